@@ -1,8 +1,264 @@
-from django.contrib import admin
+"""Admin for tables with millions of rows.
 
-# Register your models here.
-from .models import Blog, Post, Comment
+The changelists never count a whole table: unfiltered they take their count from SiteStatistics, filtered they count
+at most COUNT_LIMIT rows. Foreign keys are edited through autocomplete or raw id widgets instead of a <select> of every
+user or post, related objects are joined with list_select_related, and the list filters are on indexed columns.
 
-admin.site.register(Blog)
-admin.site.register(Post)
-admin.site.register(Comment)
\ No newline at end of file
+Deleting selected posts or comments runs a few set based statements per batch of ids rather than loading every row
+and sending its signals, and brings the denormalized counters up to date in bulk afterwards. Deleting a comment
+deletes the replies under it too. Every selected object still gets its deletion LogEntry, inserted in bulk.
+"""
+import itertools
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.admin.options import get_content_type_for_model
+from django.contrib.admin.utils import model_ngettext
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import router, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from blog.cache import bump_version, bump_versions
+from blog.models import Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics
+
+COUNT_LIMIT = 10000
+BATCH_SIZE = 500  # ids per statement, below SQLite's limit on query parameters
+FILTER_CHOICES = 20
+
+
+def batches(pks):
+    for i in range(0, len(pks), BATCH_SIZE):
+        yield pks[i:i + BATCH_SIZE]
+
+
+def with_replies(pks, using=None):
+    """The comment ids `pks` and the ids of all the replies under them, found one level of the threads at a time."""
+    found, level = set(pks), list(pks)
+    while level:
+        replies = []
+        for batch in batches(level):
+            replies += Comment.objects.using(using).filter(parent__in=batch).values_list('pk', flat=True)
+        level = [pk for pk in replies if pk not in found]
+        found.update(level)
+    return sorted(found)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that reads the count of an unfiltered changelist from the SiteStatistics counter
+    `statistics_field` and counts at most COUNT_LIMIT rows of a filtered one, linking that many rows' worth of pages."""
+
+    def __init__(self, *args, statistics_field=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statistics_field = statistics_field
+
+    @cached_property
+    def count(self):
+        if self.statistics_field and not self.object_list.query.where:
+            return getattr(SiteStatistics.load(), self.statistics_field)
+        return self.object_list.order_by()[:COUNT_LIMIT].count()
+
+
+class DeferringChangeList(ChangeList):
+    """ChangeList that leaves the admin's `list_deferred` columns (large text) out of the rows it lists."""
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(*self.model_admin.list_deferred)
+
+
+class BlogFilter(admin.SimpleListFilter):
+    """Filter by blog through an index starting with the blog. Offers the newest blogs and the one selected rather
+    than every blog, others are reached from the blog changelist's links."""
+    title = 'blog'
+    parameter_name = 'blog'
+    lookup = 'blog'
+
+    def lookups(self, request, model_admin):
+        choices = dict(Blog.objects.order_by('-id').values_list('id', 'name')[:FILTER_CHOICES])
+        if self.value() and self.value().isdigit() and int(self.value()) not in choices:
+            choices.update(Blog.objects.filter(pk=self.value()).values_list('id', 'name'))
+        return [(str(pk), name) for pk, name in choices.items()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+
+class CommentBlogFilter(BlogFilter):
+    lookup = 'post__blog'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Base for the admins of the big tables: estimated counts, no second count of the unfiltered table, and a delete
+    action that shows how many rows go instead of every one of them and deletes through delete_queryset()."""
+    statistics_field = None
+    list_deferred = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    actions = ['delete_selected']
+    # Columns the model's __str__() reads, the deletion log is written without loading whole rows
+    str_fields = ()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, statistics_field=self.statistics_field)
+
+    def get_changelist(self, request, **kwargs):
+        return DeferringChangeList
+
+    def get_deleted_counts(self, queryset):
+        """{verbose name: number of rows} that deleting `queryset` removes, for the confirmation page."""
+        return {self.opts.verbose_name_plural: queryset.count()}
+
+    @admin.action(permissions=['delete'], description='Delete selected %(verbose_name_plural)s')
+    def delete_selected(self, request, queryset):
+        # Replaces the built-in action, which collects every related object for the confirmation page and then
+        # deletes and logs the selection one object at a time
+        if request.POST.get('post'):
+            with transaction.atomic(using=router.db_for_write(self.model)):
+                self.log_deletions(request, queryset)
+                deleted = self.delete_queryset(request, queryset)
+            self.message_user(request, 'Successfully deleted %d %s.' % (deleted, model_ngettext(self.opts, deleted)),
+                              messages.SUCCESS)
+            return None
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Are you sure?',
+            'objects_name': self.opts.verbose_name_plural,
+            'model_count': self.get_deleted_counts(queryset).items(),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'opts': self.opts,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'media': self.media,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/blog/delete_in_bulk_confirmation.html', context)
+
+    def log_deletions(self, request, queryset):
+        """Write the LogEntry ModelAdmin.log_deletion() would for each object of `queryset`, a batch at a time."""
+        content_type = get_content_type_for_model(self.model)
+        objects = queryset.select_related(None).order_by().only(*self.str_fields).iterator(chunk_size=BATCH_SIZE)
+        for batch in iter(lambda: list(itertools.islice(objects, BATCH_SIZE)), []):
+            LogEntry.objects.bulk_create(
+                LogEntry(user_id=request.user.pk, content_type_id=content_type.pk, object_id=str(obj.pk),
+                         object_repr=str(obj)[:200], action_flag=DELETION)
+                for obj in batch)
+
+    def delete_queryset(self, request, queryset):
+        count = queryset.count()
+        super().delete_queryset(request, queryset)
+        return count
+
+
+@admin.register(Blog)
+class BlogAdmin(LargeTableAdmin):
+    statistics_field = 'num_blogs'
+    list_display = ('name', 'user', 'posts')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    search_fields = ('name',)
+    str_fields = ('name',)
+
+    @admin.display(description='posts')
+    def posts(self, blog):
+        return format_html('<a href="{}?blog={}">posts</a>', reverse('admin:blog_post_changelist'), blog.pk)
+
+
+@admin.register(Post)
+class PostAdmin(LargeTableAdmin):
+    statistics_field = 'num_posts'
+    list_display = ('title', 'blog', 'author', 'posted_on', 'comment_count')
+    list_select_related = ('blog', 'author')
+    list_deferred = ('body', 'body_html', 'excerpt')
+    # posted_on and blog lead the (posted_on, id) and (blog, posted_on, id) indexes
+    list_filter = ('posted_on', BlogFilter)
+    autocomplete_fields = ('blog', 'author')
+    search_fields = ('=author__username',)
+    str_fields = ('title',)
+
+    def get_deleted_counts(self, queryset):
+        posts = queryset.values('pk')
+        return {
+            'posts': queryset.count(),
+            'comments': Comment.objects.filter(post__in=posts).count(),
+            'activities': Activity.objects.filter(post__in=posts).count(),
+        }
+
+    def delete_queryset(self, request, queryset):
+        """Delete the posts with their comments and activity. The counters and caches the receivers in
+        blog/signals.py would update one post at a time are brought up to date in bulk."""
+        db = router.db_for_write(Post)
+        with transaction.atomic(using=db):
+            posts = queryset.using(db).order_by()
+            pks = list(posts.values_list('pk', flat=True))
+            months = list(posts.annotate(month=TruncMonth('posted_on')).values('blog', 'month').annotate(n=Count('id')))
+            deleted = comments = 0
+            for batch in batches(pks):
+                # Comment activity carries the post too
+                Activity.objects.filter(post__in=batch).delete()
+                comments += Comment.objects.filter(post__in=batch)._raw_delete(db)
+                SiteStatistics.objects.filter(latest_post__in=batch).update(latest_post=None)
+                deleted += Post.objects.filter(pk__in=batch)._raw_delete(db)
+
+            SiteStatistics.increment('num_posts', -deleted)
+            SiteStatistics.increment('num_comments', -comments)
+            newest = Post.objects.order_by('-posted_on', '-id').values('pk')[:1]
+            SiteStatistics.objects.filter(pk=1, latest_post__isnull=True).update(latest_post=newest)
+            for row in months:
+                if row['month']:
+                    MonthlyPostCount.adjust(row['blog'], row['month'], -row['n'])
+
+            blogs = {row['blog'] for row in months}
+            transaction.on_commit(lambda: (bump_versions('post', pks), bump_versions('blog', blogs),
+                                           bump_version('posts', 'all')), using=db)
+        return deleted
+
+
+@admin.register(Comment)
+class CommentAdmin(LargeTableAdmin):
+    statistics_field = 'num_comments'
+    list_display = ('__str__', 'user', 'post', 'posted_on')
+    list_select_related = ('user', 'post')
+    list_deferred = ('post__body', 'post__body_html', 'post__excerpt')
+    list_filter = ('posted_on', CommentBlogFilter)
+    ordering = ('-posted_on', '-id')
+    raw_id_fields = ('post', 'parent')
+    autocomplete_fields = ('user',)
+    # Spam is usually found by its author
+    search_fields = ('=user__username',)
+    str_fields = ('text',)
+
+    def get_deleted_counts(self, queryset):
+        pks = with_replies(queryset.order_by().values_list('pk', flat=True))
+        return {
+            'comments': len(pks),
+            'activities': sum(Activity.objects.filter(comment__in=batch).count() for batch in batches(pks)),
+        }
+
+    def delete_queryset(self, request, queryset):
+        """Delete the comments with their replies and activity, then recount the posts they were on."""
+        db = router.db_for_write(Comment)
+        with transaction.atomic(using=db):
+            comments = queryset.using(db).order_by()
+            posts = list(comments.exclude(post=None).values_list('post', flat=True).distinct())
+            # Replies are on the same post as the comment they answer
+            pks = with_replies(comments.values_list('pk', flat=True), db)
+            deleted = 0
+            # Deepest first, so no batch leaves a reply pointing at a deleted comment
+            for batch in batches(pks[::-1]):
+                Activity.objects.filter(comment__in=batch).delete()
+                deleted += Comment.objects.filter(pk__in=batch)._raw_delete(db)
+            for batch in batches(posts):
+                Post.recount_comments(pk__in=batch)
+            SiteStatistics.increment('num_comments', -deleted)
+            transaction.on_commit(lambda: bump_versions('post', posts), using=db)
+        return deleted
@@ -0,0 +1,143 @@
+"""Async versions of the busiest read views, routed in place of the sync ones when settings.ASYNC_VIEWS is on
+(miniblog/asgi.py turns it on).
+
+Django 3.x has no async ORM API, so every database call goes through run_query(), which runs it on a worker
+thread with its own connection. Queries that don't depend on each other, such as a post and its first page of
+comments, are started together with asyncio.gather. Template rendering stays synchronous and is run on a
+thread by the ASGI handler.
+"""
+import asyncio
+import functools
+from calendar import timegm
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.generic import View
+
+from blog import views
+from blog.cache import acached_fragment, page_validators, version_key
+from blog.models import SiteStatistics
+
+
+def run_query(fn, *args, **kwargs):
+    """Run a blocking ORM call on its own worker thread so several can be awaited concurrently.
+    The thread's connection is then released according to CONN_MAX_AGE, as at the end of a sync request."""
+    def call():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+def resolve_user(request):
+    """Load the session and user now, on a worker thread, rather than lazily while the template renders."""
+    return request.user.is_authenticated
+
+
+class AsyncViewMixin:
+    """Django 3.x class-based views can't have async handlers, so wrap the view function in a coroutine."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        functools.update_wrapper(async_view, view)
+        return async_view
+
+
+class VersionedConditionMixin:
+    """Async counterpart of the versioned_condition() decorator on the sync views."""
+
+    def get_version_keys(self):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        # Bypass the sync versioned_condition() decorator on the parent's dispatch, get() checks asynchronously
+        return View.dispatch(self, request, *args, **kwargs)
+
+    async def dispatch_conditional(self, handler):
+        etag, last_modified = await run_query(page_validators, self.request, self.get_version_keys())
+        etag = quote_etag(etag) if etag else None
+        last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await handler()
+        if self.request.method in ('GET', 'HEAD'):
+            if last_modified and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+            if etag and not response.has_header('ETag'):
+                response['ETag'] = etag
+        return response
+
+
+class IndexView(AsyncViewMixin, views.IndexView):
+
+    async def get(self, request, *args, **kwargs):
+        self.statistics, _ = await asyncio.gather(run_query(SiteStatistics.load), run_query(resolve_user, request))
+        return self.render_to_response(self.get_context_data(**kwargs))
+
+    def get_statistics(self):
+        return self.statistics
+
+
+class PostListView(AsyncViewMixin, VersionedConditionMixin, views.PostListView):
+
+    def get_version_keys(self):
+        return [version_key('posts', 'all')]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.dispatch_conditional(self.render_page)
+
+    async def render_page(self):
+        self.object_list = self.get_queryset()
+        context = await run_query(self.get_context_data)
+        return self.render_to_response(context)
+
+
+class BlogDetailView(AsyncViewMixin, VersionedConditionMixin, views.BlogDetailView):
+
+    def get_version_keys(self):
+        return [version_key('blog', self.kwargs['blog_pk'])]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.dispatch_conditional(self.render_page)
+
+    async def render_page(self):
+        (fragment, hit), self.archive_sidebar = await asyncio.gather(
+            acached_fragment('blog-detail', self.get_version_keys(), self.arender_fragment,
+                             variant=self.request.GET.get(self.cursor_kwarg, '')),
+            run_query(views.archive_sidebar, self.kwargs['blog_pk']),
+        )
+        return self.fragment_response(fragment, hit)
+
+    async def arender_fragment(self):
+        # The blog and its page of posts are both looked up by blog_pk, so they can load in parallel
+        self.object, self.post_page = await asyncio.gather(run_query(self.get_object), run_query(self.get_post_page))
+        return await sync_to_async(self.build_fragment, thread_sensitive=False)()
+
+
+class PostDetailView(AsyncViewMixin, VersionedConditionMixin, views.PostDetailView):
+
+    def get_version_keys(self):
+        return [version_key('post', self.kwargs['post_pk'])]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.dispatch_conditional(self.render_page)
+
+    async def render_page(self):
+        fragment, hit = await acached_fragment('post-detail', self.get_version_keys(), self.arender_fragment,
+                                               variant=self.request.GET.get(self.cursor_kwarg, ''))
+        return self.fragment_response(fragment, hit)
+
+    async def arender_fragment(self):
+        self.object, self.comment_page = await asyncio.gather(run_query(self.get_object), run_query(self.get_comment_page))
+        return await sync_to_async(self.build_fragment, thread_sensitive=False)()
@@ -0,0 +1,85 @@
+"""Cached user resolution for AuthenticationMiddleware.
+
+With the cached_db session engine the session is read from the cache, and CachedModelBackend (the only entry of
+settings.AUTHENTICATION_BACKENDS) resolves the session's user id through `user_cache`, a process local LRU of User
+objects. A logged-in request therefore runs no session or user query in the steady state.
+
+Entries expire after USER_CACHE_TTL seconds and are only used while the user's version counter (blog/cache.py) is
+unchanged. The receivers in blog/signals.py bump it when the user is saved (which includes password changes and
+the last_login update on login), deleted or logged out. When the cache is shared by every process (redis) each
+process sees the bump and drops its copy, so a changed password ends the other sessions on the next request. A
+locmem or file cache is not shared, bumps don't reach the other processes, and settings.py only enables the
+cached sessions and this backend with redis.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from blog.cache import get_versions, version_key
+
+
+class UserCache:
+    """Thread safe LRU of User objects by primary key, each valid for `ttl` seconds and until its version changes."""
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, pk, load):
+        """The user with primary key `pk`, calling `load(pk)` on a miss. Returns a copy, since request code mutates
+        request.user (backend, permission caches)."""
+        version, = get_versions(version_key('user', pk))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(pk)
+            if entry is not None and entry[1] > now and entry[2] == version:
+                self._users.move_to_end(pk)
+                self._stats['hits'] += 1
+                return copy.deepcopy(entry[0])
+            self._stats['misses'] += 1
+        user = load(pk)
+        if user is None:
+            return None
+        with self._lock:
+            self._users[pk] = (copy.deepcopy(user), now + self.ttl, version)
+            self._users.move_to_end(pk)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+                self._stats['evictions'] += 1
+        return user
+
+    def invalidate(self, pk):
+        """Drop this process' copy, other processes notice the version bump."""
+        with self._lock:
+            self._users.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._users), capacity=self.max_size)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+user_cache = UserCache(
+    max_size=getattr(settings, 'USER_CACHE_SIZE', 1000),
+    ttl=getattr(settings, 'USER_CACHE_TTL', 300),
+)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that resolves session users through `user_cache`. Authentication itself is unchanged."""
+
+    def get_user(self, user_id):
+        return user_cache.get(user_id, super().get_user)
@@ -0,0 +1,185 @@
+"""Versioned fragment caching.
+
+Every cacheable object has a version counter stored in the cache under `version:<kind>:<pk>`. Fragment keys
+embed the versions they were rendered from, so bumping a version (done by the receivers in blog/signals.py)
+makes exactly the dependent fragments unreachable and they simply expire. Nothing is ever deleted by pattern.
+
+Versions are nanosecond timestamps: missing versions start from the current time and bumps move them to the
+current time (or one past the old value if the clock is behind). A version evicted from the cache therefore comes
+back larger than any value it had before and can never resurrect a stale fragment, and a version doubles as the
+time of the last change for Last-Modified headers.
+
+All of this assumes every worker process shares the cache. With settings.CACHE_SHARED off (the per-process locmem
+cache) a bump would only reach one process, so fragments are rendered on every request and pages get no validators.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.views.decorators.http import condition
+
+from blog.models import Blog
+from blog.routers import pin_to_primary
+
+
+def cache_shared():
+    return getattr(settings, 'CACHE_SHARED', True)
+
+
+def version_key(kind, pk):
+    return 'version:%s:%s' % (kind, pk)
+
+
+def get_versions(*keys):
+    """Fetch several version counters in one round trip, initialising any that are missing."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(kind, pk):
+    key = version_key(kind, pk)
+    current = cache.get(key) or 0
+    cache.set(key, max(current + 1, time.time_ns()), None)
+
+
+def bump_versions(kind, pks):
+    """bump_version() for many objects in two round trips, for writes that change rows in bulk."""
+    keys = [version_key(kind, pk) for pk in pks if pk is not None]
+    current = cache.get_many(keys)
+    now = time.time_ns()
+    cache.set_many({key: max(current.get(key, 0) + 1, now) for key in keys}, None)
+
+
+class CacheStats:
+    """Thread safe hit/miss counters per fragment name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def add(self, name, hit):
+        with self._lock:
+            self._stats[name]['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+fragment_stats = CacheStats()
+
+
+def fragment_key(name, versions, variant=''):
+    """Cache key of fragment `name` rendered from the current values of the given version keys.
+    `variant` distinguishes renderings of the same objects, e.g. different pages of a listing."""
+    variant = hashlib.md5(variant.encode()).hexdigest() if variant else ''
+    versions = ','.join('%s=%s' % pair for pair in zip(versions, get_versions(*versions)))
+    return 'fragment:%s:%s:%s' % (name, versions, variant)
+
+
+def cached_fragment(name, versions, render, variant=''):
+    """Return the cached value of fragment `name` for the given version keys, calling `render()` on a miss.
+    Returns a (value, hit) tuple."""
+    if not cache_shared():
+        fragment_stats.add(name, False)
+        return render(), False
+    key = fragment_key(name, versions, variant)
+    value = cache.get(key)
+    hit = value is not None
+    if not hit:
+        value = render()
+        cache.set(key, value, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60))
+    fragment_stats.add(name, hit)
+    return value, hit
+
+
+async def acached_fragment(name, versions, arender, variant=''):
+    """Async cached_fragment(), `arender` is a coroutine function. Cache calls run on worker threads since the
+    file and redis backends block."""
+    if not cache_shared():
+        fragment_stats.add(name, False)
+        return await arender(), False
+    key = await sync_to_async(fragment_key, thread_sensitive=False)(name, versions, variant)
+    value = await sync_to_async(cache.get, thread_sensitive=False)(key)
+    hit = value is not None
+    if not hit:
+        value = await arender()
+        timeout = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+        await sync_to_async(cache.set, thread_sensitive=False)(key, value, timeout)
+    fragment_stats.add(name, hit)
+    return value, hit
+
+
+def user_blog_key(user_id):
+    return 'user-blog:%s' % user_id
+
+
+def get_user_blog(user_id):
+    """The id and name of the user's blog as a dict, or None if they have no blog.
+    The Blog receivers in blog/signals.py delete the entry when the user's blog changes, the timeout bounds how long
+    a process that missed the delete keeps a stale entry."""
+    key = user_blog_key(user_id)
+    blog = cache.get(key)
+    if blog is None:
+        blog = Blog.objects.filter(user=user_id).order_by('id').values('id', 'name').first() or {}
+        # Cache "no blog" as {} so users without a blog don't query on every page either, but only where creating a
+        # blog deletes it for every process. Otherwise the new blogger would be sent to blog-create until it expired.
+        if blog or cache_shared():
+            cache.set(key, blog, getattr(settings, 'USER_BLOG_CACHE_TIMEOUT', 60 * 5))
+    return blog or None
+
+
+def page_validators(request, keys):
+    """ETag and Last-Modified of a page whose content depends only on the version counters `keys` and the viewer.
+    Memoised on the request since the condition decorator asks for each validator separately. (None, None), no
+    conditional GET, unless the cache is shared."""
+    if not cache_shared():
+        return None, None
+    if not hasattr(request, '_page_validators'):
+        versions = get_versions(*keys)
+        if max(versions) > time.time_ns() - getattr(settings, 'REPLICA_MAX_LAG', 5) * 10 ** 9:
+            # Changed so recently that a replica may not have it yet, don't let this page be built from a replica
+            pin_to_primary()
+        user = request.user
+        if user.is_authenticated:
+            # The sidebar shows the user and their blog, so each user gets their own ETag. Pages for logged in users
+            # carry the CSRF token in their forms, which login rotates along with the session key: a page cached in
+            # an earlier session would post a stale token and be refused.
+            blog = get_user_blog(user.pk)
+            audience = 'user:%s:%s:%s' % (user.pk, blog['id'] if blog else '', request.session.session_key)
+        else:
+            audience = 'anonymous'
+        raw = '%s|%s|%s|%s' % (request.path, request.GET.urlencode(), audience, versions)
+        etag = hashlib.md5(raw.encode()).hexdigest()
+        # Last-Modified can't express per-user content, so only anonymous pages get one
+        last_modified = None
+        if not user.is_authenticated:
+            last_modified = datetime.fromtimestamp(max(versions) / 1e9, timezone.utc)
+        request._page_validators = etag, last_modified
+    return request._page_validators
+
+
+def versioned_condition(get_keys):
+    """View decorator adding ETag and Last-Modified validators derived from version counters alone, so a matching
+    If-None-Match / If-Modified-Since request gets a 304 without a database query or template rendering.
+    `get_keys(**view_kwargs)` returns the version keys the page content depends on."""
+    def validators(request, kwargs):
+        return page_validators(request, get_keys(**kwargs))
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: validators(request, kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: validators(request, kwargs)[1],
+    )
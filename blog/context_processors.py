@@ -0,0 +1,11 @@
+from blog.cache import get_user_blog
+
+
+def navigation(request):
+    """Adds `my_blog` (id and name of the logged-in user's blog, or None) for the sidebar in base.html.
+    It is a callable so the lookup only happens on pages that use it, and it is served from the cache."""
+    def my_blog():
+        if request.user.is_authenticated:
+            return get_user_blog(request.user.pk)
+        return None
+    return {'my_blog': my_blog}
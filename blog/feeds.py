@@ -0,0 +1,113 @@
+"""RSS and Atom feeds of the latest posts, site wide and per blog.
+
+Each feed is a single indexed query for the newest `item_count` posts. The generated XML is kept in the
+fragment cache under the same version counters as the HTML pages, so it is only rebuilt after a post or
+blog changes, and validators from versioned_condition() let pollers revalidate with a 304.
+"""
+from datetime import datetime, time, timezone
+
+from django.contrib.syndication.views import Feed
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from blog.cache import cached_fragment, version_key, versioned_condition
+from blog.models import Blog, Post
+
+
+def as_datetime(day):
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+class LatestPostsFeed(Feed):
+    title = 'miniblog - recent posts'
+    description = 'The newest posts across every blog on miniblog.'
+    item_count = 20
+
+    def link(self):
+        return reverse('post-list')
+
+    def get_queryset(self, obj):
+        return Post.objects.all()
+
+    def items(self, obj):
+        return self.get_queryset(obj).select_related('author').only(
+            *Post.LIST_FIELDS, 'last_modified', 'excerpt', 'author__username')[:self.item_count]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.excerpt
+
+    def item_link(self, item):
+        return reverse('post-detail', kwargs={'blog_pk': item.blog_id, 'post_pk': item.pk})
+
+    def item_author_name(self, item):
+        return item.author.username if item.author else None
+
+    def item_pubdate(self, item):
+        return as_datetime(item.posted_on)
+
+    def item_updateddate(self, item):
+        return as_datetime(item.last_modified)
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class BlogPostsFeed(LatestPostsFeed):
+
+    def get_object(self, request, blog_pk):
+        return get_object_or_404(Blog, pk=blog_pk)
+
+    def title(self, obj):
+        return 'miniblog - %s' % obj.name
+
+    def description(self, obj):
+        return 'The newest posts on %s.' % obj.name
+
+    def link(self, obj):
+        return reverse('blog-detail', kwargs={'blog_pk': obj.pk})
+
+    def get_queryset(self, obj):
+        return obj.post_set.all()
+
+
+class BlogPostsAtomFeed(BlogPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+def cached_feed(name, feed, get_keys):
+    """Wrap a Feed so its XML is cached under the version keys returned by get_keys(**view_kwargs)."""
+    @versioned_condition(get_keys)
+    def view(request, **kwargs):
+        def render():
+            response = feed(request, **kwargs)
+            return {'content': response.content, 'content_type': response['Content-Type']}
+
+        fragment, hit = cached_fragment(name, get_keys(**kwargs), render)
+        response = HttpResponse(fragment['content'], content_type=fragment['content_type'])
+        response['X-Fragment-Cache'] = 'hit' if hit else 'miss'
+        return response
+    return view
+
+
+def site_keys(**kwargs):
+    return [version_key('posts', 'all')]
+
+
+def blog_keys(blog_pk, **kwargs):
+    return [version_key('blog', blog_pk)]
+
+
+latest_posts_rss = cached_feed('feed-rss', LatestPostsFeed(), site_keys)
+latest_posts_atom = cached_feed('feed-atom', LatestPostsAtomFeed(), site_keys)
+blog_posts_rss = cached_feed('blog-feed-rss', BlogPostsFeed(), blog_keys)
+blog_posts_atom = cached_feed('blog-feed-atom', BlogPostsAtomFeed(), blog_keys)
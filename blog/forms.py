@@ -17,7 +17,14 @@ class CommentForm(forms.ModelForm):
 
     class Meta:
         model = Comment
-        fields = ['text', 'user', 'post']
+        fields = ['text', 'user', 'post', 'parent']
         help_texts = {
             'text': '',
-        }
\ No newline at end of file
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        parent, post = cleaned_data.get('parent'), cleaned_data.get('post')
+        if parent is not None and post is not None and parent.post_id != post.pk:
+            raise forms.ValidationError('Replies must be on the same post as the comment they answer.')
+        return cleaned_data
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Password hashing on a bounded worker pool.
+
+PBKDF2 is by far the most CPU expensive thing a request can do. PooledPBKDF2PasswordHasher (first in
+settings.PASSWORD_HASHERS) runs every hash on `hashing_pool`: registration, login, password changes and the dummy
+hash ModelBackend computes for unknown usernames. At most PASSWORD_HASHING_WORKERS hashes run at once, so a login or
+sign-up storm can't take every core away from page rendering. At most PASSWORD_HASHING_QUEUE hashes may be running
+or waiting; beyond that, or when a hash waits longer than PASSWORD_HASHING_TIMEOUT, HashingBusy is raised and
+HashingBusyMiddleware answers 503 with Retry-After instead of queueing without limit.
+
+hashlib releases the GIL while it hashes, so worker threads hash in parallel with the request threads.
+"""
+import concurrent.futures
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingPool:
+    """Thread pool with a limit on running plus waiting jobs. With 0 workers jobs run inline on the caller's thread."""
+
+    def __init__(self, workers=2, queue_size=32, timeout=10.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'hashed': 0, 'rejected': 0, 'timeouts': 0}
+
+    @property
+    def executor(self):
+        # Created on first use, so processes forked by the application server each start their own threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='hashing')
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self.workers:
+            self._count('hashed')
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HashingBusy
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            result = future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self._count('timeouts')
+            raise HashingBusy
+        self._count('hashed')
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self.queue_size - self._slots._value
+        stats['workers'] = self.workers
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+hashing_pool = HashingPool(
+    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 2),
+    queue_size=getattr(settings, 'PASSWORD_HASHING_QUEUE', 32),
+    timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 10.0),
+)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2PasswordHasher computing hashes on `hashing_pool`. Same algorithm name, so existing hashes verify.
+    verify() and harden_runtime() hash through encode(), so wrapping encode() covers them too."""
+
+    def encode(self, password, salt, iterations=None):
+        return hashing_pool.run(super().encode, password, salt, iterations)
@@ -0,0 +1,167 @@
+"""Buffered comment ingestion, enabled with settings.COMMENT_INGESTION = 'buffered'.
+
+CommentCreateView hands validated comments to `comment_buffer` instead of saving them one by one. A single flusher
+thread drains the buffer and writes everything queued so far in one transaction: one bulk insert, one update setting
+the new comments' thread paths, one counter update per post, one site statistics update, and the cache version bumps
+that the receivers in blog/signals.py would otherwise do per comment. Each request waits for the transaction
+containing its comment (group commit), so the redirect still shows the new comment, while a burst of comments on a
+viral post costs a few transactions instead of one write lock per comment. The buffer is bounded: once
+COMMENT_BUFFER_SIZE comments are waiting, submit() raises BufferFull and the view answers 503 with Retry-After
+instead of queueing without limit.
+
+Buffered ingestion is for WSGI servers, whose worker threads can afford to wait. Under ASGI the view saves comments
+one by one whatever the setting: Django runs sync views on a single shared thread there, and a request waiting for
+its batch would stall every other sync view meanwhile.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from blog.models import Activity, Comment, Post, SiteStatistics, path_segment
+from blog.signals import bump_on_commit
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    pass
+
+
+def save_comments(comments):
+    """Insert new comments in bulk and update everything the post_save receivers keep in sync with them, the
+    activity timeline included. Must be called inside a transaction."""
+    ancestors = [comment.ancestors_path() for comment in comments]
+    Comment.objects.bulk_create(comments)  # pre_save fills in posted_on and last_modified on the instances
+    if comments and comments[0].pk is None:
+        # SQLite can't return the ids of a bulk insert. The insert holds the database's write lock until commit, so
+        # the new rows are the last ones, in order
+        pks = Comment.objects.order_by('-pk').values_list('pk', flat=True)[:len(comments)]
+        for comment, pk in zip(comments, sorted(pks)):
+            comment.pk = pk
+    for comment, path in zip(comments, ancestors):
+        comment.path = path + path_segment(comment.pk)
+    Comment.objects.bulk_update(comments, ['path'])
+    Activity.objects.bulk_create(Activity.for_comment(c, c.post.blog_id if c.post_id else None) for c in comments)
+    by_post = defaultdict(list)
+    for comment in comments:
+        by_post[comment.post_id].append(comment)
+    by_post.pop(None, None)
+    for post_id, group in by_post.items():
+        Post.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + len(group),
+            last_comment_at=max(c.last_modified for c in group),
+        )
+        bump_on_commit('post', post_id)
+    SiteStatistics.increment('num_comments', len(comments))
+
+
+class PendingComment:
+
+    def __init__(self, comment):
+        self.comment = comment
+        self.committed = threading.Event()
+        self.error = None
+
+
+class CommentBuffer:
+    """Bounded queue of comments waiting to be written, with the thread that writes them in batches."""
+
+    def __init__(self, max_size=1000, batch_size=200, linger=0.005):
+        self.queue = queue.Queue(max_size)
+        self.batch_size = batch_size
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'rejected': 0, 'batches': 0, 'largest_batch': 0,
+                       'flush_seconds': 0.0}
+
+    def submit(self, comment, timeout=2.0):
+        """Queue `comment` and wait up to `timeout` seconds for it to be committed.
+        Returns whether it was committed in time, raises BufferFull if the buffer is at capacity."""
+        pending = PendingComment(comment)
+        try:
+            self.queue.put_nowait(pending)
+        except queue.Full:
+            self._count('rejected')
+            raise BufferFull
+        self._count('submitted')
+        self._ensure_flusher()
+        if not pending.committed.wait(timeout):
+            return False
+        if pending.error is not None:
+            raise pending.error
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['depth'] = self.queue.qsize()
+        stats['capacity'] = self.queue.maxsize
+        stats['mean_batch'] = stats['committed'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='comment-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Give concurrent requests a moment to join the batch, then take whatever else is waiting
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                save_comments([pending.comment for pending in batch])
+        except Exception:
+            # One bad row, e.g. a post deleted since the form was validated, must not fail its neighbours
+            logger.exception('Batch of %d comments failed, retrying one by one', len(batch))
+            self.flush_one_by_one(batch)
+        else:
+            for pending in batch:
+                pending.committed.set()
+            self._count('committed', len(batch))
+        finally:
+            close_old_connections()
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+            self._stats['flush_seconds'] += time.perf_counter() - start
+
+    def flush_one_by_one(self, batch):
+        for pending in batch:
+            try:
+                with transaction.atomic():
+                    save_comments([pending.comment])
+                self._count('committed')
+            except Exception as e:
+                pending.error = e
+                self._count('failed')
+            pending.committed.set()
+
+
+comment_buffer = CommentBuffer(
+    max_size=getattr(settings, 'COMMENT_BUFFER_SIZE', 1000),
+    batch_size=getattr(settings, 'COMMENT_BATCH_SIZE', 200),
+    linger=getattr(settings, 'COMMENT_BATCH_LINGER', 0.005),
+)
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Post
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Load the read views through the WSGI and ASGI handlers in-process at high concurrency and compare '
+            'throughput and tail latency. Each mode runs in its own subprocess since ASYNC_VIEWS is read at startup.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode.')
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, may be repeated. Defaults to the index, post list and newest post.')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], help='Run a single mode and print JSON (used internally).')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        if options['mode']:
+            result = self.run_mode(options['mode'], paths, options['requests'], options['concurrency'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        for mode in ('wsgi', 'asgi'):
+            env = dict(os.environ, MINIBLOG_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+            command = [sys.executable, sys.argv[0], 'bench_asgi', '--mode', mode,
+                       '--requests', str(options['requests']), '--concurrency', str(options['concurrency'])]
+            for path in paths:
+                command += ['--path', path]
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+            if completed.returncode:
+                raise CommandError(completed.stderr)
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            self.stdout.write('%s: %7.1f req/s  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  errors %d' % (
+                mode, result['rps'], result['p50'], result['p95'], result['p99'], result['errors']))
+
+    def default_paths(self):
+        paths = ['/', '/posts/']
+        post = Post.objects.exclude(blog=None).only('id', 'blog_id').first()
+        if post:
+            paths.append('/blog/%d/post/%d' % (post.blog_id, post.pk))
+            paths.append('/blog/%d' % post.blog_id)
+        return paths
+
+    def run_mode(self, mode, paths, count, concurrency):
+        if mode == 'asgi' and not settings.ASYNC_VIEWS:
+            raise CommandError('ASGI mode needs MINIBLOG_ASYNC_VIEWS=1.')
+        run = self.run_asgi if mode == 'asgi' else self.run_wsgi
+        run(paths, len(paths) * 2, concurrency)  # warm up caches and connections
+        start = time.perf_counter()
+        latencies, errors = run(paths, count, concurrency)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'rps': count / elapsed,
+            'p50': statistics.median(latencies) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'errors': errors,
+        }
+
+    def run_wsgi(self, paths, count, concurrency):
+        from django.core.handlers.wsgi import WSGIHandler
+        application = WSGIHandler()
+        latencies, errors, lock = [], [0], threading.Lock()
+
+        def one(i):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': paths[i % len(paths)], 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.url_scheme': 'http', 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            }
+            status = []
+            start = time.perf_counter()
+            body = application(environ, lambda s, headers: status.append(s))
+            b''.join(body)
+            body.close()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                if not status[0].startswith('200'):
+                    errors[0] += 1
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(count)))
+        return latencies, errors[0]
+
+    def run_asgi(self, paths, count, concurrency):
+        from django.core.handlers.asgi import ASGIHandler
+        application = ASGIHandler()
+        latencies, errors = [], [0]
+
+        async def one(i, semaphore):
+            async with semaphore:
+                path = paths[i % len(paths)]
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                    'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                }
+                messages = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    messages.append(message)
+
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                latencies.append(time.perf_counter() - start)
+                if messages[0]['status'] != 200:
+                    errors[0] += 1
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*(one(i, semaphore) for i in range(count)))
+
+        asyncio.run(main())
+        return latencies, errors[0]
@@ -0,0 +1,80 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from blog.ingest import comment_buffer
+from blog.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = ('Post comments to the most commented post from many threads at once, with synchronous and then buffered '
+            'ingestion, and compare throughput, latency and errors. The comments are deleted again afterwards. '
+            'Writes to the configured database, run it against a copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--comments', type=int, default=25, help='Comments posted by each thread.')
+
+    def handle(self, *args, **options):
+        post = Post.objects.exclude(blog=None).order_by('-comment_count', 'id').first()
+        if post is None:
+            raise CommandError('The database has no posts, run seed_data first.')
+        user_id = post.author_id
+        marker = 'bench-comments-%s' % uuid.uuid4().hex
+        try:
+            for mode in ('sync', 'buffered'):
+                with override_settings(COMMENT_INGESTION=mode):
+                    self.report(mode, self.run(post, user_id, marker, options))
+        finally:
+            Comment.objects.filter(text__startswith=marker).delete()
+
+    def run(self, post, user_id, marker, options):
+        url = reverse('comment-create')
+        host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+        lock = threading.Lock()
+        latencies, statuses = [], {}
+        before = comment_buffer.stats()
+
+        def worker(n):
+            client = Client(HTTP_HOST=host)
+            for i in range(options['comments']):
+                start = time.perf_counter()
+                response = client.post(url, {'text': '%s %d-%d' % (marker, n, i), 'post': post.pk, 'user': user_id})
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        after = comment_buffer.stats()
+        latencies.sort()
+        return {
+            'rate': len(latencies) / elapsed,
+            'p50': statistics.median(latencies) * 1000,
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+            'statuses': statuses,
+            'batches': after['batches'] - before['batches'],
+            'committed': after['committed'] - before['committed'],
+        }
+
+    def report(self, mode, result):
+        batches = ''
+        if result['batches']:
+            batches = ' | %d batches, %.1f comments per batch' % (result['batches'], result['committed'] / result['batches'])
+        self.stdout.write('%-8s %7.1f comments/s  p50 %7.2fms  p99 %8.2fms  responses %s%s' % (
+            mode, result['rate'], result['p50'], result['p99'],
+            ', '.join('%s x%d' % item for item in sorted(result['statuses'].items())), batches))
@@ -0,0 +1,92 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from blog import hashing
+from blog.hashing import HashingPool
+
+
+class Command(BaseCommand):
+    help = ('Log in from many threads at once while other threads load pages, first hashing on the request threads and '
+            'then on the bounded hashing pool, and compare logins per second, login latency and the latency of the '
+            'page loads. A user is created for the run and deleted afterwards. Writes sessions to the configured '
+            'database, run it against a copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=16, help='Threads logging in.')
+        parser.add_argument('--readers', type=int, default=4, help='Threads loading pages.')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--url', default='post-list', help='URL name of the page the readers load.')
+
+    def handle(self, *args, **options):
+        username, password = 'bench-hashing-%s' % uuid.uuid4().hex[:8], uuid.uuid4().hex
+        user = User.objects.create_user(username, password=password)
+        modes = {
+            'inline': HashingPool(workers=0),
+            'pooled': HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_QUEUE,
+                                  settings.PASSWORD_HASHING_TIMEOUT),
+        }
+        default_pool = hashing.hashing_pool
+        try:
+            for mode, pool in modes.items():
+                hashing.hashing_pool = pool
+                self.report(mode, self.run(username, password, options), pool.stats())
+        finally:
+            hashing.hashing_pool = default_pool
+            user.delete()
+
+    def run(self, username, password, options):
+        host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+        login_url, page_url = reverse('login'), reverse(options['url'])
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        result = {'logins': [], 'pages': [], 'statuses': {}}
+
+        def worker(kind, request):
+            client = Client(HTTP_HOST=host)
+            latencies, statuses = [], {}
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                response = request(client)
+                latencies.append(time.perf_counter() - start)
+                if kind == 'logins':
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            connection.close()
+            with lock:
+                result[kind].extend(latencies)
+                for status, n in statuses.items():
+                    result['statuses'][status] = result['statuses'].get(status, 0) + n
+
+        log_in = lambda client: client.post(login_url, {'username': username, 'password': password})
+        load_page = lambda client: client.get(page_url)
+        threads = [threading.Thread(target=worker, args=('logins', log_in)) for _ in range(options['logins'])]
+        threads += [threading.Thread(target=worker, args=('pages', load_page)) for _ in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['seconds'] = options['seconds']
+        return result
+
+    def report(self, mode, result, pool):
+        logins, pages = sorted(result['logins']) or [0], sorted(result['pages']) or [0]
+        # Only 302s are successful logins, 503s were turned away by the pool
+        succeeded = result['statuses'].get(302, 0)
+        self.stdout.write('%-6s logins %6.1f/s  p50 %7.1fms  p99 %7.1fms | pages %6.1f/s  p50 %6.1fms  p99 %7.1fms | '
+                          'responses %s, rejected by pool %d' % (
+                              mode, succeeded / result['seconds'], statistics.median(logins) * 1000,
+                              self.percentile(logins, 0.99) * 1000, len(result['pages']) / result['seconds'],
+                              statistics.median(pages) * 1000, self.percentile(pages, 0.99) * 1000,
+                              ', '.join('%s x%d' % item for item in sorted(result['statuses'].items())),
+                              pool['rejected'] + pool['timeouts']))
+
+    def percentile(self, values, fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,67 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from blog.models import Blog, Post
+from blog.search import search_posts
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare ranked FTS5 search against a naive, unranked icontains scan on a seeded corpus. '
+            'The corpus is inserted inside a transaction that is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50000, help='Number of posts to seed.')
+        parser.add_argument('--words', type=int, default=200, help='Words per post body.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = ['%s%d' % (rng.choice('bcdfghklmnprstvz'), i) for i in range(20000)]
+        try:
+            with transaction.atomic():
+                self.seed(rng, vocabulary, options['posts'], options['words'])
+                # Zipf-like corpus: low indexes are common words, high indexes are rare ones
+                for label, word in [('common', vocabulary[1]), ('medium', vocabulary[200]), ('rare', vocabulary[15000])]:
+                    fts = self.time(lambda: list(search_posts(word)), options['repeat'])
+                    naive = self.time(lambda: list(
+                        Post.objects.filter(Q(title__icontains=word) | Q(body__icontains=word))
+                        .order_by('-posted_on', '-id')[:20]), options['repeat'])
+                    self.stdout.write('%-6s %-8s fts5 p50 %8.2fms p95 %8.2fms | icontains p50 %8.2fms p95 %8.2fms | %.1fx' % (
+                        label, word, fts[0], fts[1], naive[0], naive[1], naive[0] / max(fts[0], 1e-6)))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rng, vocabulary, count, words):
+        user = User.objects.create(username='bench-search-%d' % rng.randrange(10 ** 9))
+        blog = Blog.objects.create(name='search benchmark', user=user)
+        cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+        start = time.perf_counter()
+        for offset in range(0, count, 1000):
+            Post.objects.bulk_create(
+                Post(title=' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=6)),
+                     body=' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=words)),
+                     blog=blog, author=user)
+                for _ in range(min(1000, count - offset)))
+        self.stdout.write('Seeded %d posts in %.1fs' % (count, time.perf_counter() - start))
+
+    def time(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0]
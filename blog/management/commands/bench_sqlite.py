@@ -0,0 +1,105 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+
+from blog.models import Post, Comment
+
+MODES = {
+    # What settings.py used to configure: default journaling, a connection per request
+    'stock': {'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 0, 'OPTIONS': {}},
+    # Whatever settings.DATABASES['default'] configures now
+    'tuned': {},
+}
+
+
+class Command(BaseCommand):
+    help = ('Hammer copies of the database with concurrent page reads and comment writes, once with the stock SQLite '
+            'configuration and once with the configuration in settings.DATABASES, and compare throughput, read '
+            'latency and "database is locked" errors. The live database is only read, through the backup API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+
+    def handle(self, *args, **options):
+        default = settings.DATABASES['default']
+        if 'sqlite' not in default['ENGINE'] or default['NAME'] == ':memory:':
+            raise CommandError('bench_sqlite needs a file based SQLite default database.')
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, overrides in MODES.items():
+                name = os.path.join(directory, '%s.sqlite3' % mode)
+                self.copy_database(default['NAME'], name)
+                alias = 'bench-%s' % mode
+                connections.databases[alias] = dict(default, NAME=name, **overrides)
+                self.report(mode, self.run(alias, options))
+
+    def copy_database(self, source, target):
+        with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+            src.backup(dst)
+            # journal_mode is stored in the file, start each copy from the rollback journal default
+            dst.execute('PRAGMA journal_mode = delete')
+
+    def run(self, alias, options):
+        posts = list(Post.objects.using(alias).exclude(blog=None).values_list('pk', flat=True))
+        if not posts:
+            raise CommandError('The database has no posts, run seed_data first.')
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        result = {'reads': [], 'writes': [], 'errors': 0}
+
+        def worker(operation, kind, seed):
+            rng = random.Random(seed)
+            latencies, errors = [], 0
+            connection = connections[alias]
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation(alias, rng.choice(posts))
+                    latencies.append(time.perf_counter() - start)
+                except OperationalError:
+                    errors += 1
+                # End of "request": stock closes, tuned keeps the connection until CONN_MAX_AGE
+                connection.close_if_unusable_or_obsolete()
+            connection.close()
+            with lock:
+                result[kind].extend(latencies)
+                result['errors'] += errors
+
+        threads = [threading.Thread(target=worker, args=(self.read, 'reads', i)) for i in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=(self.write, 'writes', -i)) for i in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['seconds'] = options['seconds']
+        return result
+
+    def read(self, alias, post_pk):
+        """The queries of the post list and post detail pages."""
+        list(Post.objects.using(alias).select_related('author').only('id', 'title', 'posted_on', 'blog_id', 'author__username')[:20])
+        post = Post.objects.using(alias).get(pk=post_pk)
+        list(Comment.objects.using(alias).filter(post=post).select_related('user').order_by('path')[:50])
+
+    def write(self, alias, post_pk):
+        """The writes of CommentCreateView: the comment and the post's denormalized counters, in one transaction."""
+        with transaction.atomic(using=alias):
+            Post.objects.using(alias).filter(pk=post_pk).values('pk').get()
+            Comment.objects.using(alias).bulk_create([Comment(text='benchmark', post_id=post_pk)])
+            Post.objects.using(alias).filter(pk=post_pk).update(comment_count=F('comment_count') + 1)
+
+    def report(self, mode, result):
+        reads = sorted(result['reads']) or [0]
+        self.stdout.write('%-5s reads %7.0f/s  p50 %6.2fms  p99 %7.2fms | writes %6.0f/s | locked errors %d' % (
+            mode, len(result['reads']) / result['seconds'], statistics.median(reads) * 1000,
+            reads[min(len(reads) - 1, int(len(reads) * 0.99))] * 1000,
+            len(result['writes']) / result['seconds'], result['errors']))
@@ -0,0 +1,129 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from blog.models import MAX_DEPTH, PATH_STEP, Blog, Post, Comment
+from blog.pagination import ThreadPaginator
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare reading comment threads by walking the parent foreign key, a query per comment or per level of '
+            'the thread, with the single range scan of Comment.path: a whole thread, the replies under one comment '
+            'and one page of top-level comments. The threads are inserted inside a transaction that is rolled back '
+            'afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=5000, help='Comments in each thread shape.')
+        parser.add_argument('--per-page', type=int, default=20, help='Top-level comments per page.')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per read.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username='bench-threads-%d' % rng.randrange(10 ** 9))
+                blog = Blog.objects.create(name='thread benchmark', user=user)
+                shapes = {
+                    # Long reply chains, as deep as replies nest
+                    'deep': lambda n, pks: rng.choice(pks[-MAX_DEPTH + 1:]) if n % MAX_DEPTH else None,
+                    # Many top-level comments, each with a few direct replies
+                    'wide': lambda n, pks: pks[-(n % 5)] if n % 5 else None,
+                    # Replies to any earlier comment, like a busy discussion
+                    'random': lambda n, pks: rng.choice(pks) if pks and rng.random() < 0.7 else None,
+                }
+                for name, pick_parent in shapes.items():
+                    post = Post.objects.create(title='%s threads' % name, body='benchmark', blog=blog, author=user)
+                    self.seed(post, user, options['comments'], pick_parent)
+                    self.compare(name, post, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, post, user, count, pick_parent):
+        # Explicit primary keys so replies can name their parent within one bulk_create
+        first = (Comment.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+        comments, depths = [], {}
+        for pk in range(first, first + count):
+            parent = pick_parent(pk - first, list(depths))
+            if parent is not None and depths[parent] + 1 >= MAX_DEPTH:
+                parent = None
+            depths[pk] = depths[parent] + 1 if parent is not None else 0
+            comments.append(Comment(pk=pk, text='comment %d' % pk, post=post, user=user, parent_id=parent))
+        Comment.objects.bulk_create(comments, batch_size=1000)
+        Comment.fill_paths(post=post)
+
+    def compare(self, name, post, options):
+        per_page, repeat = options['per_page'], options['repeat']
+        # The comment with the most replies under it, at any depth
+        replies = {}
+        for path in Comment.objects.filter(post=post).values_list('path', flat=True):
+            for end in range(PATH_STEP, len(path), PATH_STEP):
+                replies[path[:end]] = replies.get(path[:end], 0) + 1
+        top = Comment.objects.get(post=post, path=max(replies, key=replies.get))
+        top_level = Comment.objects.filter(post=post, parent=None)
+        reads = [
+            ('thread', top_level.order_by('id'), lambda: list(Comment.thread(post))),
+            ('subtree', Comment.objects.filter(pk=top.pk), lambda: list(top.subtree())),
+            ('page', top_level.order_by('id')[:per_page],
+             lambda: ThreadPaginator(Comment.objects.filter(post=post), per_page).page().object_list),
+        ]
+        for label, roots, by_path in reads:
+            rows, path_queries, path_ms = self.time(by_path, repeat)
+            __, node_queries, node_ms = self.time(lambda: self.per_comment(roots), repeat)
+            __, level_queries, level_ms = self.time(lambda: self.per_level(roots), repeat)
+            self.stdout.write('%-6s %-7s %5d comments | per comment %5d queries %9.2fms | per level %3d queries '
+                              '%8.2fms | path %d query %8.2fms' % (
+                                  name, label, rows, node_queries, node_ms, level_queries, level_ms, path_queries,
+                                  path_ms))
+
+    def per_comment(self, roots):
+        """The threads under `roots` in depth first order, reading the replies of one comment at a time."""
+        ordered = []
+
+        def visit(comment):
+            ordered.append(comment)
+            for reply in comment.replies.order_by('id'):
+                visit(reply)
+
+        for root in roots:
+            visit(root)
+        return ordered
+
+    def per_level(self, roots):
+        """The threads under `roots` in depth first order, reading the replies of a whole level at a time and
+        ordering them in Python."""
+        roots = list(roots)
+        replies, level = {}, roots
+        while level:
+            level = list(Comment.objects.filter(parent__in=[c.pk for c in level]).order_by('id'))
+            for reply in level:
+                replies.setdefault(reply.parent_id, []).append(reply)
+        ordered, stack = [], roots[::-1]
+        while stack:
+            comment = stack.pop()
+            ordered.append(comment)
+            stack.extend(reversed(replies.get(comment.pk, [])))
+        return ordered
+
+    def time(self, read, repeat):
+        """Rows and queries of one `read` and its median duration in ms over `repeat` runs."""
+        queries = []
+        # Counted rather than captured, the walks run more queries than the debug query log keeps
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            rows = len(read())
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            read()
+            timings.append((time.perf_counter() - start) * 1000)
+        return rows, len(queries), statistics.median(timings)
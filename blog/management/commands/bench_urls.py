@@ -0,0 +1,165 @@
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from blog.middleware import QueryRecorder
+from blog.models import Blog, Post
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'bench_urls.json')
+METRICS = ['p50', 'p95', 'p99', 'queries', 'peak_kib']
+BENCH_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-urls'}}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Request every named blog URL through the test client and report p50/p95/p99 latency, queries per request '
+            'and peak Python memory. By default the data comes from seed_data inside a transaction that is rolled back '
+            'afterwards. The pages are cached in a private in-memory cache that is thrown away with it, never in the '
+            'configured one. With --baseline, fails if any URL regressed against the stored numbers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per URL.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per URL before measuring.')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request.')
+        parser.add_argument('--existing', action='store_true', help='Benchmark the data already in the database instead of seeding.')
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the seed_data defaults.')
+        parser.add_argument('--url', action='append', dest='urls', help='Only benchmark this URL name, may be repeated.')
+        parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE, help='Compare against a stored baseline.')
+        parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, help='Store the results as the new baseline.')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help='Allowed slowdown factor for latency and memory. Query counts must not grow at all.')
+
+    def handle(self, *args, **options):
+        # Rolled back rows give their ids out again, fragments and versions cached for them must not outlive the run
+        try:
+            with override_settings(CACHES=BENCH_CACHES, CACHE_SHARED=True), transaction.atomic():
+                if not options['existing']:
+                    scale = options['scale']
+                    call_command('seed_data', users=int(200 * scale), blogs=int(100 * scale), posts=int(5000 * scale),
+                                 comments=int(20000 * scale), stdout=self.stdout)
+                results = self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write('%-16s %9s %9s %9s %8s %10s' % ('url', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB'))
+        for name, result in results.items():
+            self.stdout.write('%-16s %9.2f %9.2f %9.2f %8.1f %10.0f' % (name, *(result[m] for m in METRICS)))
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['save_baseline']), exist_ok=True)
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write('Saved baseline to %s' % options['save_baseline'])
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def targets(self):
+        """(URL name, kwargs, query string or POST data, method) for every URL, aimed at the heaviest objects."""
+        viral = Post.objects.exclude(blog=None).order_by('-comment_count', 'id').first()
+        busiest = Blog.objects.annotate(n=Count('post')).order_by('-n', 'id').first()
+        word = viral.title.split()[0]
+        post = {'blog_pk': viral.blog_id, 'post_pk': viral.pk}
+        busiest_month = Post.objects.filter(blog=busiest).order_by('-posted_on').values_list('posted_on', flat=True).first()
+        month = {'year': busiest_month.year, 'month': busiest_month.month}
+        return [
+            ('index', {}, {}, 'get'),
+            ('blog-list', {}, {}, 'get'),
+            ('user-list', {}, {}, 'get'),
+            ('post-list', {}, {}, 'get'),
+            ('search', {}, {'q': word}, 'get'),
+            ('user-detail', {'user_pk': busiest.user_id}, {}, 'get'),
+            ('blog-detail', {'blog_pk': busiest.pk}, {}, 'get'),
+            ('post-detail', post, {}, 'get'),
+            ('post-comments', post, {}, 'get'),
+            ('post-feed', {}, {}, 'get'),
+            ('blog-feed', {'blog_pk': busiest.pk}, {}, 'get'),
+            ('post-archive-year', {'year': month['year']}, {}, 'get'),
+            ('post-archive-month', month, {}, 'get'),
+            ('blog-archive-year', {'blog_pk': busiest.pk, 'year': month['year']}, {}, 'get'),
+            ('blog-archive-month', dict(month, blog_pk=busiest.pk), {}, 'get'),
+            ('activity', {}, {}, 'get'),
+            ('user-activity', {'user_pk': busiest.user_id}, {}, 'get'),
+            ('blog-activity', {'blog_pk': busiest.pk}, {}, 'get'),
+            # Writes go last so they don't invalidate the caches of the reads above mid-measurement
+            ('comment-create', {}, {'text': 'benchmark comment', 'post': viral.pk, 'user': busiest.user_id}, 'post'),
+        ]
+
+    def run(self, options):
+        # The client's default host is only allowed under the test runner, DEBUG allows localhost
+        host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(Blog.objects.order_by('id').last().user)
+        results = {}
+        for name, kwargs, data, method in self.targets():
+            if options['urls'] and name not in options['urls']:
+                continue
+            url = reverse(name, kwargs=kwargs)
+            request = lambda: getattr(client, method)(url, data)
+
+            for _ in range(options['warmup']):
+                self.check_response(name, request())
+            timings, queries = [], 0
+            for _ in range(options['requests']):
+                if options['cold']:
+                    cache.clear()
+                recorder = QueryRecorder()
+                with recorder.record():
+                    start = time.perf_counter()
+                    request()
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries += recorder.count
+
+            # Measured in a separate request since tracing slows everything down
+            if options['cold']:
+                cache.clear()
+            tracemalloc.start()
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            timings.sort()
+            results[name] = {
+                'p50': statistics.median(timings),
+                'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+                'queries': queries / len(timings),
+                'peak_kib': peak / 1024,
+            }
+        return results
+
+    def check_response(self, name, response):
+        if response.status_code not in (200, 302):
+            raise CommandError('%s returned HTTP %d.' % (name, response.status_code))
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            if result['queries'] > before['queries']:
+                regressions.append('%s: %.1f queries per request, baseline %.1f' % (name, result['queries'], before['queries']))
+            for metric in ('p95', 'peak_kib'):
+                if result[metric] > before[metric] * tolerance:
+                    regressions.append('%s: %s %.2f, baseline %.2f' % (name, metric, result[metric], before[metric]))
+        if regressions:
+            raise CommandError('Regressions against %s:\n  %s' % (path, '\n  '.join(regressions)))
+        self.stdout.write(self.style.SUCCESS('No regressions against %s.' % path))
@@ -0,0 +1,214 @@
+import contextlib
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_date, parse_datetime
+
+from blog.cache import bump_version, user_blog_key
+from blog.management.commands.blog_export import open_stream
+from blog.models import Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics
+
+MODELS = {'user': User, 'blog': Blog, 'post': Post, 'comment': Comment}
+PROGRESS_EVERY = 100000
+
+
+@contextlib.contextmanager
+def preserve_dates(*models):
+    """Switch off auto_now and auto_now_add while importing so rows keep their exported dates."""
+    fields = [f for model in models for f in model._meta.fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Load a blog_export NDJSON stream with batched bulk_create, in constant memory. Blogs, posts and comments get '
+            'new primary keys above the current maximum, users are matched by username. Progress is checkpointed after '
+            'every committed batch so an interrupted import resumes where it stopped. Run it with writes to the site '
+            'stopped: rows created meanwhile can take the ids the import assigns, which stops it with an error.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File written by blog_export, "-" for stdin. A .gz suffix is decompressed.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk_create and transaction.')
+        parser.add_argument('--checkpoint', help='Checkpoint file, defaults to <input>.checkpoint. Required for stdin to resume.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over.')
+
+    def handle(self, *args, **options):
+        path = options['checkpoint'] or (None if options['input'] == '-' else options['input'] + '.checkpoint')
+        state = self.load_checkpoint(path, options['restart'])
+        if state['line']:
+            self.stderr.write('Resuming after line %d.' % state['line'])
+        self.offsets = state['offsets']
+        self.matched_path = path and path + '.users'
+        self.matched = self.load_matched(self.matched_path, options['restart'])
+        self.progress = {}
+
+        stream = open_stream(options['input'], 'r')
+        try:
+            with preserve_dates(Post, Comment):
+                line = state['line']
+                # The batch after the checkpoint may have committed just before an interruption
+                replay = line > 0
+                for name, records in self.batches(itertools.islice(stream, line, None), options['batch_size']):
+                    self.new_matches = {}
+                    with transaction.atomic():
+                        self.import_batch(name, records, replay)
+                    replay = False
+                    self.save_matched(self.matched_path, self.new_matches)
+                    line += len(records)
+                    state['line'] = line
+                    self.save_checkpoint(path, state)
+        finally:
+            if options['input'] != '-':
+                stream.close()
+
+        self.finish()
+        for name, (count, elapsed) in self.progress.items():
+            self.stderr.write('Imported %d %s(s) in %.1fs (%.0f rows/s)' % (count, name, elapsed, count / max(elapsed, 1e-6)))
+        for name in (path, self.matched_path):
+            if name and os.path.exists(name):
+                os.remove(name)
+
+    def batches(self, lines, size):
+        """Yield (model name, records) with every batch holding at most `size` rows of a single model."""
+        batch, current = [], None
+        for text in lines:
+            record = json.loads(text)
+            if record['model'] not in MODELS:
+                raise CommandError('Unknown model %r in import stream.' % record['model'])
+            if batch and (record['model'] != current or len(batch) >= size):
+                yield current, batch
+                batch = []
+            current = record['model']
+            batch.append(record)
+        if batch:
+            yield current, batch
+
+    def load_checkpoint(self, path, restart):
+        if path and os.path.exists(path) and not restart:
+            with open(path) as f:
+                return json.load(f)
+        # New rows are numbered after the current maximum, which turns FK remapping into arithmetic. The checkpoint
+        # is therefore just the stream position and the offsets. The only ids that don't follow from the offsets are
+        # those of users matched to existing ones by username, appended to <checkpoint>.users as they are found.
+        offsets = {name: model.objects.aggregate(pk=Max('pk'))['pk'] or 0 for name, model in MODELS.items()}
+        return {'line': 0, 'offsets': offsets}
+
+    def load_matched(self, path, restart):
+        """{old pk: existing pk} of the users matched by username so far."""
+        matched = {}
+        if path and os.path.exists(path) and not restart:
+            with open(path) as f:
+                for text in f:
+                    old, new = text.split()
+                    matched[int(old)] = int(new)
+        elif path and os.path.exists(path):
+            os.remove(path)
+        return matched
+
+    def save_matched(self, path, matches):
+        if path and matches:
+            with open(path, 'a') as f:
+                f.writelines('%d %d\n' % item for item in matches.items())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def save_checkpoint(self, path, state):
+        if path:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+
+    def new_pk(self, name, old):
+        return None if old is None else self.offsets[name] + old
+
+    def user_pk(self, old):
+        return self.matched.get(old) or self.new_pk('user', old)
+
+    def import_batch(self, name, records, replay=False):
+        start = time.perf_counter()
+        if name == 'user':
+            objs = self.build_users(records)
+        else:
+            objs = [getattr(self, 'build_' + name)(record['pk'], record['fields']) for record in records]
+        if replay:
+            # Primary keys are deterministic, so replaying a batch committed just before a crash is a no-op
+            MODELS[name].objects.bulk_create(objs, ignore_conflicts=True)
+        else:
+            try:
+                MODELS[name].objects.bulk_create(objs)
+            except IntegrityError as e:
+                # Ignoring the conflict would drop the row and point later references at the row holding its id
+                raise CommandError('Could not insert %s(s) %d to %d: %s. Rows created on the site since the import '
+                                   'started hold ids the import assigned.' % (name, objs[0].pk, objs[-1].pk, e))
+        count, elapsed = self.progress.get(name, (0, 0.0))
+        self.progress[name] = (count + len(records), elapsed + time.perf_counter() - start)
+        if (count + len(records)) // PROGRESS_EVERY > count // PROGRESS_EVERY:
+            count, elapsed = self.progress[name]
+            self.stderr.write('  %d %s(s), %.0f rows/s' % (count, name, count / max(elapsed, 1e-6)))
+
+    def build_users(self, records):
+        existing = dict(User.objects.filter(username__in=[r['fields']['username'] for r in records]).values_list('username', 'pk'))
+        users = []
+        for record in records:
+            fields = record['fields']
+            if fields['username'] in existing:
+                self.matched[record['pk']] = self.new_matches[record['pk']] = existing[fields['username']]
+                continue
+            pk = self.new_pk('user', record['pk'])
+            users.append(User(pk=pk, **dict(fields, date_joined=parse_datetime(fields['date_joined']))))
+        return users
+
+    def build_blog(self, pk, fields):
+        return Blog(pk=self.new_pk('blog', pk), name=fields['name'], user_id=self.user_pk(fields['user_id']))
+
+    def build_post(self, pk, fields):
+        post = Post(
+            pk=self.new_pk('post', pk), title=fields['title'], body=fields['body'],
+            blog_id=self.new_pk('blog', fields['blog_id']), author_id=self.user_pk(fields['author_id']),
+            posted_on=parse_date(fields['posted_on']), last_modified=parse_date(fields['last_modified']),
+        )
+        post.render_body()
+        return post
+
+    def build_comment(self, pk, fields):
+        return Comment(
+            pk=self.new_pk('comment', pk), text=fields['text'],
+            post_id=self.new_pk('post', fields['post_id']), user_id=self.user_pk(fields['user_id']),
+            parent_id=self.new_pk('comment', fields.get('parent_id')),
+            posted_on=parse_date(fields['posted_on']), last_modified=parse_datetime(fields['last_modified']),
+        )
+
+    def finish(self):
+        """bulk_create sends no signals, so redo the work of the receivers in blog/signals.py in bulk."""
+        with connection.cursor() as cursor:
+            # Explicit primary keys don't advance sequences on backends that have them
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(MODELS.values())):
+                cursor.execute(sql)
+        Post.recount_comments(pk__gt=self.offsets['post'])
+        Comment.fill_paths(pk__gt=self.offsets['comment'])
+        Activity.backfill(
+            blogs=Blog.objects.filter(pk__gt=self.offsets['blog']),
+            posts=Post.objects.filter(pk__gt=self.offsets['post']),
+            comments=Comment.objects.filter(pk__gt=self.offsets['comment']),
+        )
+        SiteStatistics.recompute()
+        MonthlyPostCount.recompute()
+        bump_version('posts', 'all')
+        bump_version('blogs', 'all')
+        owners = Blog.objects.filter(pk__gt=self.offsets['blog']).values_list('user', flat=True).distinct().iterator()
+        for batch in iter(lambda: list(itertools.islice(owners, 1000)), []):
+            cache.delete_many([user_blog_key(pk) for pk in batch])
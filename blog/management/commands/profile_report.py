@@ -0,0 +1,68 @@
+import os
+import pstats
+import sys
+from glob import glob
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.middleware import PROFILE_HEADER, profile_token
+
+SORT_KEYS = {'tottime': 2, 'cumtime': 3}  # positions in a pstats (cc, nc, tt, ct, callers) entry
+
+
+def short_path(filename):
+    """`filename` relative to the sys.path entry it was imported from, so reports don't repeat site-packages."""
+    for prefix in sorted(filter(None, sys.path), key=len, reverse=True):
+        if filename.startswith(prefix.rstrip(os.sep) + os.sep):
+            return os.path.relpath(filename, prefix)
+    return filename
+
+
+class Command(BaseCommand):
+    help = ('Merge the profiles ProfilingMiddleware wrote to PROFILE_DIR into a report per URL name, views with the most '
+            'sampled time first, each with its hottest functions in milliseconds per request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Directory of profiles, PROFILE_DIR by default.')
+        parser.add_argument('--url', action='append', default=[], help='Only report this URL name, can be repeated.')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='tottime',
+                            help='Rank functions by time spent in the function itself or including its callees.')
+        parser.add_argument('--limit', type=int, default=15, help='Functions listed per view.')
+        parser.add_argument('--clear', action='store_true', help='Delete the profiles once they are reported.')
+        parser.add_argument('--token', action='store_true',
+                            help='Print an %s header value that gets a request profiled, then exit.' % PROFILE_HEADER)
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write('%s: %s' % (PROFILE_HEADER, profile_token()))
+            return
+        directory = options['dir'] or settings.PROFILE_DIR
+        if not os.path.isdir(directory):
+            raise CommandError('No profiles in %s, enable PROFILING first.' % directory)
+
+        reports = []
+        for url_name in sorted(os.listdir(directory)):
+            files = sorted(glob(os.path.join(directory, url_name, '*.prof')))
+            if not files or (options['url'] and url_name not in options['url']):
+                continue
+            reports.append((url_name, files, pstats.Stats(*files)))
+        if not reports:
+            raise CommandError('No matching profiles in %s.' % directory)
+
+        # Views that cost the most sampled time overall first
+        reports.sort(key=lambda report: report[2].total_tt, reverse=True)
+        for url_name, files, stats in reports:
+            self.report(url_name, len(files), stats, options['sort'], options['limit'])
+            if options['clear']:
+                for path in files:
+                    os.remove(path)
+
+    def report(self, url_name, count, stats, sort, limit):
+        self.stdout.write('\n%s: %d profile(s), %.2fms per request' % (url_name, count, stats.total_tt * 1000 / count))
+        self.stdout.write('%10s %10s %10s  %s' % ('own ms', 'cum ms', 'calls', 'function'))
+        entries = [(func, entry) for func, entry in stats.stats.items() if '_lsprof' not in func[2]]
+        entries.sort(key=lambda item: item[1][SORT_KEYS[sort]], reverse=True)
+        for (filename, line, name), (cc, nc, tt, ct, callers) in entries[:limit]:
+            function = pstats.func_std_string((short_path(filename), line, name))
+            self.stdout.write('%10.2f %10.2f %10.1f  %s' % (tt * 1000 / count, ct * 1000 / count, nc / count, function))
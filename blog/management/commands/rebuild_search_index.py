@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FTS5 post search index from blog_post, e.g. after restoring a backup without the index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true', help='Merge the index b-trees after rebuilding.')
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Post)]
+        if connection.vendor != 'sqlite':
+            raise CommandError('The search index is only maintained on SQLite databases.')
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO blog_post_fts(blog_post_fts) VALUES ('rebuild')")
+            if options['optimize']:
+                cursor.execute("INSERT INTO blog_post_fts(blog_post_fts) VALUES ('optimize')")
+            cursor.execute('SELECT COUNT(*) FROM blog_post_fts')
+            indexed = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS('Indexed %d post(s).' % indexed))
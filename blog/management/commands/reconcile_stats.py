@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import MonthlyPostCount, Post, SiteStatistics
+
+FIELDS = ['num_blogs', 'num_users', 'num_posts', 'num_comments', 'latest_post_id']
+
+
+class Command(BaseCommand):
+    help = 'Recount the denormalized site statistics, per-post comment counts and monthly post counts from the source tables, e.g. after a bulk load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing the corrected values.')
+
+    def handle(self, *args, **options):
+        before = SiteStatistics.objects.filter(pk=1).first()
+        if options['dry_run']:
+            # Recompute inside a transaction that is always rolled back
+            with transaction.atomic():
+                after = SiteStatistics.recompute()
+                transaction.set_rollback(True)
+        else:
+            after = SiteStatistics.recompute()
+
+        drift = [(name, getattr(before, name, None), getattr(after, name)) for name in FIELDS
+                 if before is None or getattr(before, name) != getattr(after, name)]
+        for name, old, new in drift:
+            self.stdout.write('%s: %s -> %s' % (name, old, new))
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Site statistics are up to date.'))
+        elif not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Reconciled %d counter(s).' % len(drift)))
+
+        if not options['dry_run']:
+            posts = Post.recount_comments()
+            self.stdout.write('Recounted comments on %d post(s).' % posts)
+            MonthlyPostCount.recompute()
+            self.stdout.write('Recounted monthly post counts.')
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.cache import bump_version, bump_versions
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Backfill Post.body_html and Post.excerpt for posts saved before those columns existed, in primary key '
+            'order and in batches, so it can run against a live site and be interrupted at any point. A post edited '
+            'while its batch renders keeps the HTML its save() rendered.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render every post, e.g. after changing render_body().')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.order_by('pk').only('id', 'blog', 'body')
+        if not options['all']:
+            posts = posts.filter(body_html='')
+        start, count, last = time.perf_counter(), 0, 0
+        while True:
+            batch = list(posts.filter(pk__gt=last)[:options['batch_size']])
+            if not batch:
+                break
+            last = batch[-1].pk
+            while batch:
+                changed = self.render(batch)
+                count += len(batch) - len(changed)
+                # Edited while they were rendered, read the new body and render that instead
+                batch = list(posts.filter(pk__in=changed))
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Rendered %d post(s) in %.1fs.' % (count, elapsed))
+
+    def render(self, batch):
+        """Write the rendering of each post unless its body changed since it was read, so an edit saved meanwhile is
+        never overwritten with the old body's HTML. Returns the ids of the posts that changed (or were deleted)."""
+        for post in batch:
+            post.render_body()
+        changed = []
+        with transaction.atomic():
+            for post in batch:
+                if not Post.objects.filter(pk=post.pk, body=post.body).update(body_html=post.body_html, excerpt=post.excerpt):
+                    changed.append(post.pk)
+        # Post pages render the same HTML either way, but the feeds and the search fallback show the excerpt, which
+        # was empty before
+        bump_version('posts', 'all')
+        bump_versions('blog', {post.blog_id for post in batch if post.pk not in changed})
+        return changed
@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from blog.models import ReplicationHeartbeat
+from blog.routers import replica_lag
+
+
+class Command(BaseCommand):
+    help = ('Write the replication heartbeat on the primary, which the router compares against each replica to measure '
+            'lag, and copy the primary over SQLite replicas (the local stand-in for real replication).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Repeat every INTERVAL seconds instead of running once.')
+        parser.add_argument('--heartbeat-only', action='store_true', help='Only write the heartbeat, for replicas the database replicates itself.')
+
+    def handle(self, *args, **options):
+        while True:
+            ReplicationHeartbeat.touch()
+            if not options['heartbeat_only']:
+                for alias in settings.DATABASE_REPLICAS:
+                    self.copy(alias)
+            if options['verbosity'] > 1:
+                for alias in settings.DATABASE_REPLICAS:
+                    self.stdout.write('%s: %s seconds behind' % (alias, replica_lag(alias)))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, alias):
+        replica = connections[alias]
+        if replica.vendor != 'sqlite':
+            self.stderr.write('Skipping %s, only SQLite replicas are copied.' % alias)
+            return
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        target = sqlite3.connect(replica.settings_dict['NAME'], timeout=30)
+        try:
+            # Online backup, readers of the replica wait on the lock for the moment the pages are swapped in
+            primary.connection.backup(target)
+        finally:
+            target.close()
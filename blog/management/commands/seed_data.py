@@ -0,0 +1,136 @@
+import itertools
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from blog.cache import bump_version
+from blog.management.commands.blog_import import preserve_dates
+from blog.models import MAX_DEPTH, Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics
+
+WORDS = ('the of and to in is was for on that with as by it at from his an were are which this be or has had not '
+         'first one their its new after but who they have her she two been other when there all during into school '
+         'time may years more most only over city some world would where later up such used many can state about '
+         'national out known university united then made').split()
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights under which item 0 is picked most often and popularity falls off as 1 / rank ** skew."""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = ('Generate users, blogs, posts and comments with realistic skew: a few prolific bloggers write most of the '
+            'posts and a few viral posts get most of the comments. Seeded users can log in with the password "password".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--blogs', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--replies', type=float, default=0.3,
+                            help='Fraction of the comments that reply to an earlier comment on the same post.')
+        parser.add_argument('--days', type=int, default=730, help='Posts are spread over this many days before today.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of blog and post popularity.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        start = time.perf_counter()
+        with transaction.atomic(), preserve_dates(Post, Comment):
+            users = self.seed_users(options['users'])
+            blogs = self.seed_blogs(users, options['blogs'], options['skew'])
+            posts = self.seed_posts(blogs, options['posts'], options['days'], options['skew'])
+            comments = self.seed_comments(users, posts, options['comments'], options['skew'], options['replies'])
+
+            # bulk_create sends no signals, bring the denormalized data up to date in bulk
+            if posts:
+                Post.recount_comments(pk__gte=posts[0][0])
+            if comments:
+                Comment.fill_paths(pk__gte=comments[0])
+            Activity.backfill(
+                blogs=Blog.objects.filter(pk__gte=blogs[0][0]) if blogs else None,
+                posts=Post.objects.filter(pk__gte=posts[0][0]) if posts else None,
+                comments=Comment.objects.filter(pk__gte=comments[0]) if comments else None,
+            )
+            SiteStatistics.recompute()
+            MonthlyPostCount.recompute()
+        bump_version('posts', 'all')
+        bump_version('blogs', 'all')
+        self.stdout.write('Seeded %d users, %d blogs, %d posts and %d comments in %.1fs' % (
+            options['users'], options['blogs'], options['posts'], options['comments'], time.perf_counter() - start))
+
+    def next_pks(self, model, count):
+        # Explicit primary keys, since bulk_create doesn't return them on every backend
+        first = (model.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+        return range(first, first + count)
+
+    def insert(self, model, objs):
+        for batch in iter(lambda: list(itertools.islice(objs, self.batch_size)), []):
+            model.objects.bulk_create(batch)
+
+    def words(self, count):
+        return ' '.join(self.rng.choices(WORDS, k=count))
+
+    def seed_users(self, count):
+        password = make_password('password')  # hashing is slow, every seeded user shares one hash
+        pks = self.next_pks(User, count)
+        tag = self.rng.randrange(16 ** 6)
+        self.insert(User, (User(pk=pk, username='seed-%06x-%d' % (tag, pk), password=password) for pk in pks))
+        return list(pks)
+
+    def seed_blogs(self, users, count, skew):
+        owners = self.rng.choices(users, cum_weights=zipf_weights(len(users), skew), k=count)
+        pks = self.next_pks(Blog, count)
+        self.insert(Blog, (Blog(pk=pk, name=self.words(3).title(), user_id=owner) for pk, owner in zip(pks, owners)))
+        return list(zip(pks, owners))
+
+    def seed_posts(self, blogs, count, days, skew):
+        """Returns (pk, posted_on) pairs, ids increase with the posting date as they would in production."""
+        picks = self.rng.choices(blogs, cum_weights=zipf_weights(len(blogs), skew), k=count)
+        dates = sorted(date.today() - timedelta(days=self.rng.randrange(days)) for _ in range(count))
+        pks = self.next_pks(Post, count)
+
+        def post(pk, blog, owner, posted_on):
+            post = Post(pk=pk, title=self.words(self.rng.randint(3, 8)).capitalize(), blog_id=blog, author_id=owner,
+                        body=self.words(self.rng.randint(50, 400)), posted_on=posted_on, last_modified=posted_on)
+            post.render_body()
+            return post
+
+        self.insert(Post, (post(pk, blog, owner, posted_on) for pk, (blog, owner), posted_on in zip(pks, picks, dates)))
+        return list(zip(pks, dates))
+
+    def seed_comments(self, users, posts, count, skew, replies):
+        # Popularity is independent of age, so shuffle the posts before ranking them
+        ranked = self.rng.sample(posts, len(posts))
+        picks = self.rng.choices(ranked, cum_weights=zipf_weights(len(ranked), skew), k=count)
+        today = date.today()
+        # (pk, depth, posted_on) of the comments seeded so far on each post, replies answer one of them
+        threads = {}
+
+        def comment(pk, post):
+            post_pk, posted_on = post
+            thread = threads.setdefault(post_pk, [])
+            parent = None
+            if thread and self.rng.random() < replies:
+                parent = self.rng.choice(thread)
+                if parent[1] + 1 >= MAX_DEPTH:
+                    parent = None
+                else:
+                    posted_on = parent[2]
+            day = posted_on + timedelta(days=self.rng.randint(0, (today - posted_on).days))
+            thread.append((pk, parent[1] + 1 if parent else 0, day))
+            return Comment(pk=pk, text=self.words(self.rng.randint(5, 60)), post_id=post_pk,
+                           user_id=self.rng.choice(users), parent_id=parent[0] if parent else None, posted_on=day,
+                           last_modified=datetime.combine(day, clock(12), tzinfo=timezone.utc))
+
+        pks = self.next_pks(Comment, count)
+        self.insert(Comment, (comment(pk, post) for pk, post in zip(pks, picks)))
+        return pks
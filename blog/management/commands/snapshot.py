@@ -0,0 +1,192 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from datetime import date
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.template.utils import get_app_template_dirs
+from django.test import Client
+from django.urls import reverse
+
+from blog.models import Blog, Post
+from miniblog.static import compress
+
+MANIFEST = '.snapshot.json'
+FORMAT = 1
+
+
+def page_path(output, url):
+    """File the page at `url` is written to: <url>/index.html, so the proxy can try $uri/index.html before Django."""
+    return os.path.join(output, *filter(None, url.split('/')), 'index.html')
+
+
+def write_page(path, content):
+    """Replace the page at `path` and its compressed variants by renaming, so the proxy never serves half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    compress(tmp)
+    for suffix in ('.gz', '.br'):
+        if os.path.exists(tmp + suffix):
+            os.replace(tmp + suffix, path + suffix)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(tmp, path)
+
+
+def remove_page(output, url):
+    path = page_path(output, url)
+    for name in (path, path + '.gz', path + '.br'):
+        if os.path.exists(name):
+            os.remove(name)
+    # Prune the directories left empty, a deleted blog's directory still holds the pages of posts moved elsewhere
+    directory = os.path.dirname(path)
+    while directory != output and os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def render_pages(output, host, urls):
+    """Request `urls` as an anonymous visitor and write the pages under `output`. Returns the URLs that failed."""
+    client = Client(HTTP_HOST=host)
+    failed = []
+    for url in urls:
+        response = client.get(url)
+        if response.status_code == 200:
+            write_page(page_path(output, url), response.content)
+        else:
+            failed.append(url)
+    return failed
+
+
+def render_batch(args):
+    return render_pages(*args)
+
+
+def digest(*values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+
+
+def build_digest():
+    """Digest of everything besides the data that shapes every page: the templates and the static files manifest.
+    A deploy that changes either re-renders the whole snapshot."""
+    build = hashlib.sha1()
+    directories = [*(d for engine in settings.TEMPLATES for d in engine['DIRS']), *get_app_template_dirs('templates')]
+    for directory in directories:
+        for root, dirs, names in sorted(os.walk(directory)):
+            for name in sorted(names):
+                with open(os.path.join(root, name), 'rb') as f:
+                    build.update(name.encode() + f.read())
+    manifest = getattr(staticfiles_storage, 'manifest_name', None)
+    if manifest and staticfiles_storage.exists(manifest):
+        with staticfiles_storage.open(manifest) as f:
+            build.update(f.read())
+    return build.hexdigest()[:16]
+
+
+class Command(BaseCommand):
+    help = ('Render the blog list, the first page of the post list and every blog and post page as an anonymous '
+            'visitor into a tree of static HTML (with .gz variants) that a front proxy can serve without Django: '
+            'try $uri/index.html for requests without a session cookie or query string, and pass the rest on. '
+            'SNAPSHOT_DIR/%s records a fingerprint of every page, later runs only re-render the pages whose post, '
+            'comments or blog changed and delete the pages of deleted objects.' % MANIFEST)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Directory to write, SNAPSHOT_DIR by default.')
+        parser.add_argument('--full', action='store_true', help='Re-render every page, changed or not.')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Render in this many forked processes, 0 renders in this process.')
+
+    def handle(self, *args, **options):
+        output = os.path.abspath(options['output'] or settings.SNAPSHOT_DIR)
+        previous = self.load_manifest(output)
+        build = build_digest()
+        if options['full'] or previous['build'] != build:
+            previous['pages'] = dict.fromkeys(previous['pages'])
+        since = date.fromisoformat(previous['date']) if previous['date'] else None
+        started, today = time.monotonic(), date.today()
+
+        pages, recent = self.fingerprints(since)
+        # last_modified is a date, so posts edited since the day of the previous run are always re-rendered
+        dirty = [url for url, fingerprint in pages.items() if previous['pages'].get(url) != fingerprint or url in recent]
+        stale = [url for url in previous['pages'] if url not in pages]
+
+        failed = set(self.render(output, dirty, options['workers']))
+        for url in stale:
+            remove_page(output, url)
+        for url in failed:
+            pages[url] = None  # rendered again next time
+        self.save_manifest(output, {'format': FORMAT, 'date': today.isoformat(), 'build': build, 'pages': pages})
+
+        self.stdout.write('Rendered %d of %d pages, removed %d, in %.1fs' % (
+            len(dirty) - len(failed), len(pages), len(stale), time.monotonic() - started))
+        if failed:
+            raise CommandError('%d page(s) did not render: %s' % (len(failed), ', '.join(sorted(failed)[:10])))
+
+    def fingerprints(self, since):
+        """{url: fingerprint} of every page of the snapshot, and the URLs of the posts modified on or after `since`.
+        Reads only narrow columns, no bodies, so it stays cheap next to rendering even for large sites."""
+        pages, recent = {}, set()
+        blog_list, post_list = hashlib.sha1(), hashlib.sha1()
+        blogs = {}
+        for pk, name in Blog.objects.order_by('id').values_list('id', 'name').iterator():
+            blogs[pk] = hashlib.sha1(repr(name).encode())
+            blog_list.update(repr((pk, name)).encode())
+
+        posts = Post.objects.order_by('id').values_list(
+            'id', 'blog', 'title', 'posted_on', 'last_modified', 'comment_count', 'last_comment_at')
+        for pk, blog_pk, title, posted_on, last_modified, comment_count, last_comment_at in posts.iterator():
+            listed = repr((pk, blog_pk, title, posted_on)).encode()
+            post_list.update(listed)
+            if blog_pk is None:
+                continue  # posts of deleted blogs have no page
+            blogs[blog_pk].update(listed)
+            url = reverse('post-detail', kwargs={'blog_pk': blog_pk, 'post_pk': pk})
+            pages[url] = digest(title, last_modified, comment_count, last_comment_at)
+            if since is not None and last_modified >= since:
+                recent.add(url)
+
+        pages[reverse('blog-list')] = blog_list.hexdigest()[:16]
+        pages[reverse('post-list')] = post_list.hexdigest()[:16]
+        for pk, blog in blogs.items():
+            pages[reverse('blog-detail', kwargs={'blog_pk': pk})] = blog.hexdigest()[:16]
+        return pages, recent
+
+    def render(self, output, urls, workers):
+        host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+        if not workers or len(urls) < 2:
+            return render_pages(output, host, urls)
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise CommandError('--workers needs the fork start method, run without it on this platform.')
+        # Small batches keep the workers evenly busy however unequal the pages are
+        size = max(1, min(100, len(urls) // (workers * 8)))
+        batches = [(output, host, urls[i:i + size]) for i in range(0, len(urls), size)]
+        # Each child opens its own database connection rather than sharing this one
+        connections.close_all()
+        with context.Pool(workers) as pool:
+            return [url for failed in pool.imap_unordered(render_batch, batches) for url in failed]
+
+    def load_manifest(self, output):
+        try:
+            with open(os.path.join(output, MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = None
+        if not manifest or manifest.get('format') != FORMAT:
+            return {'date': None, 'build': None, 'pages': {}}
+        return manifest
+
+    def save_manifest(self, output, manifest):
+        os.makedirs(output, exist_ok=True)
+        path = os.path.join(output, MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
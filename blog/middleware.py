@@ -0,0 +1,228 @@
+"""Request middleware for the blog app."""
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from blog.hashing import HashingBusy
+from blog.routers import request_routing
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalise a SQL statement so that the same query with different parameters compares equal.
+    Parameters are already separated out as %s placeholders, only IN lists of varying length need collapsing."""
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts, times and fingerprints every query run through it."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times, most frequent first. These are the N+1 suspects."""
+        return [(sql, n) for sql, n in self.fingerprints.most_common() if n >= threshold]
+
+    @contextmanager
+    def record(self):
+        """Install the recorder on every configured database connection for the duration of the block."""
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+
+class QueryStats:
+    """Thread safe running totals of query counts and SQL time, keyed by URL name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'requests': 0, 'queries': 0, 'time': 0.0, 'max_queries': 0})
+
+    def add(self, url_name, recorder):
+        with self._lock:
+            entry = self._stats[url_name]
+            entry['requests'] += 1
+            entry['queries'] += recorder.count
+            entry['time'] += recorder.duration
+            entry['max_queries'] = max(entry['max_queries'], recorder.count)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+class QueryCountMiddleware:
+    """Records the number of queries, total SQL time and repeated statements of each request.
+
+    Enabled with settings.QUERY_INSTRUMENTATION. Totals are aggregated per resolved URL name in `query_stats`,
+    the per-request numbers are added as X-Query-Count / X-Query-Time response headers, and any statement run
+    QUERY_REPEAT_THRESHOLD times or more in one request is logged as a likely N+1.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.repeat_threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            # Template responses are rendered inside get_response, so template queries are counted too
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else request.path
+        query_stats.add(url_name, recorder)
+
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Time'] = '%.1fms' % (recorder.duration * 1000)
+        logger.debug('%s: %d queries in %.1fms', url_name, recorder.count, recorder.duration * 1000)
+        for sql, n in recorder.repeated(self.repeat_threshold):
+            logger.warning('%s: possible N+1, statement ran %d times: %s', url_name, n, sql)
+        return response
+
+
+class HashingBusyMiddleware(MiddlewareMixin):
+    """Answers 503 with Retry-After when password hashing is at capacity (HashingBusy, see blog/hashing.py), e.g.
+    during a login storm, instead of a server error. Sync and async capable, so under ASGI it doesn't force the
+    async views through async_to_sync."""
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, HashingBusy):
+            response = HttpResponse('Too many people are signing in right now, please try again.', status=503)
+            response['Retry-After'] = '1'
+            return response
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Lets PrimaryReplicaRouter send the request's reads to replicas, see blog/routers.py.
+
+    A request that wrote to the primary sets a cookie keeping that browser's reads on the primary for
+    READ_YOUR_WRITES_SECONDS, long enough for the replicas to catch up with the write. Not installed unless
+    settings.DATABASE_REPLICAS is set.
+    """
+    cookie_name = 'primary_until'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.window = getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5)
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            pinned_until = 0.0
+        with request_routing(pinned_until) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            response.set_cookie(self.cookie_name, '%.3f' % (time.time() + self.window), max_age=self.window,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SALT = 'blog.middleware.profile'
+
+
+def profile_token():
+    """Value for the X-Profile request header that makes ProfilingMiddleware profile the request, valid for
+    PROFILE_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign('profile')
+
+
+class ProfilingMiddleware:
+    """Profiles a sample of requests with cProfile and writes each profile to PROFILE_DIR/<url name>/.
+
+    Enabled with settings.PROFILING. One request in PROFILE_SAMPLE_RATE is profiled at random (0 samples none),
+    as is any request whose X-Profile header carries a token from profile_token(), so a slow page can be
+    profiled on demand. Requests that aren't sampled only pay for one random number. The profile_report
+    command merges the files into a hot function report per view. cProfile only sees the request's own
+    thread, work the async views hand to worker threads is not included.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 100)
+        self.directory = settings.PROFILE_DIR
+        self.token_max_age = getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 60 * 60)
+        self.header = 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_')
+
+    def __call__(self, request):
+        if not self.sampled(request):
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this thread
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+        response[PROFILE_HEADER] = self.save(request, profile)
+        return response
+
+    def sampled(self, request):
+        if self.rate and random.randrange(self.rate) == 0:
+            return True
+        token = request.META.get(self.header)
+        if not token:
+            return False
+        try:
+            signing.TimestampSigner(salt=PROFILE_SALT).unsign(token, max_age=self.token_max_age)
+        except signing.BadSignature:
+            return False
+        return True
+
+    def save(self, request, profile):
+        """Write the profile under the request's URL name, returns its path relative to PROFILE_DIR."""
+        match = getattr(request, 'resolver_match', None)
+        url_name = re.sub(r'[^\w.-]', '_', match.view_name) if match and match.view_name else '_unresolved'
+        name = os.path.join(url_name, '%d-%d-%d.prof' % (time.time_ns(), os.getpid(), threading.get_ident()))
+        os.makedirs(os.path.join(self.directory, url_name), exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, name))
+        return name
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_statistics(apps, schema_editor):
+    Blog = apps.get_model('blog', 'Blog')
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    User = apps.get_model('auth', 'User')
+    SiteStatistics = apps.get_model('blog', 'SiteStatistics')
+    SiteStatistics.objects.create(
+        pk=1,
+        num_blogs=Blog.objects.count(),
+        num_users=User.objects.count(),
+        num_posts=Post.objects.count(),
+        num_comments=Comment.objects.count(),
+        latest_post=Post.objects.order_by('-posted_on', '-id').first(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('blog', '0010_auto_20261018_1729'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_blogs', models.PositiveIntegerField(default=0)),
+                ('num_users', models.PositiveIntegerField(default=0)),
+                ('num_posts', models.PositiveIntegerField(default=0)),
+                ('num_comments', models.PositiveIntegerField(default=0)),
+                ('latest_post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='blog.post')),
+            ],
+            options={
+                'verbose_name_plural': 'site statistics',
+            },
+        ),
+        migrations.RunPython(populate_statistics, migrations.RunPython.noop),
+    ]
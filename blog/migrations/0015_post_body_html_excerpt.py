@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:58
+
+import importlib
+
+from django.db import migrations, models
+
+# SQLite adds and removes columns by rebuilding blog_post, which drops the triggers feeding the full-text index
+# from 0013. The index itself keys on the unchanged post ids, so recreating the triggers is enough.
+fts = importlib.import_module('blog.migrations.0013_post_fts')
+TRIGGER_SQL = [sql for sql in fts.CREATE_SQL if sql.startswith('CREATE TRIGGER')]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_replicationheartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, fts.run(TRIGGER_SQL)),
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(fts.run(TRIGGER_SQL), migrations.RunPython.noop),
+    ]
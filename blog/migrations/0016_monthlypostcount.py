@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def populate_counts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    MonthlyPostCount = apps.get_model('blog', 'MonthlyPostCount')
+    months = Post.objects.annotate(m=TruncMonth('posted_on')).order_by()
+    per_blog = months.exclude(blog=None).values('blog', 'm').annotate(n=Count('id'))
+    site = months.values('m').annotate(n=Count('id'))
+    MonthlyPostCount.objects.bulk_create(
+        [MonthlyPostCount(blog_id=row['blog'], month=row['m'], count=row['n']) for row in per_blog]
+        + [MonthlyPostCount(blog=None, month=row['m'], count=row['n']) for row in site],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_body_html_excerpt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyPostCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month.')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('blog', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.blog')),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlypostcount',
+            constraint=models.UniqueConstraint(fields=('blog', 'month'), name='monthly_post_count_blog_month_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlypostcount',
+            constraint=models.UniqueConstraint(condition=models.Q(('blog', None)), fields=('month',), name='monthly_post_count_site_month_uniq'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
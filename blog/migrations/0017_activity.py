@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import itertools
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.text import Truncator
+
+
+def backfill_activity(apps, schema_editor):
+    """Same events as Activity.backfill(), which historical models don't have."""
+    Blog = apps.get_model('blog', 'Blog')
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    Activity = apps.get_model('blog', 'Activity')
+    blogs = (Activity(kind='blog', created=row['user__date_joined'], user_id=row['user'], blog_id=row['id'],
+                      summary=row['name'][:200])
+             for row in Blog.objects.values('id', 'name', 'user', 'user__date_joined').iterator())
+    posts = (Activity(kind='post', created=datetime.combine(row['posted_on'], time(0), tzinfo=timezone.utc),
+                      user_id=row['author'], blog_id=row['blog'], post_id=row['id'], summary=row['title'][:200])
+             for row in Post.objects.values('id', 'title', 'author', 'blog', 'posted_on').iterator())
+    comments = (Activity(kind='comment', created=row['last_modified'], user_id=row['user'], blog_id=row['post__blog'],
+                         post_id=row['post'], comment_id=row['id'],
+                         summary=Truncator(' '.join(row['text'].split())).chars(200))
+                for row in Comment.objects.values('id', 'text', 'user', 'post', 'post__blog', 'last_modified').iterator())
+    events = itertools.chain(blogs, posts, comments)
+    for batch in iter(lambda: list(itertools.islice(events, 2000)), []):
+        Activity.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blog', '0016_monthlypostcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('blog', 'new blog'), ('post', 'new post'), ('comment', 'new comment')], max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('summary', models.CharField(max_length=200)),
+                ('blog', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.blog')),
+                ('comment', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.comment')),
+                ('post', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+                ('user', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'activities',
+                'ordering': ['-created', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-created', '-id'], name='activity_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', '-created', '-id'], name='activity_user_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['blog', '-created', '-id'], name='activity_blog_created_id_idx'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_activity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-posted_on', '-id'], name='comment_posted_on_id_idx'),
+        ),
+    ]
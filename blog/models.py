@@ -1,12 +1,25 @@
-from django.db import models
+import itertools
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Subquery
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, LPad, TruncMonth
 from django.contrib.auth.models import User
-from datetime import date
+from django.utils import timezone
+from django.utils.html import linebreaks
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+from datetime import date, datetime, time
+
+EXCERPT_WORDS = 30
 
 # Create your models here.
 class Blog(models.Model):
      name = models.CharField(max_length=200, help_text="Enter the name of your blog.")
      user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+     def __str__(self):
+         return self.name
+
 class Post(models.Model):
     title = models.CharField(max_length=200, help_text="Title of the post.", blank=False)
     blog = models.ForeignKey(Blog, on_delete=models.SET_NULL, null=True)
@@ -14,13 +27,295 @@ class Post(models.Model):
     body = models.TextField()
     posted_on = models.DateField(auto_now_add=True) # Automatically set the field to now when the object is first created, cannot be edited
     last_modified = models.DateField(default=date.today)
+    # Denormalized from Comment by blog/signals.py so the detail page never has to count comments
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Derived from body by render_body() whenever the post is saved, so pages never re-render or load the raw body
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
 
     class Meta: 
-        ordering = ['-posted_on']
+        ordering = ['-posted_on', '-id']
+        indexes = [
+            # Keyset pagination walks these newest first, see blog/pagination.py
+            models.Index(fields=['-posted_on', '-id'], name='post_posted_on_id_idx'),
+            models.Index(fields=['blog', '-posted_on', '-id'], name='post_blog_posted_on_id_idx'),
+        ]
+
+    # Columns the post listings display, for .only()
+    LIST_FIELDS = ('id', 'title', 'posted_on', 'blog')
+
+    def __str__(self):
+        return self.title
+
+    def save(self, *args, **kwargs):
+        self.render_body()
+        if not self._state.adding:
+            # Edits count as modifications, the snapshot command re-renders pages by it
+            self.last_modified = date.today()
+        if kwargs.get('update_fields') is not None:
+            if 'body' in kwargs['update_fields']:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'body_html', 'excerpt'}
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'last_modified'}
+        super().save(*args, **kwargs)
+
+    def render_body(self):
+        """Fill in body_html and excerpt from body. save() calls this, bulk_create callers have to do it themselves."""
+        self.body_html = linebreaks(self.body, autoescape=True)
+        self.excerpt = Truncator(' '.join(self.body.split())).words(EXCERPT_WORDS)[:300]
+
+    @property
+    def rendered_body(self):
+        # Rows saved before body_html existed are rendered on the fly until render_posts has backfilled them
+        if not self.body_html:
+            self.render_body()
+        return mark_safe(self.body_html)
+
+    @classmethod
+    def recount_comments(cls, **filters):
+        """Recompute comment_count and last_comment_at from the comment table, for backfills and reconciliation."""
+        comments = Comment.objects.filter(post=models.OuterRef('pk')).order_by()
+        return cls.objects.filter(**filters).update(
+            comment_count=Coalesce(Subquery(comments.values('post').annotate(n=Count('id')).values('n')), 0),
+            last_comment_at=Subquery(comments.order_by('-id').values('last_modified')[:1]),
+        )
+
+# Comment.path holds the ids of a comment's ancestors followed by its own, each zero padded to PATH_STEP digits.
+# Sorting a post's comments by path lists every thread depth first with each reply under its parent, and a comment
+# with all of its replies is one range of the (post, path) index.
+PATH_STEP = 10
+MAX_DEPTH = 25
+
+def path_segment(pk):
+    return '%0*d' % (PATH_STEP, pk)
 
 class Comment(models.Model):
     text = models.TextField(help_text="Body of the comment")
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True)
+    # Indexed as the leading column of the indexes in Meta
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, db_index=False)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     posted_on = models.DateField(auto_now_add=True)
-    last_modified = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    last_modified = models.DateTimeField(auto_now=True)
+    # Set by save() once the id is known, bulk_create callers have to call fill_paths()
+    path = models.CharField(max_length=PATH_STEP * MAX_DEPTH, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            # A post's latest comment, read when one is deleted (Post.recount_comments(), blog/signals.py)
+            models.Index(fields=['post', '-id'], name='comment_post_id_idx'),
+            # The admin changelist, newest first and filtered by date
+            models.Index(fields=['-posted_on', '-id'], name='comment_posted_on_id_idx'),
+        ]
+
+    def __str__(self):
+        return Truncator(' '.join(self.text.split())).chars(50)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        ancestors = self.ancestors_path()
+        # No savepoint inside the request's transaction, the two statements just have to commit together
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            self.path = ancestors + path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def ancestors_path(self):
+        """Path of the comment this new one answers, '' on the post itself. Replies to the deepest comments join
+        the thread as siblings of the comment they answer, so this may move the comment up to its grandparent."""
+        if self.parent_id is None:
+            return ''
+        ancestors = self.parent.path
+        if len(ancestors) >= PATH_STEP * MAX_DEPTH:
+            ancestors = ancestors[:-PATH_STEP]
+            self.parent_id = int(ancestors[-PATH_STEP:])
+        return ancestors
+
+    @property
+    def depth(self):
+        """0 for comments on the post, 1 for their replies and so on."""
+        return max(len(self.path) // PATH_STEP - 1, 0)
+
+    def subtree(self):
+        """This comment followed by all of its replies, depth first, in one range scan."""
+        return Comment.objects.filter(post=self.post_id, path__gte=self.path, path__lt=self.path + ':').order_by('path')
+
+    @classmethod
+    def thread(cls, post):
+        """Every comment on `post`, depth first, in one range scan."""
+        return cls.objects.filter(post=post).order_by('path')
+
+    @classmethod
+    def fill_paths(cls, **filters):
+        """Set path on comments inserted with bulk_create, one UPDATE per level of the threads."""
+        comments = cls.objects.filter(path='', **filters)
+        segment = LPad(Cast('id', models.CharField()), PATH_STEP, models.Value('0'))
+        filled = comments.filter(parent=None).update(path=segment)
+        parent_path = cls.objects.filter(pk=models.OuterRef('parent')).values('path')[:1]
+        while True:
+            level = comments.filter(parent__path__gt='').update(path=Concat(Subquery(parent_path), segment))
+            if not level:
+                return filled
+            filled += level
+
+# The index page only links to the latest post
+LATEST_POST_DEFERRED = ['latest_post__body', 'latest_post__body_html', 'latest_post__excerpt']
+
+class SiteStatistics(models.Model):
+    """Denormalized site wide counters for the index page, kept up to date by the receivers in blog/signals.py.
+    There is only ever one row, use SiteStatistics.load() to read it with a single query."""
+    num_blogs = models.PositiveIntegerField(default=0)
+    num_users = models.PositiveIntegerField(default=0)
+    num_posts = models.PositiveIntegerField(default=0)
+    num_comments = models.PositiveIntegerField(default=0)
+    latest_post = models.ForeignKey(Post, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        verbose_name_plural = 'site statistics'
+
+    @classmethod
+    def load(cls):
+        try:
+            return cls.objects.select_related('latest_post').defer(*LATEST_POST_DEFERRED).get(pk=1)
+        except cls.DoesNotExist:
+            return cls.recompute()
+
+    @classmethod
+    def increment(cls, field, delta=1):
+        """Atomically adjust a counter in the database, rebuilding the row if it does not exist yet. Counters that
+        drifted low (rows bulk inserted without counting them) stop at 0 rather than failing the delete that
+        decrements them, reconcile_stats brings them back."""
+        if not cls.objects.filter(pk=1).update(**{field: Greatest(models.F(field) + delta, 0)}):
+            cls.recompute()
+
+    @classmethod
+    def recompute(cls):
+        """Recount everything from the source tables. Expensive, only for bootstrap and reconciliation."""
+        stats, _ = cls.objects.update_or_create(pk=1, defaults={
+            'num_blogs': Blog.objects.count(),
+            'num_users': User.objects.count(),
+            'num_posts': Post.objects.count(),
+            'num_comments': Comment.objects.count(),
+            'latest_post': Post.objects.order_by('-posted_on', '-id').first(),
+        })
+        return stats
+
+class MonthlyPostCount(models.Model):
+    """Number of posts per calendar month, per blog and site wide (blog is null), for the archive sidebar.
+    Kept up to date by the receivers in blog/signals.py so the archive never has to GROUP BY the post table."""
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    month = models.DateField(help_text="First day of the month.")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['blog', 'month'], name='monthly_post_count_blog_month_uniq'),
+            # NULLs never collide in a unique index, the site wide rows need their own
+            models.UniqueConstraint(fields=['month'], condition=models.Q(blog=None), name='monthly_post_count_site_month_uniq'),
+        ]
+
+    @classmethod
+    def adjust(cls, blog_id, posted_on, delta=1):
+        """Add `delta` to the month of `posted_on`, for the blog and for the whole site."""
+        month = posted_on.replace(day=1)
+        for blog in {blog_id, None}:
+            rows = cls.objects.filter(blog=blog, month=month)
+            if rows.update(count=Greatest(models.F('count') + delta, 0)) or delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(blog_id=blog, month=month, count=delta)
+            except IntegrityError:
+                # Created by a concurrent request since the update above
+                rows.update(count=models.F('count') + delta)
+
+    @classmethod
+    def recompute(cls):
+        """Recount every month from the post table. Expensive, only for bootstrap and after bulk inserts."""
+        months = Post.objects.annotate(m=TruncMonth('posted_on')).order_by()
+        per_blog = months.exclude(blog=None).values('blog', 'm').annotate(n=Count('id'))
+        site = months.values('m').annotate(n=Count('id'))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [cls(blog_id=row['blog'], month=row['m'], count=row['n']) for row in per_blog]
+                + [cls(blog=None, month=row['m'], count=row['n']) for row in site],
+                batch_size=1000,
+            )
+
+class Activity(models.Model):
+    """Append-only timeline of new blogs, posts and comments, written when they are created (receivers in
+    blog/signals.py, save_comments() in blog/ingest.py) so no timeline has to merge the source tables.
+    Each row carries the ids and text the timeline displays, and the site, user and blog timelines are each a range
+    scan over one of the (..., created, id) indexes."""
+    BLOG, POST, COMMENT = 'blog', 'post', 'comment'
+    KINDS = [(BLOG, 'new blog'), (POST, 'new post'), (COMMENT, 'new comment')]
+    SUMMARY_LENGTH = 200
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    created = models.DateTimeField(default=timezone.now)
+    # user and blog are covered by the composite indexes below, post and comment need their own for cascades
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, db_index=False, related_name='+')
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, null=True, db_index=False, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, related_name='+')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, related_name='+')
+    summary = models.CharField(max_length=SUMMARY_LENGTH)
+
+    class Meta:
+        verbose_name_plural = 'activities'
+        ordering = ['-created', '-id']
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='activity_created_id_idx'),
+            models.Index(fields=['user', '-created', '-id'], name='activity_user_created_id_idx'),
+            models.Index(fields=['blog', '-created', '-id'], name='activity_blog_created_id_idx'),
+        ]
+
+    @classmethod
+    def for_blog(cls, blog, created=None):
+        return cls(kind=cls.BLOG, created=created or timezone.now(), user_id=blog.user_id, blog_id=blog.pk,
+                   summary=blog.name[:cls.SUMMARY_LENGTH])
+
+    @classmethod
+    def for_post(cls, post, created=None):
+        return cls(kind=cls.POST, created=created or timezone.now(), user_id=post.author_id, blog_id=post.blog_id,
+                   post_id=post.pk, summary=post.title[:cls.SUMMARY_LENGTH])
+
+    @classmethod
+    def for_comment(cls, comment, blog_id, created=None):
+        summary = Truncator(' '.join(comment.text.split())).chars(cls.SUMMARY_LENGTH)
+        return cls(kind=cls.COMMENT, created=created or timezone.now(), user_id=comment.user_id, blog_id=blog_id,
+                   post_id=comment.post_id, comment_id=comment.pk, summary=summary)
+
+    @classmethod
+    def backfill(cls, blogs=None, posts=None, comments=None, batch_size=2000):
+        """Record the events of existing objects, for rows inserted with bulk_create. Blogs are dated by their
+        owner joining and posts by their posting day, the closest the source tables have to a creation time."""
+        def midnight(day):
+            return datetime.combine(day, time(0), tzinfo=timezone.utc)
+
+        blogs = Blog.objects.none() if blogs is None else blogs
+        posts = Post.objects.none() if posts is None else posts
+        comments = Comment.objects.none() if comments is None else comments
+
+        events = itertools.chain(
+            (cls.for_blog(blog, blog.user.date_joined)
+             for blog in blogs.select_related('user').only('name', 'user', 'user__date_joined').iterator()),
+            (cls.for_post(post, midnight(post.posted_on))
+             for post in posts.only('title', 'author', 'blog', 'posted_on').iterator()),
+            (cls.for_comment(comment, comment.post.blog_id if comment.post else None, comment.last_modified)
+             for comment in comments.select_related('post').only('text', 'user', 'post', 'post__blog', 'last_modified').iterator()),
+        )
+        for batch in iter(lambda: list(itertools.islice(events, batch_size)), []):
+            cls.objects.bulk_create(batch)
+
+class ReplicationHeartbeat(models.Model):
+    """Single row rewritten on the primary by the replicate command. How old a replica's copy is tells the router
+    in blog/routers.py how far behind the replica is."""
+    beat = models.DateTimeField()
+
+    @classmethod
+    def touch(cls):
+        cls.objects.update_or_create(pk=1, defaults={'beat': timezone.now()})
@@ -0,0 +1,154 @@
+"""Keyset (cursor) pagination.
+
+Instead of OFFSET/LIMIT, each page starts strictly after the sort key of the last
+row on the previous page, so the database does an index range scan and page N
+costs the same as page 1. The cursor handed to the client is an opaque,
+url-safe encoding of that sort key.
+"""
+import base64
+import binascii
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import F, Q, Subquery
+from django.http import Http404
+
+
+def encode_cursor(values):
+    """Pack the sort key of a row into an opaque url-safe token."""
+    raw = '|'.join(value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Unpack a token made by encode_cursor() into its `length` raw string values."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidPage('Invalid cursor.')
+    parts = raw.split('|')
+    if len(parts) != length:
+        raise InvalidPage('Invalid cursor.')
+    return parts
+
+
+class KeysetPage:
+    """A single page of results plus the cursor needed to fetch the next one."""
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        """Keyset pages only know whether they are the first page, so 'previous' links back to the start."""
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginates a queryset on a two column key, e.g. ('-posted_on', '-id').
+
+    The last column must be unique (normally the primary key) so the key gives a total order.
+    A composite index matching `ordering` is what makes each page a cheap range scan.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-posted_on', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+        # Fetch one extra row to find out whether there is a next page without a COUNT(*)
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        return KeysetPage(rows, cursor or None, next_cursor)
+
+    def _after(self, values):
+        """Build the `(a, b) < (x, y)` row comparison as an OR of two Q objects."""
+        (first, second), (first_value, second_value) = self.fields, values
+        first_op = 'lt' if self.ordering[0].startswith('-') else 'gt'
+        second_op = 'lt' if self.ordering[1].startswith('-') else 'gt'
+        return (Q(**{'%s__%s' % (first, first_op): first_value})
+                | Q(**{first: first_value, '%s__%s' % (second, second_op): second_value}))
+
+    def encode_cursor(self, obj):
+        return encode_cursor(getattr(obj, name) for name in self.fields)
+
+    def decode_cursor(self, cursor):
+        parts = decode_cursor(cursor, len(self.fields))
+        model_fields = [self.queryset.model._meta.get_field(name) for name in self.fields]
+        try:
+            return [field.to_python(part) for field, part in zip(model_fields, parts)]
+        except ValidationError:
+            raise InvalidPage('Invalid cursor.')
+
+
+class ThreadPaginator:
+    """Paginates comment threads `per_page` top-level comments at a time, each page holding those comments with all
+    of their replies in depth first order.
+
+    Comments sort by their materialized path (see Comment.path), so a page is a single range of the (post, path)
+    index: from the path of its first top-level comment up to that of the next page's first one, which a scalar
+    subquery finds in the same query. That path is the cursor of the next page.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    def page(self, cursor=None):
+        start = self.decode_cursor(cursor) if cursor else ''
+        following = self.queryset.filter(parent=None, path__gte=start).order_by('path').values('path')
+        next_root = Subquery(following[self.per_page:self.per_page + 1])
+        rows = list(self.queryset.filter(path__gte=start).annotate(next_root=next_root)
+                    .filter(Q(next_root=None) | Q(path__lt=F('next_root'))).order_by('path'))
+        next_cursor = encode_cursor([rows[0].next_root]) if rows and rows[0].next_root else None
+        return KeysetPage(rows, cursor or None, next_cursor)
+
+    def decode_cursor(self, cursor):
+        path, = decode_cursor(cursor, 1)
+        if not path.isdigit():
+            raise InvalidPage('Invalid cursor.')
+        return path
+
+
+class KeysetPaginationMixin:
+    """View mixin that paginates with KeysetPaginator, reading the cursor from ?after=."""
+    paginate_by = 20
+    cursor_kwarg = 'after'
+    keyset_ordering = ('-posted_on', '-id')
+
+    def get_keyset_paginator(self, queryset, per_page):
+        return KeysetPaginator(queryset, per_page, self.keyset_ordering)
+
+    def paginate_keyset(self, queryset, per_page=None):
+        paginator = self.get_keyset_paginator(queryset, per_page or self.paginate_by)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page
+
+    def paginate_queryset(self, queryset, page_size):
+        """Hook used by MultipleObjectMixin (ListView) so keyset pages drop straight into `page_obj`."""
+        paginator, page = self.paginate_keyset(queryset, page_size)
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,138 @@
+"""Primary/replica database routing.
+
+Writes always go to the primary ('default'). Reads made while handling a request go to a random healthy replica from
+settings.DATABASE_REPLICAS, except:
+
+* after the request itself wrote something, and for READ_YOUR_WRITES_SECONDS after that on the same browser
+  (ReadYourWritesMiddleware carries this over in a cookie), so users always see their own changes;
+* inside a transaction on the primary, which must see its own uncommitted rows;
+* when a page depends on a version counter (blog/cache.py) bumped less than REPLICA_MAX_LAG seconds ago, so a
+  replica that hasn't caught up can't be cached under the new version;
+* when every replica lags more than REPLICA_MAX_LAG behind, measured from the heartbeat row the replicate command
+  writes on the primary.
+
+Reads outside of a request (management commands, shell) always use the primary.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+
+class RoutingState:
+    """Per-request routing flags, shared by every thread working on the request."""
+
+    def __init__(self, pinned_until=0.0):
+        self.pinned_until = pinned_until
+        self.wrote = False
+        self.primary = False
+
+    @property
+    def pinned(self):
+        return self.wrote or self.primary or time.time() < self.pinned_until
+
+
+routing_state = contextvars.ContextVar('routing_state', default=None)
+
+
+@contextmanager
+def request_routing(pinned_until=0.0):
+    """Route the reads made inside the block to replicas, used by ReadYourWritesMiddleware around each request."""
+    state = RoutingState(pinned_until)
+    token = routing_state.set(state)
+    try:
+        yield state
+    finally:
+        routing_state.reset(token)
+
+
+def pin_to_primary():
+    """Send every remaining read of the current request to the primary."""
+    state = routing_state.get()
+    if state is not None:
+        state.primary = True
+
+
+def note_write():
+    """Record a write made on the request's behalf by another thread, which the router could not see."""
+    state = routing_state.get()
+    if state is not None:
+        state.wrote = True
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary according to its copy of the heartbeat, None if unknown."""
+    from blog.models import ReplicationHeartbeat
+    try:
+        beat = ReplicationHeartbeat.objects.using(alias).values_list('beat', flat=True).first()
+    except DatabaseError:
+        return None
+    return None if beat is None else (timezone.now() - beat).total_seconds()
+
+
+class ReplicaHealth:
+    """Caches which replicas are within REPLICA_MAX_LAG, rechecking each at most every REPLICA_CHECK_INTERVAL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    def healthy(self, aliases):
+        now = time.monotonic()
+        interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 1)
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG', 5)
+        healthy = []
+        for alias in aliases:
+            with self._lock:
+                checked_at, ok = self._checked.get(alias, (None, False))
+            if checked_at is None or now - checked_at >= interval:
+                lag = replica_lag(alias)
+                ok = lag is not None and lag <= max_lag
+                with self._lock:
+                    self._checked[alias] = (now, ok)
+            if ok:
+                healthy.append(alias)
+        return healthy
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+
+    @property
+    def replicas(self):
+        return getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.pinned or not self.replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        healthy = replica_health.healthy(self.replicas)
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return False if db in self.replicas else None
@@ -0,0 +1,96 @@
+"""Full-text search over Post title and body.
+
+On SQLite this queries the blog_post_fts FTS5 index created in migration 0013, ranked with bm25()
+(title matches weigh more than body matches) and paginated on the (rank, id) key. Other database
+backends fall back to an icontains scan so the view keeps working, just slowly.
+"""
+import re
+
+from django.core.paginator import InvalidPage
+from django.db import router, connections
+from django.db.models import F, Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from blog.models import Post
+from blog.pagination import KeysetPage, KeysetPaginator, encode_cursor, decode_cursor
+
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+# Control characters cannot appear in the escaped snippet, so they are safe to swap for <mark> tags afterwards
+MARK_START, MARK_END = '\x02', '\x03'
+
+# Rank and page on the FTS table alone first, then join and build snippets for just the rows on the page.
+# SQLite would otherwise compute the snippet and joins for every match before sorting.
+SEARCH_SQL = """
+    WITH page AS (
+        SELECT rowid AS id, bm25(blog_post_fts, %(weights)s) AS rank
+        FROM blog_post_fts
+        WHERE blog_post_fts MATCH %%s %(after)s
+        ORDER BY rank, rowid
+        LIMIT %%s
+    )
+    SELECT blog_post.id, blog_post.title, blog_post.blog_id, blog_post.author_id, blog_post.posted_on,
+           auth_user.username AS author_username, page.rank AS rank,
+           (SELECT snippet(blog_post_fts, -1, %%s, %%s, '...', 16) FROM blog_post_fts
+            WHERE blog_post_fts MATCH %%s AND rowid = page.id) AS snippet
+    FROM page
+    JOIN blog_post ON blog_post.id = page.id
+    LEFT JOIN auth_user ON auth_user.id = blog_post.author_id
+    ORDER BY page.rank, page.id
+"""
+
+AFTER_SQL = 'AND (bm25(blog_post_fts, %(weights)s) > %%s OR (bm25(blog_post_fts, %(weights)s) = %%s AND rowid > %%s))'
+
+_TOKEN = re.compile(r'\w+')
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that matches every word, quoting each one so user input can't inject FTS syntax."""
+    return ' '.join('"%s"' % token for token in _TOKEN.findall(text))
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_posts(text, per_page=20, cursor=None):
+    """Return a KeysetPage of matching posts, best match first. Each post carries `rank`, `snippet` and `author_username`."""
+    query = fts_query(text)
+    if not query:
+        return KeysetPage([], cursor, None)
+    alias = router.db_for_read(Post)
+    if connections[alias].vendor != 'sqlite':
+        return _search_posts_icontains(text, per_page, cursor)
+
+    weights = '%s, %s' % (TITLE_WEIGHT, BODY_WEIGHT)
+    params = [query]
+    after = ''
+    if cursor:
+        rank, pk = decode_cursor(cursor, 2)
+        try:
+            rank, pk = float(rank), int(pk)
+        except ValueError:
+            raise InvalidPage('Invalid cursor.')
+        after = AFTER_SQL % {'weights': weights}
+        params += [rank, rank, pk]
+    sql = SEARCH_SQL % {'weights': weights, 'after': after}
+    rows = list(Post.objects.using(alias).raw(sql, params + [per_page + 1, MARK_START, MARK_END, query]))
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([rows[-1].rank, rows[-1].pk])
+    for post in rows:
+        post.snippet = highlight(post.snippet)
+    return KeysetPage(rows, cursor, next_cursor)
+
+
+def _search_posts_icontains(text, per_page, cursor):
+    queryset = Post.objects.filter(Q(title__icontains=text) | Q(body__icontains=text)).annotate(
+        author_username=F('author__username')).only(*Post.LIST_FIELDS, 'author', 'excerpt')
+    page = KeysetPaginator(queryset, per_page).page(cursor)
+    for post in page:
+        post.snippet = escape(post.excerpt)
+    return page
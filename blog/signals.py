@@ -0,0 +1,148 @@
+"""Signal receivers that keep denormalized data in sync with Blog, Post, Comment and User. Connected in BlogConfig.ready()."""
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from blog.auth import user_cache
+from blog.cache import bump_version, user_blog_key
+from blog.models import Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics
+
+COUNTERS = {
+    Blog: 'num_blogs',
+    User: 'num_users',
+    Post: 'num_posts',
+    Comment: 'num_comments',
+}
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        SiteStatistics.increment(COUNTERS[sender])
+
+
+@receiver(post_delete, sender=Blog)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def count_deleted(sender, instance, **kwargs):
+    SiteStatistics.increment(COUNTERS[sender], -1)
+
+
+@receiver(post_save, sender=Post)
+def track_latest_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        SiteStatistics.objects.filter(pk=1).update(latest_post=instance)
+
+
+@receiver(post_delete, sender=Post)
+def replace_latest_post(sender, instance, **kwargs):
+    # Deleting the latest post has already nulled the FK, find the next newest through the (posted_on, id) index
+    newest = Post.objects.order_by('-posted_on', '-id').values('pk')[:1]
+    SiteStatistics.objects.filter(pk=1, latest_post__isnull=True).update(latest_post=newest)
+
+
+@receiver(post_save, sender=Post)
+def count_post_month(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.posted_on:
+        MonthlyPostCount.adjust(instance.blog_id, instance.posted_on)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post_month(sender, instance, **kwargs):
+    if instance.posted_on:
+        MonthlyPostCount.adjust(instance.blog_id, instance.posted_on, -1)
+
+
+@receiver(post_save, sender=Blog)
+def record_blog_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Activity.for_blog(instance).save()
+
+
+@receiver(post_save, sender=Post)
+def record_post_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Activity.for_post(instance).save()
+
+
+@receiver(post_save, sender=Comment)
+def record_comment_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Activity.for_comment(instance, instance.post.blog_id if instance.post_id else None).save()
+
+
+@receiver(post_save, sender=Comment)
+def count_post_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.post_id:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1,
+            last_comment_at=instance.last_modified,
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_post_comment(sender, instance, **kwargs):
+    if instance.post_id:
+        latest = Comment.objects.filter(post=instance.post_id).order_by('-id').values('last_modified')[:1]
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=Greatest(F('comment_count') - 1, 0),
+            last_comment_at=Subquery(latest),
+        )
+
+
+def bump_on_commit(kind, pk):
+    # Bump after commit so a concurrent request can't re-cache the old rows under the new version
+    if pk is not None:
+        transaction.on_commit(lambda: bump_version(kind, pk))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    bump_on_commit('post', instance.pk)
+    bump_on_commit('blog', instance.blog_id)
+    bump_on_commit('posts', 'all')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    bump_on_commit('post', instance.post_id)
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_delete, sender=Blog)
+def invalidate_blog(sender, instance, **kwargs):
+    bump_on_commit('blog', instance.pk)
+    bump_on_commit('blogs', 'all')
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_delete, sender=Blog)
+def forget_user_blog(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        key = user_blog_key(instance.user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    # Dropped locally at once so this request's own later lookups see the change, other processes after commit
+    user_cache.invalidate(instance.pk)
+    bump_on_commit('user', instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(sender, user)
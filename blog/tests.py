@@ -1,3 +1,1338 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import StringIO
+from urllib.parse import urlencode
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path, reverse
+
+from blog import async_views
+from blog.auth import UserCache
+from blog.cache import bump_version, fragment_stats, get_user_blog, get_versions, page_validators, version_key
+from blog.forms import CommentForm
+from blog.hashing import HashingBusy, HashingPool
+from blog.management.commands import blog_import
+from blog.ingest import CommentBuffer, save_comments
+from blog.middleware import QueryRecorder, ReadYourWritesMiddleware, profile_token, query_stats
+from blog.models import MAX_DEPTH, PATH_STEP, Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics, path_segment
+from blog.pagination import KeysetPaginator, ThreadPaginator
+from blog.routers import PrimaryReplicaRouter, replica_health, request_routing
+from blog.search import search_posts
+from miniblog.static import CompressedManifestStaticFilesStorage, StaticFileIndex, StaticFilesWSGI
+
+# The cached sessions and users that settings.py enables with a shared (redis) cache. A test run is one process, so
+# its locmem cache is shared by every request.
+shared_cache = override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                                 AUTHENTICATION_BACKENDS=['blog.auth.CachedModelBackend'])
+
+# Maximum queries each view may run for a logged-in user who owns a blog. Sessions and users are served from the
+# cache (blog/auth.py), the first request of the test (index) pays for loading the user.
+QUERY_BUDGETS = {
+    'index': 3,
+    'blog-list': 1,
+    'user-list': 1,
+    'post-list': 2,
+    'post-archive-month': 1,
+    'blog-archive-month': 2,
+    'search': 1,
+    'activity': 1,
+    'blog-activity': 2,
+    'user-detail': 2,
+    'blog-detail': 3,
+    'post-detail': 2,
+    'post-comments': 1,
+    'comment-create': 9,  # the insert, then the path built from the new id
+}
+
+
+def make_posts(blog, count, start=date(2020, 1, 1)):
+    """Create `count` posts on `blog`, two per day so that keyset ties on posted_on are exercised."""
+    posts = [Post(title='post %d' % i, body='body %d' % i, blog=blog, author=blog.user) for i in range(count)]
+    for post in posts:
+        post.render_body()
+    Post.objects.bulk_create(posts)
+    for i, post in enumerate(Post.objects.filter(blog=blog).order_by('id')):
+        Post.objects.filter(pk=post.pk).update(posted_on=start + timedelta(days=i // 2))
+
+
+class BlogTestCase(TestCase):
+    """TestCase that starts every test with an empty cache, since primary keys are reused between tests."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class QueryBudgetMixin:
+    """Test helper that fails when a request runs more queries than the budget declared for its URL name."""
+    query_budgets = QUERY_BUDGETS
+    repeat_threshold = 2
+
+    def assertQueryBudget(self, url_name, kwargs=None, method='get', data=None, budget=None):
+        budget = self.query_budgets[url_name] if budget is None else budget
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = getattr(self.client, method)(reverse(url_name, kwargs=kwargs), data)
+        if recorder.count > budget:
+            repeated = ''.join('\n  %dx %s' % (n, sql) for sql, n in recorder.repeated(self.repeat_threshold))
+            self.fail('%s ran %d queries, budget is %d.%s' % (url_name, recorder.count, budget, repeated))
+        return response
+
+
+@shared_cache
+class UserCacheTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('rosa', password='pw')
+        self.client.force_login(self.user)
+
+    def auth_queries(self, url, method='get', data=None):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = getattr(self.client, method)(url, data)
+        return response, [sql for sql in recorder.fingerprints if 'auth_user' in sql or 'django_session' in sql]
+
+    def test_logged_in_requests_make_no_auth_queries(self):
+        self.client.get(reverse('blog-list'))
+        response, queries = self.auth_queries(reverse('blog-list'))
+        self.assertTrue(response.context['user'].is_authenticated)
+        self.assertEqual(queries, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Blog.objects.create(name='rosa blog', user=self.user)
+        response, queries = self.auth_queries(reverse('post-create'), 'post', {'title': 't', 'body': 'b'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(queries, [])
+        self.assertEqual(Post.objects.get().author, self.user)
+
+    def test_password_change_ends_cached_sessions(self):
+        self.client.get(reverse('blog-list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new')
+            self.user.save()
+        self.assertFalse(self.client.get(reverse('blog-list')).context['user'].is_authenticated)
+
+    def test_changes_in_other_processes_are_seen_through_the_version(self):
+        users = UserCache()
+        loads = []
+        load = lambda pk: loads.append(pk) or User.objects.get(pk=pk)
+        users.get(self.user.pk, load)
+        self.assertEqual(users.get(self.user.pk, load).username, 'rosa')
+        User.objects.filter(pk=self.user.pk).update(username='rosa2')  # no signal, as if saved elsewhere
+        bump_version('user', self.user.pk)
+        self.assertEqual(users.get(self.user.pk, load).username, 'rosa2')
+        self.assertEqual(len(loads), 2)
+
+    def test_lru_eviction_and_ttl(self):
+        other = User.objects.create_user('sam', password='pw')
+        users = UserCache(max_size=1, ttl=60)
+        users.get(self.user.pk, lambda pk: User.objects.get(pk=pk))
+        users.get(other.pk, lambda pk: User.objects.get(pk=pk))
+        self.assertEqual(users.stats()['evictions'], 1)
+        with mock.patch('blog.auth.time.monotonic', return_value=time.monotonic() + 61):
+            users.get(other.pk, lambda pk: User.objects.get(pk=pk))
+        self.assertEqual((users.stats()['hits'], users.stats()['misses']), (0, 3))
+
+    def test_returned_users_are_copies(self):
+        users = UserCache()
+        users.get(self.user.pk, lambda pk: User.objects.get(pk=pk)).username = 'changed'
+        self.assertEqual(users.get(self.user.pk, lambda pk: None).username, 'rosa')
+
+
+class PasswordHashingTests(BlogTestCase):
+
+    def test_registration_hashes_the_password_once(self):
+        with mock.patch('blog.hashing.hashing_pool.run', wraps=HashingPool(workers=0).run) as run:
+            response = self.client.post(reverse('register'), {
+                'username': 'tara', 'password1': 'correct horse battery', 'password2': 'correct horse battery'})
+        self.assertRedirects(response, reverse('index'))
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(int(self.client.session['_auth_user_id']), User.objects.get(username='tara').pk)
+
+    def test_hashes_run_on_the_pool_threads(self):
+        pool = HashingPool(workers=2)
+        self.assertTrue(pool.run(lambda: threading.current_thread().name).startswith('hashing'))
+        self.assertEqual(pool.stats()['pending'], 0)
+
+    def test_full_pool_turns_logins_away(self):
+        User.objects.create_user('uma', password='pw')
+        pool = HashingPool(workers=1, queue_size=1)
+        pool._slots.acquire()  # a hash is already running or waiting
+        with mock.patch('blog.hashing.hashing_pool', pool):
+            response = self.client.post(reverse('login'), {'username': 'uma', 'password': 'pw'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_slow_hashes_time_out(self):
+        pool = HashingPool(workers=1, timeout=0.01)
+        release = threading.Event()
+        with self.assertRaises(HashingBusy):
+            pool.run(release.wait)
+        release.set()
+
+
+class KeysetPaginationTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.blog = Blog.objects.create(name='alice blog', user=cls.user)
+        make_posts(cls.blog, 45)
+
+    def test_pages_cover_every_post_once_in_order(self):
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(post.pk for post in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        expected = list(Post.objects.order_by('-posted_on', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse('post-list'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_listing_query_count_is_independent_of_depth(self):
+        first = self.client.get(reverse('post-list'))
+        cursor = first.context['page_obj'].next_cursor
+        with self.assertNumQueries(1):
+            self.client.get(reverse('post-list'), {'after': cursor})
+
+    def test_blog_and_user_detail_are_paginated(self):
+        response = self.client.get(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk}))
+        self.assertEqual(len(response.context['post_list']), 20)
+        self.assertTrue(response.context['page_obj'].has_next())
+        response = self.client.get(reverse('user-detail', kwargs={'user_pk': self.user.pk}))
+        self.assertEqual(len(response.context['post_list']), 20)
+
+
+@shared_cache
+class QueryBudgetTests(QueryBudgetMixin, BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bob', password='pw')
+        cls.blog = Blog.objects.create(name='bob blog', user=cls.user)
+        make_posts(cls.blog, 30)
+        cls.post = Post.objects.first()
+        Comment.objects.bulk_create(Comment(text='c %d' % i, post=cls.post, user=cls.user) for i in range(30))
+        Post.recount_comments()
+        Comment.fill_paths()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_views_stay_within_budget(self):
+        self.assertQueryBudget('index')
+        self.assertQueryBudget('blog-list')
+        self.assertQueryBudget('user-list')
+        self.assertQueryBudget('post-list')
+        self.assertQueryBudget('search', data={'q': 'body'})
+        self.assertQueryBudget('activity')
+        self.assertQueryBudget('blog-activity', {'blog_pk': self.blog.pk})
+        self.assertQueryBudget('user-detail', {'user_pk': self.user.pk})
+        self.assertQueryBudget('blog-detail', {'blog_pk': self.blog.pk})
+        post_kwargs = {'blog_pk': self.blog.pk, 'post_pk': self.post.pk}
+        self.assertQueryBudget('post-detail', post_kwargs)
+        self.assertQueryBudget('post-comments', post_kwargs)
+        self.assertQueryBudget('post-archive-month', {'year': 2020, 'month': 1})
+        self.assertQueryBudget('blog-archive-month', {'blog_pk': self.blog.pk, 'year': 2020, 'month': 1})
+        data = {'text': 'hi', 'post': self.post.pk, 'user': self.user.pk}
+        self.assertQueryBudget('comment-create', method='post', data=data)
+
+    def test_budget_failure_reports_repeated_statements(self):
+        with self.assertRaisesRegex(AssertionError, 'budget is 0'):
+            self.assertQueryBudget('blog-list', budget=0)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_middleware_records_per_url_name(self):
+        query_stats.reset()
+        response = self.client.get(reverse('post-list'))
+        self.assertIn('X-Query-Count', response)
+        stats = query_stats.snapshot()['post-list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['queries'], int(response['X-Query-Count']))
+
+
+class SiteStatisticsTests(BlogTestCase):
+
+    def test_counters_follow_creates_and_deletes(self):
+        user = User.objects.create_user('carol', password='pw')
+        blog = Blog.objects.create(name='carol blog', user=user)
+        first = Post.objects.create(title='first', body='x', blog=blog, author=user)
+        second = Post.objects.create(title='second', body='y', blog=blog, author=user)
+        Comment.objects.create(text='hi', post=second, user=user)
+
+        stats = SiteStatistics.load()
+        self.assertEqual((stats.num_users, stats.num_blogs, stats.num_posts, stats.num_comments), (1, 1, 2, 1))
+        self.assertEqual(stats.latest_post, second)
+
+        second.delete()
+        stats = SiteStatistics.load()
+        self.assertEqual((stats.num_posts, stats.num_comments), (1, 0))
+        self.assertEqual(stats.latest_post, first)
+
+    def test_counters_do_not_go_below_zero(self):
+        user = User.objects.create_user('carol', password='pw')
+        post = Post.objects.create(title='first', body='x', blog=Blog.objects.create(name='carol blog', user=user), author=user)
+        Comment.objects.bulk_create(Comment(text='c', post=post, user=user) for i in range(3))  # not counted
+        Comment.objects.all().delete()
+        self.assertEqual(SiteStatistics.load().num_comments, 0)
+        SiteStatistics.increment('num_posts', -10)
+        self.assertEqual(SiteStatistics.load().num_posts, 0)
+
+    def test_index_reads_statistics_with_one_query(self):
+        SiteStatistics.recompute()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('index'))
+
+    def test_reconcile_command_fixes_drift(self):
+        user = User.objects.create_user('dave', password='pw')
+        make_posts(Blog.objects.create(name='dave blog', user=user), 5)  # bulk_create bypasses the signals
+        out = StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn('num_posts: 0 -> 5', out.getvalue())
+        self.assertEqual(SiteStatistics.load().num_posts, 5)
+
+
+class CommentThreadTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('erin', password='pw')
+        cls.blog = Blog.objects.create(name='erin blog', user=cls.user)
+        cls.post = Post.objects.create(title='viral', body='x', blog=cls.blog, author=cls.user)
+
+    def test_comment_count_and_timestamp_are_maintained(self):
+        first = Comment.objects.create(text='one', post=self.post, user=self.user)
+        second = Comment.objects.create(text='two', post=self.post, user=self.user)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.post.last_comment_at, second.last_modified)
+
+        second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.last_comment_at, first.last_modified)
+
+    def test_comments_are_paginated_with_load_more(self):
+        Comment.objects.bulk_create(Comment(text='c %d' % i, post=self.post, user=self.user) for i in range(60))
+        Post.recount_comments()
+        Comment.fill_paths()
+        kwargs = {'blog_pk': self.blog.pk, 'post_pk': self.post.pk}
+        response = self.client.get(reverse('post-detail', kwargs=kwargs))
+        self.assertEqual(len(response.context['comment_list']), 50)
+        self.assertContains(response, 'load more comments')
+
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('post-comments', kwargs=kwargs), {'after': cursor})
+        self.assertEqual([c.text for c in response.context['comment_list']], ['c %d' % i for i in range(50, 60)])
+        self.assertNotContains(response, 'load more comments')
+        self.assertNotContains(response, '<html')
+
+    def test_recount_comments_fixes_bulk_inserts(self):
+        Comment.objects.bulk_create(Comment(text='c', post=self.post, user=self.user) for i in range(3))
+        Post.recount_comments(pk=self.post.pk)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 3)
+
+    def test_latest_comment_is_an_index_lookup(self):
+        plan = Comment.objects.filter(post=self.post).order_by('-id').values('last_modified')[:1].explain()
+        self.assertIn('comment_post_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def reply(self, parent, text):
+        return Comment.objects.create(text=text, post=self.post, user=self.user, parent=parent)
+
+    def test_replies_are_listed_under_their_parent(self):
+        first = self.reply(None, 'first')
+        second = self.reply(None, 'second')
+        answer = self.reply(first, 'answer')
+        self.reply(answer, 'answer to answer')
+        self.reply(second, 'answer to second')
+        self.reply(first, 'late answer')
+
+        with self.assertNumQueries(1):
+            thread = [(c.text, c.depth) for c in Comment.thread(self.post)]
+        self.assertEqual(thread, [('first', 0), ('answer', 1), ('answer to answer', 2), ('late answer', 1),
+                                  ('second', 0), ('answer to second', 1)])
+        with self.assertNumQueries(1):
+            self.assertEqual([c.text for c in answer.subtree()], ['answer', 'answer to answer'])
+
+    def test_pages_hold_top_level_comments_with_all_their_replies(self):
+        for i in range(3):
+            parent = self.reply(None, 'top %d' % i)
+            for j in range(2):
+                parent = self.reply(parent, 'reply %d.%d' % (i, j))
+        paginator = ThreadPaginator(Comment.objects.filter(post=self.post), 2)
+        with self.assertNumQueries(1):
+            page = paginator.page()
+        self.assertEqual([c.text for c in page], ['top 0', 'reply 0.0', 'reply 0.1', 'top 1', 'reply 1.0', 'reply 1.1'])
+        page = paginator.page(page.next_cursor)
+        self.assertEqual([c.text for c in page], ['top 2', 'reply 2.0', 'reply 2.1'])
+        self.assertIsNone(page.next_cursor)
+
+        kwargs = {'blog_pk': self.blog.pk, 'post_pk': self.post.pk}
+        response = self.client.get(reverse('post-comments', kwargs=kwargs), {'after': 'bm90IGEgcGF0aA'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_replies_beyond_the_maximum_depth_join_the_deepest_level(self):
+        comment = None
+        for i in range(MAX_DEPTH + 2):
+            comment = self.reply(comment, 'level %d' % i)
+        paths = Comment.thread(self.post).values_list('path', flat=True)
+        self.assertEqual(max(len(path) for path in paths), PATH_STEP * MAX_DEPTH)
+        self.assertEqual(comment.depth, MAX_DEPTH - 1)
+        self.assertEqual(comment.parent.depth, MAX_DEPTH - 2)
+
+    def test_reply_form_rejects_a_comment_on_another_post(self):
+        other = Post.objects.create(title='other', body='y', blog=self.blog, author=self.user)
+        parent = Comment.objects.create(text='elsewhere', post=other, user=self.user)
+        form = CommentForm({'text': 'hi', 'post': self.post.pk, 'user': self.user.pk, 'parent': parent.pk})
+        self.assertFalse(form.is_valid())
+        form = CommentForm({'text': 'hi', 'post': other.pk, 'user': self.user.pk, 'parent': parent.pk})
+        self.assertTrue(form.is_valid())
+
+    def test_bulk_inserted_replies_get_paths(self):
+        first = self.reply(None, 'first')
+        with transaction.atomic():
+            save_comments([Comment(text='buffered', post=self.post, user=self.user, parent=first)])
+        buffered = Comment.objects.get(text='buffered')
+        self.assertEqual(buffered.path, first.path + path_segment(buffered.pk))
+
+        top = Comment.objects.create(text='top', post=self.post, user=self.user)
+        Comment.objects.bulk_create([Comment(pk=top.pk + 1, text='a', post=self.post, user=self.user, parent=top),
+                                     Comment(pk=top.pk + 2, text='b', post=self.post, user=self.user, parent_id=top.pk + 1)])
+        Comment.objects.filter(pk=top.pk).update(path='')
+        self.assertEqual(Comment.fill_paths(), 3)
+        self.assertEqual([c.text for c in top.subtree()], ['top', 'a', 'b'])
+
+
+class SearchTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('frank', password='pw')
+        cls.blog = Blog.objects.create(name='frank blog', user=cls.user)
+        cls.in_body = Post.objects.create(title='notes', body='all about <b>sourdough</b> starters', blog=cls.blog, author=cls.user)
+        cls.in_title = Post.objects.create(title='Sourdough', body='flour and water', blog=cls.blog, author=cls.user)
+        Post.objects.bulk_create(Post(title='bread %d' % i, body='rye bread', blog=cls.blog, author=cls.user) for i in range(25))
+
+    def test_title_matches_rank_first_and_snippets_are_escaped(self):
+        page = search_posts('sourdough')
+        self.assertEqual([post.pk for post in page], [self.in_title.pk, self.in_body.pk])
+        self.assertIn('&lt;b&gt;<mark>sourdough</mark>&lt;/b&gt;', page.object_list[1].snippet)
+
+    def test_index_follows_updates_and_bulk_inserts(self):
+        self.assertEqual(len(search_posts('rye', per_page=100)), 25)
+        Post.objects.filter(pk=self.in_title.pk).update(body='now with rye')
+        self.assertEqual(len(search_posts('rye', per_page=100)), 26)
+
+    def test_search_view_paginates_on_rank_cursor(self):
+        response = self.client.get(reverse('search'), {'q': 'bread'})
+        first = [post.pk for post in response.context['post_list']]
+        response = self.client.get(reverse('search'), {'q': 'bread', 'after': response.context['page_obj'].next_cursor})
+        second = [post.pk for post in response.context['post_list']]
+        self.assertEqual((len(first), len(second)), (20, 5))
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'bread', 'after': 'junk'}).status_code, 404)
+
+    def test_query_syntax_is_not_injected(self):
+        self.assertEqual(list(search_posts('sourdough" * (')), list(search_posts('sourdough')))
+        self.assertEqual(list(search_posts('rye OR NEAR(')), [])
+
+
+class FragmentCacheTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('gina', password='pw')
+        cls.reader = User.objects.create_user('hank', password='pw')
+        cls.blog = Blog.objects.create(name='gina blog', user=cls.owner)
+        cls.post = Post.objects.create(title='cached', body='x', blog=cls.blog, author=cls.owner)
+        cls.other = Post.objects.create(title='other', body='y', blog=cls.blog, author=cls.owner)
+        cls.post_url = reverse('post-detail', kwargs={'blog_pk': cls.blog.pk, 'post_pk': cls.post.pk})
+        cls.other_url = reverse('post-detail', kwargs={'blog_pk': cls.blog.pk, 'post_pk': cls.other.pk})
+        cls.blog_url = reverse('blog-detail', kwargs={'blog_pk': cls.blog.pk})
+
+    def test_repeat_hits_skip_the_database(self):
+        fragment_stats.reset()
+        self.assertEqual(self.client.get(self.post_url)['X-Fragment-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.post_url)
+        self.assertEqual(response['X-Fragment-Cache'], 'hit')
+        self.assertContains(response, '<h1>cached</h1>', html=True)
+        self.assertEqual(fragment_stats.snapshot()['post-detail'], {'hits': 1, 'misses': 1})
+
+    def test_comment_invalidates_only_its_post(self):
+        for url in (self.post_url, self.other_url, self.blog_url):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(text='fresh comment', post=self.post, user=self.reader)
+        response = self.client.get(self.post_url)
+        self.assertEqual(response['X-Fragment-Cache'], 'miss')
+        self.assertContains(response, 'fresh comment')
+        self.assertEqual(self.client.get(self.other_url)['X-Fragment-Cache'], 'hit')
+        self.assertEqual(self.client.get(self.blog_url)['X-Fragment-Cache'], 'hit')
+
+    def test_new_post_invalidates_blog_listing(self):
+        self.client.get(self.blog_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='brand new', body='z', blog=self.blog, author=self.owner)
+        response = self.client.get(self.blog_url)
+        self.assertEqual(response['X-Fragment-Cache'], 'miss')
+        self.assertContains(response, 'brand new')
+
+    def test_per_user_parts_are_not_cached(self):
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(self.blog_url), 'create new post')
+        self.client.force_login(self.reader)
+        response = self.client.get(self.blog_url)
+        self.assertEqual(response['X-Fragment-Cache'], 'hit')
+        self.assertNotContains(response, 'create new post')
+
+
+@shared_cache
+class NavigationCacheTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('ivy', password='pw')
+        self.client.force_login(self.user)
+
+    def test_sidebar_blog_link_is_cached_and_invalidated(self):
+        self.assertContains(self.client.get(reverse('blog-list')), 'Create A Blog')
+        with self.assertNumQueries(1):  # the blog listing itself, session and user come from the cache
+            self.client.get(reverse('blog-list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blog = Blog.objects.create(name='ivy blog', user=self.user)
+        response = self.client.get(reverse('blog-list'))
+        self.assertContains(response, reverse('blog-detail', kwargs={'blog_pk': blog.pk}))
+        self.assertEqual(get_user_blog(self.user.pk), {'id': blog.pk, 'name': 'ivy blog'})
+
+    @override_settings(CACHE_SHARED=False)
+    def test_no_blog_is_not_cached_in_an_unshared_cache(self):
+        self.assertIsNone(get_user_blog(self.user.pk))
+        Blog.objects.bulk_create([Blog(name='ivy blog', user=self.user)])  # no signal, as in another process
+        self.assertEqual(get_user_blog(self.user.pk)['name'], 'ivy blog')
+
+    def test_user_without_blog_has_a_profile_page(self):
+        response = self.client.get(reverse('user-detail', kwargs={'user_pk': self.user.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['blog'])
+
+    def test_post_create_without_blog_redirects_to_blog_create(self):
+        response = self.client.post(reverse('post-create'), {'title': 't', 'body': 'b'})
+        self.assertRedirects(response, reverse('blog-create'))
+
+
+class ConditionalGetTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('jack', password='pw')
+        cls.blog = Blog.objects.create(name='jack blog', user=cls.user)
+        cls.post = Post.objects.create(title='etag me', body='x', blog=cls.blog, author=cls.user)
+        cls.post_url = reverse('post-detail', kwargs={'blog_pk': cls.blog.pk, 'post_pk': cls.post.pk})
+
+    def test_matching_etag_gets_304_without_queries(self):
+        for url in (self.post_url, reverse('blog-detail', kwargs={'blog_pk': self.blog.pk}),
+                    reverse('post-list'), reverse('blog-list')):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_last_modified_for_anonymous_pages(self):
+        last_modified = self.client.get(self.post_url)['Last-Modified']
+        response = self.client.get(self.post_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_and_users_get_new_etags(self):
+        anonymous = self.client.get(self.post_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(text='new', post=self.post, user=self.user)
+        response = self.client.get(self.post_url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(self.user)
+        response = self.client.get(self.post_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_new_session_gets_a_new_etag(self):
+        # The page's comment form carries the session's CSRF token
+        self.client.force_login(self.user)
+        etag = self.client.get(self.post_url)['ETag']
+        self.client.logout()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.post_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_unshared_cache_serves_no_fragments_or_validators(self):
+        response = self.client.get(self.post_url)
+        self.assertFalse(response.has_header('ETag'))
+        Post.objects.filter(pk=self.post.pk).update(title='no bump')  # no signal, as if changed by another process
+        self.assertContains(self.client.get(self.post_url), 'no bump')
+
+
+class FeedTests(BlogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('kate', password='pw')
+        cls.blog = Blog.objects.create(name='kate blog', user=cls.user)
+        cls.other = Blog.objects.create(name='other blog', user=User.objects.create_user('leo', password='pw'))
+        make_posts(cls.blog, 25)
+        Post.objects.create(title='elsewhere', body='x', blog=cls.other, author=cls.other.user)
+        cls.blog_feed = reverse('blog-feed', kwargs={'blog_pk': cls.blog.pk})
+
+    def test_feeds_list_latest_entries(self):
+        response = self.client.get(reverse('post-feed'))
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertEqual(response.content.count(b'<item>'), 20)
+        self.assertContains(response, 'elsewhere')
+
+        response = self.client.get(reverse('blog-feed-atom', kwargs={'blog_pk': self.blog.pk}))
+        self.assertEqual(response.content.count(b'<entry>'), 20)
+        self.assertNotContains(response, 'elsewhere')
+
+    def test_feed_is_cached_until_the_blog_changes(self):
+        etag = self.client.get(self.blog_feed)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.blog_feed)['X-Fragment-Cache'], 'hit')
+            self.assertEqual(self.client.get(self.blog_feed, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='breaking', body='news', blog=self.blog, author=self.user)
+        self.assertContains(self.client.get(self.blog_feed, HTTP_IF_NONE_MATCH=etag), 'breaking')
+
+    def test_unknown_blog_is_404(self):
+        self.assertEqual(self.client.get(reverse('blog-feed', kwargs={'blog_pk': 999})).status_code, 404)
+
+
+class ImportExportTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('erin', password='pw')
+        blog = Blog.objects.create(name='erin blog', user=self.user)
+        self.exported_blog = blog.pk
+        make_posts(blog, 3)
+        post = Post.objects.order_by('id').last()
+        one = Comment.objects.create(text='one', post=post, user=self.user)
+        Comment.objects.create(text='two', post=post, user=self.user, parent=one)
+        Comment.objects.update(posted_on=date(2020, 3, 1))
+        SiteStatistics.recompute()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'export.ndjson.gz')
+        call_command('blog_export', self.path, stderr=StringIO())
+        Blog.objects.all().delete()
+        Post.objects.all().delete()
+
+    def import_export(self, **options):
+        call_command('blog_import', self.path, batch_size=1, stderr=StringIO(), **options)
+
+    def test_round_trip_keeps_dates_and_rebuilds_counters(self):
+        self.import_export()
+        self.assertEqual(User.objects.count(), 1)  # matched by username
+        blog = Blog.objects.get()
+        self.assertEqual(blog.user, self.user)
+        self.assertEqual([p.posted_on for p in blog.post_set.order_by('id')], [date(2020, 1, 1), date(2020, 1, 1), date(2020, 1, 2)])
+        post = blog.post_set.order_by('id').last()
+        self.assertEqual(post.comment_count, 2)
+        self.assertEqual(set(post.comment_set.values_list('posted_on', flat=True)), {date(2020, 3, 1)})
+        one, two = post.comment_set.order_by('path')
+        self.assertEqual((two.parent, two.path), (one, one.path + path_segment(two.pk)))
+        stats = SiteStatistics.load()
+        self.assertEqual((stats.num_blogs, stats.num_posts, stats.num_comments), (1, 3, 2))
+        self.assertEqual(get_user_blog(self.user.pk)['id'], blog.pk)
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        original = blog_import.Command.import_batch
+
+        def fail_on_comments(command, name, records, replay=False):
+            if name == 'comment':
+                raise RuntimeError('interrupted')
+            original(command, name, records, replay)
+
+        with mock.patch.object(blog_import.Command, 'import_batch', fail_on_comments):
+            with self.assertRaises(RuntimeError):
+                self.import_export()
+        self.assertEqual((Post.objects.count(), Comment.objects.count()), (3, 0))
+        # The checkpoint doesn't grow with the import, only users matched by username are kept on the side
+        with open(self.path + '.checkpoint') as f:
+            self.assertEqual(set(json.load(f)), {'line', 'offsets'})
+        with open(self.path + '.checkpoint.users') as f:
+            self.assertEqual(f.read().split()[1], str(self.user.pk))
+
+        self.import_export()
+        self.assertEqual((Blog.objects.count(), Post.objects.count(), Comment.objects.count()), (1, 3, 2))
+        self.assertEqual(set(Comment.objects.values_list('user', flat=True)), {self.user.pk})
+        self.assertFalse(os.path.exists(self.path + '.checkpoint.users'))
+
+    def test_ids_taken_during_the_import_stop_it(self):
+        # Created on the site after the import picked its offsets, with the id the import assigns to the blog
+        original = blog_import.Command.load_checkpoint
+
+        def take_an_id(command, path, restart):
+            state = original(command, path, restart)
+            Blog.objects.create(pk=state['offsets']['blog'] + self.exported_blog, name='live', user=self.user)
+            return state
+
+        with mock.patch.object(blog_import.Command, 'load_checkpoint', take_an_id):
+            with self.assertRaisesMessage(CommandError, 'Could not insert blog(s)'):
+                self.import_export()
+        self.assertEqual(list(Blog.objects.values_list('name', flat=True)), ['live'])
+
+
+class SeedAndBenchmarkTests(BlogTestCase):
+
+    def test_seed_data_is_skewed_and_counted(self):
+        call_command('seed_data', users=20, blogs=10, posts=200, comments=1000, stdout=StringIO())
+        stats = SiteStatistics.load()
+        self.assertEqual((stats.num_users, stats.num_blogs, stats.num_posts, stats.num_comments), (20, 10, 200, 1000))
+        counts = sorted(Post.objects.values_list('comment_count', flat=True), reverse=True)
+        self.assertEqual(sum(counts), 1000)
+        self.assertGreater(counts[0], 10 * 1000 / 200)  # the most viral post gets far more than its share
+        self.assertEqual(stats.latest_post, Post.objects.order_by('-posted_on', '-id').first())
+
+    def test_bench_urls_fails_on_query_regression(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'baseline.json')
+        # Two requests are too few for stable timings, only query counts are compared here
+        options = {'requests': 2, 'warmup': 1, 'urls': ['index', 'post-detail'], 'tolerance': 1000, 'stdout': StringIO()}
+        call_command('bench_urls', scale=0.02, save_baseline=baseline, **options)
+        call_command('bench_urls', scale=0.02, baseline=baseline, **options)
+        self.assertIsNone(cache.get(version_key('posts', 'all')))  # nothing cached for the rolled back rows
+
+        with open(baseline) as f:
+            results = json.load(f)
+        results['index']['queries'] = 0
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        with self.assertRaisesMessage(CommandError, 'index'):
+            call_command('bench_urls', scale=0.02, baseline=baseline, **options)
+
+
+class DatabaseBackendTests(TestCase):
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64000)
+        self.assertTrue(connection.is_usable())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Router decisions only, the replica's lag is mocked so no database is touched."""
+
+    def setUp(self):
+        replica_health.reset()
+        self.router = PrimaryReplicaRouter()
+        patcher = mock.patch('blog.routers.replica_lag', return_value=0.5)
+        self.lag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_reads_go_to_the_replica_until_the_request_writes(self):
+        with request_routing():
+            self.assertEqual(self.router.db_for_read(Post), 'replica')
+            self.assertEqual(self.router.db_for_write(Comment), 'default')
+            self.assertEqual(self.router.db_for_read(Comment), 'default')
+
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.lag.return_value = 60
+        with request_routing():
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_write_pins_the_browser_to_the_primary(self):
+        def write(request):
+            self.router.db_for_write(Comment)
+            return HttpResponse()
+
+        response = ReadYourWritesMiddleware(write)(RequestFactory().post('/comments/create'))
+        cookie = response.cookies[ReadYourWritesMiddleware.cookie_name]
+
+        def read(request):
+            return HttpResponse(self.router.db_for_read(Post))
+
+        request = RequestFactory().get('/posts/')
+        request.COOKIES[cookie.key] = cookie.value
+        self.assertEqual(ReadYourWritesMiddleware(read)(request).content, b'default')
+        self.assertEqual(ReadYourWritesMiddleware(read)(RequestFactory().get('/posts/')).content, b'replica')
+
+    def test_recently_changed_pages_are_built_from_the_primary(self):
+        cache.clear()
+        request = RequestFactory().get('/posts/')
+        request.user = AnonymousUser()
+        with request_routing():
+            page_validators(request, [version_key('posts', 'all')])  # the version starts at the current time
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+
+class RenderedBodyTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('omar', password='pw')
+        self.blog = Blog.objects.create(name='omar blog', user=self.user)
+
+    def test_body_is_rendered_on_save(self):
+        post = Post.objects.create(title='t', body='<b>one</b>\n\ntwo ' + 'word ' * 50, blog=self.blog, author=self.user)
+        self.assertTrue(post.body_html.startswith('<p>&lt;b&gt;one&lt;/b&gt;</p>\n\n<p>two'))
+        self.assertTrue(post.excerpt.endswith('…'))
+        self.assertEqual(len(post.excerpt.split()), 30)
+
+    def test_list_views_do_not_load_bodies(self):
+        make_posts(self.blog, 3)
+        recorder = QueryRecorder()
+        with recorder.record():
+            self.client.get(reverse('post-list'))
+            self.client.get(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk}))
+        post_queries = [sql for sql in recorder.fingerprints if 'FROM "blog_post"' in sql]
+        self.assertTrue(post_queries)
+        for sql in post_queries:
+            self.assertNotIn('"blog_post"."body', sql)
+
+    def test_render_posts_backfills_old_rows(self):
+        make_posts(self.blog, 3)
+        Post.objects.update(body_html='', excerpt='')
+        keys = [version_key('posts', 'all'), version_key('blog', self.blog.pk)]
+        before = get_versions(*keys)
+        out = StringIO()
+        call_command('render_posts', stdout=out)
+        # The feeds show the new excerpts
+        self.assertNotEqual(get_versions(*keys)[0], before[0])
+        self.assertNotEqual(get_versions(*keys)[1], before[1])
+        self.assertIn('Rendered 3 post(s)', out.getvalue())
+        self.assertFalse(Post.objects.filter(body_html='').exists())
+        self.assertEqual(Post.objects.order_by('id').first().excerpt, 'body 0')
+
+    def test_render_posts_does_not_overwrite_concurrent_edits(self):
+        make_posts(self.blog, 2)
+        Post.objects.update(body_html='', excerpt='')
+        edited = Post.objects.order_by('id').first()
+        original = Post.render_body
+
+        def edit_while_rendering(post):
+            original(post)
+            if post.pk == edited.pk and post.body == edited.body:
+                Post.objects.filter(pk=post.pk).update(body='edited meanwhile')
+
+        with mock.patch.object(Post, 'render_body', edit_while_rendering):
+            call_command('render_posts', stdout=StringIO())
+        edited.refresh_from_db()
+        self.assertEqual((edited.body_html, edited.excerpt), ('<p>edited meanwhile</p>', 'edited meanwhile'))
+        self.assertFalse(Post.objects.filter(body_html='').exists())
+
+
+class AsyncUrls:
+    """URLconf with the async views in front of the regular ones, as blog/urls.py does when ASYNC_VIEWS is on."""
+    urlpatterns = [
+        path('', async_views.IndexView.as_view(), name='index'),
+        path('posts/', async_views.PostListView.as_view(), name='post-list'),
+        path('blog/<int:blog_pk>', async_views.BlogDetailView.as_view(), name='blog-detail'),
+        path('blog/<int:blog_pk>/post/<int:post_pk>', async_views.PostDetailView.as_view(), name='post-detail'),
+        path('accounts/', include('django.contrib.auth.urls')),
+        path('', include('blog.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(TransactionTestCase):
+    """The async views query from worker threads, which can't see the uncommitted data of a TestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('mia', password='pw')
+        self.blog = Blog.objects.create(name='mia blog', user=self.user)
+        self.post = Post.objects.create(title='async post', body='x', blog=self.blog, author=self.user)
+        Comment.objects.create(text='async comment', post=self.post, user=self.user)
+
+    async def test_async_views_render_the_same_pages(self):
+        post_url = reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': self.post.pk})
+        self.assertContains(await self.async_client.get(reverse('index')), 'async post')
+        self.assertContains(await self.async_client.get(reverse('post-list')), 'async post')
+        self.assertContains(await self.async_client.get(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk})), 'async post')
+        response = await self.async_client.get(post_url)
+        self.assertContains(response, 'async comment')
+
+    def test_async_conditional_get(self):
+        # The sync client adapts the async view, and unlike AsyncClient on Django 3.x it passes request headers
+        post_url = reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': self.post.pk})
+        etag = self.client.get(post_url)['ETag']
+        self.assertEqual(self.client.get(post_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    async def test_missing_objects_are_404(self):
+        response = await self.async_client.get(reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_middleware_chain_stays_async(self):
+        # With DEBUG on, Django logs every middleware it adapts between sync and async. Middleware that turns out to
+        # be disabled (MiddlewareNotUsed) is dropped again along with its adaptation.
+        with override_settings(DEBUG=True), self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+        adapted = {m.split()[2] for m in logs.output if m.endswith(' adapted.')}
+        unused = {m.split("'")[1] for m in logs.output if 'MiddlewareNotUsed' in m}
+        self.assertEqual(adapted - unused, set())
+
+
+class BufferedCommentTests(TransactionTestCase):
+    """The flusher writes from its own thread, which can't see the uncommitted data of a TestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('nina', password='pw')
+        self.blog = Blog.objects.create(name='nina blog', user=self.user)
+        self.post = Post.objects.create(title='busy post', body='x', blog=self.blog, author=self.user)
+
+    @override_settings(COMMENT_INGESTION='buffered')
+    def test_comment_is_visible_after_the_redirect(self):
+        self.client.get(reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': self.post.pk}))  # cache it
+        response = self.client.post(reverse('comment-create'), {'text': 'buffered hello', 'post': self.post.pk, 'user': self.user.pk}, follow=True)
+        self.assertContains(response, 'buffered hello')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(SiteStatistics.load().num_comments, 1)
+
+    def test_concurrent_comments_are_written_in_batches(self):
+        buffer = CommentBuffer(linger=0.2)
+        threads = [threading.Thread(target=buffer.submit, args=(Comment(text='c%d' % i, post=self.post),))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = buffer.stats()
+        self.assertEqual((stats['committed'], stats['depth']), (20, 0))
+        self.assertLess(stats['batches'], 20)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 20)
+
+    @override_settings(COMMENT_INGESTION='buffered')
+    def test_comment_not_committed_in_time_is_accepted(self):
+        buffer = CommentBuffer()
+        with mock.patch('blog.views.comment_buffer', buffer), mock.patch.object(buffer, 'submit', return_value=False):
+            response = self.client.post(reverse('comment-create'), {'text': 'slow', 'post': self.post.pk, 'user': self.user.pk})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['X-Comment-Queue-Depth'], '0')
+        self.assertFalse(Comment.objects.exists())  # left to the flusher, not saved a second time
+
+    @override_settings(COMMENT_INGESTION='buffered')
+    async def test_comments_are_saved_directly_under_asgi(self):
+        buffer = CommentBuffer()
+        with mock.patch('blog.views.comment_buffer', buffer), mock.patch.object(buffer, 'submit') as submit:
+            # Urlencoded by hand, AsyncClient on Django 3.x can't read back the multipart body it encodes
+            response = await self.async_client.post(
+                reverse('comment-create'), urlencode({'text': 'asgi', 'post': self.post.pk, 'user': self.user.pk}),
+                content_type='application/x-www-form-urlencoded')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(submit.called)
+        self.assertTrue(await sync_to_async(Comment.objects.filter(text='asgi').exists)())
+
+    def test_synchronous_comments_have_no_queue_header(self):
+        response = self.client.post(reverse('comment-create'), {'text': 'sync', 'post': self.post.pk, 'user': self.user.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('X-Comment-Queue-Depth', response)
+
+    @override_settings(COMMENT_INGESTION='buffered')
+    def test_full_buffer_applies_backpressure(self):
+        buffer = CommentBuffer(max_size=1)
+        buffer.queue.put(None)  # no flusher is running, so the buffer stays full
+        with mock.patch('blog.views.comment_buffer', buffer):
+            response = self.client.post(reverse('comment-create'), {'text': 'too late', 'post': self.post.pk, 'user': self.user.pk})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(buffer.stats()['rejected'], 1)
+        self.assertFalse(Comment.objects.exists())
+
+
+class ArchiveTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('pia', password='pw')
+        self.blog = Blog.objects.create(name='pia blog', user=self.user)
+        make_posts(self.blog, 70, start=date(2020, 1, 20))  # 35 days, January 20 to February 23
+        SiteStatistics.recompute()
+        MonthlyPostCount.recompute()
+
+    def counts(self, blog=None):
+        return dict(MonthlyPostCount.objects.filter(blog=blog).values_list('month', 'count'))
+
+    def test_counts_follow_posts(self):
+        self.assertEqual(self.counts(self.blog), {date(2020, 1, 1): 24, date(2020, 2, 1): 46})
+        other = Blog.objects.create(name='other blog', user=self.user)
+        post = Post.objects.create(title='new', body='x', blog=other, author=self.user)
+        month = post.posted_on.replace(day=1)
+        self.assertEqual(self.counts(other), {month: 1})
+        self.assertEqual(self.counts()[month], 1)
+        Post.objects.filter(blog=self.blog, posted_on__month=1).first().delete()
+        post.delete()
+        self.assertEqual(self.counts(self.blog)[date(2020, 1, 1)], 23)
+        self.assertEqual(self.counts(), {date(2020, 1, 1): 23, date(2020, 2, 1): 46, month: 0})
+
+    def test_month_and_year_archives(self):
+        response = self.client.get(reverse('blog-archive-month', kwargs={'blog_pk': self.blog.pk, 'year': 2020, 'month': 1}))
+        self.assertEqual(len(response.context['post_list']), 20)
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('blog-archive-month', kwargs={'blog_pk': self.blog.pk, 'year': 2020, 'month': 1}), {'after': cursor})
+        self.assertEqual([p.posted_on.month for p in response.context['post_list']], [1] * 4)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+        response = self.client.get(reverse('post-archive-year', kwargs={'year': 2020}))
+        self.assertContains(response, reverse('post-archive-month', kwargs={'year': 2020, 'month': 2}))
+        self.assertContains(response, 'February</a> (46)')
+        self.assertEqual(self.client.get(reverse('post-archive-year', kwargs={'year': 2019})).context['post_list'], [])
+
+    def test_invalid_periods_are_404(self):
+        self.assertEqual(self.client.get(reverse('post-archive-month', kwargs={'year': 2020, 'month': 13})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('blog-archive-year', kwargs={'blog_pk': 999, 'year': 2020})).status_code, 404)
+
+    def test_archive_is_a_range_scan(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            self.client.get(reverse('blog-archive-month', kwargs={'blog_pk': self.blog.pk, 'year': 2020, 'month': 2}))
+        sql = next(sql for sql in recorder.fingerprints if 'FROM "blog_post"' in sql and 'posted_on' in sql)
+        self.assertNotIn('django_date', sql)
+        plan = Post.objects.filter(blog=self.blog, posted_on__gte=date(2020, 2, 1), posted_on__lt=date(2020, 3, 1)).explain()
+        self.assertIn('post_blog_posted_on_id_idx', plan)
+
+    def test_blog_sidebar_lists_months(self):
+        response = self.client.get(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk}))
+        self.assertContains(response, reverse('blog-archive-month', kwargs={'blog_pk': self.blog.pk, 'year': 2020, 'month': 1}))
+        self.assertContains(response, 'January</a> (24)')
+
+
+class ProfilingTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        user = User.objects.create_user('quinn', password='pw')
+        make_posts(Blog.objects.create(name='quinn blog', user=user), 3)
+
+    def profiles(self, url_name):
+        path = os.path.join(self.directory, url_name)
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def test_sampled_requests_are_written_per_url_name(self):
+        with self.settings(PROFILING=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=self.directory):
+            response = self.client.get(reverse('post-list'))
+        self.assertTrue(response['X-Profile'].startswith('post-list' + os.sep))
+        self.assertEqual(len(self.profiles('post-list')), 1)
+
+    def test_only_signed_headers_force_a_profile(self):
+        with self.settings(PROFILING=True, PROFILE_SAMPLE_RATE=0, PROFILE_DIR=self.directory):
+            self.assertNotIn('X-Profile', self.client.get(reverse('post-list')))
+            self.assertNotIn('X-Profile', self.client.get(reverse('post-list'), HTTP_X_PROFILE='profile:forged:sig'))
+            self.assertIn('X-Profile', self.client.get(reverse('post-list'), HTTP_X_PROFILE=profile_token()))
+        self.assertEqual(len(self.profiles('post-list')), 1)
+
+    def test_report_ranks_functions_per_view(self):
+        with self.settings(PROFILING=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=self.directory):
+            for _ in range(2):
+                self.client.get(reverse('post-list'))
+            self.client.get(reverse('index'))
+            out = StringIO()
+            call_command('profile_report', url=['post-list'], limit=5, clear=True, stdout=out)
+        self.assertIn('post-list: 2 profile(s)', out.getvalue())
+        self.assertNotIn('index:', out.getvalue())
+        self.assertEqual(len(out.getvalue().splitlines()), 2 + 5 + 1)
+        self.assertEqual(self.profiles('post-list'), [])
+        self.assertEqual(len(self.profiles('index')), 1)
+
+
+class ActivityTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('vera', password='pw')
+        self.other = User.objects.create_user('will', password='pw')
+        self.blog = Blog.objects.create(name='vera blog', user=self.user)
+        self.post = Post.objects.create(title='hello world', body='x', blog=self.blog, author=self.user)
+        self.comment = Comment.objects.create(text='nice  post\nindeed', post=self.post, user=self.other)
+
+    def test_events_are_recorded_on_create(self):
+        events = list(Activity.objects.values_list('kind', 'user', 'blog', 'summary'))
+        self.assertEqual(events, [
+            ('comment', self.other.pk, self.blog.pk, 'nice post indeed'),
+            ('post', self.user.pk, self.blog.pk, 'hello world'),
+            ('blog', self.user.pk, self.blog.pk, 'vera blog'),
+        ])
+        self.post.title = 'edited'
+        self.post.save()
+        self.assertEqual(Activity.objects.count(), 3)  # append-only, edits are not events
+        self.comment.delete()
+        self.assertFalse(Activity.objects.filter(kind=Activity.COMMENT).exists())
+
+    def test_timelines_are_filtered_and_paginated(self):
+        for i in range(25):
+            Comment.objects.create(text='c%d' % i, post=self.post, user=self.other)
+        response = self.client.get(reverse('activity'))
+        self.assertContains(response, 'c24')
+        self.assertEqual(len(response.context['activity_list']), 20)
+        response = self.client.get(reverse('activity'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual([a.summary for a in response.context['activity_list']][-3:], ['nice post indeed', 'hello world', 'vera blog'])
+
+        response = self.client.get(reverse('user-activity', kwargs={'user_pk': self.user.pk}))
+        self.assertEqual([a.kind for a in response.context['activity_list']], ['post', 'blog'])
+        response = self.client.get(reverse('blog-activity', kwargs={'blog_pk': self.blog.pk}))
+        self.assertEqual(len(response.context['activity_list']), 20)
+        self.assertEqual(self.client.get(reverse('blog-activity', kwargs={'blog_pk': 999})).status_code, 404)
+
+    def test_timeline_is_one_range_scan(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            self.client.get(reverse('user-activity', kwargs={'user_pk': self.other.pk}))
+        self.assertEqual(len([sql for sql in recorder.fingerprints if 'blog_activity' in sql]), 1)
+        plan = Activity.objects.filter(user=self.other).order_by('-created', '-id').explain()
+        self.assertIn('activity_user_created_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_bulk_paths_record_events(self):
+        save_comments([Comment(text='bulk %d' % i, post=self.post, user=self.other) for i in range(3)])
+        events = Activity.objects.filter(summary__startswith='bulk')
+        self.assertEqual(sorted(events.values_list('comment__text', flat=True)), ['bulk 0', 'bulk 1', 'bulk 2'])
+        Activity.objects.all().delete()
+        Activity.backfill(blogs=Blog.objects.all(), posts=Post.objects.all(), comments=Comment.objects.all())
+        self.assertEqual(Activity.objects.count(), 1 + 1 + 4)
+
+
+class AdminTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('yuri', password='pw')
+        self.spammer = User.objects.create_user('zed', password='pw')
+        self.blog = Blog.objects.create(name='yuri blog', user=self.admin)
+        make_posts(self.blog, 4)
+        MonthlyPostCount.recompute()
+        self.post = Post.objects.order_by('id').first()
+        for i in range(3):
+            Comment.objects.create(text='spam %d' % i, post=self.post, user=self.spammer)
+        Comment.objects.create(text='ham', post=self.post, user=self.admin)
+        SiteStatistics.recompute()
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model, params=None):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.client.get(reverse('admin:blog_%s_changelist' % model), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, list(recorder.fingerprints)
+
+    def test_unfiltered_changelists_do_not_count_the_table(self):
+        for model, table in (('post', 'blog_post'), ('comment', 'blog_comment')):
+            response, queries = self.changelist_queries(model)
+            self.assertFalse([sql for sql in queries if 'COUNT(' in sql and table in sql], model)
+        self.assertEqual(response.context['cl'].result_count, 4)
+
+        response, _ = self.changelist_queries('post', {'blog': self.blog.pk, 'posted_on__gte': '2020-01-02'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response, _ = self.changelist_queries('comment', {'q': 'zed'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_change_forms_do_not_list_every_row(self):
+        comment = Comment.objects.first()
+        response = self.client.get(reverse('admin:blog_comment_change', args=[comment.pk]))
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertNotContains(response, '<option value="%d"' % self.post.pk)
+
+    def test_bulk_comment_delete_keeps_counters(self):
+        spam = list(Comment.objects.filter(user=self.spammer).values_list('pk', flat=True))
+        # Replies go with the comment they answer
+        reply = Comment.objects.create(text='reply', post=self.post, user=self.admin, parent_id=spam[0])
+        Comment.objects.create(text='reply to reply', post=self.post, user=self.admin, parent=reply)
+        data = {'action': 'delete_selected', '_selected_action': spam}
+        response = self.client.post(reverse('admin:blog_comment_changelist'), dict(data, index=0))
+        self.assertContains(response, 'Comments: 5')
+        self.assertContains(response, 'Activities: 5')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:blog_comment_changelist'), dict(data, post='yes'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)), ['ham'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(SiteStatistics.load().num_comments, 1)
+        self.assertFalse(Activity.objects.filter(user=self.spammer).exists())
+        entries = LogEntry.objects.filter(action_flag=DELETION, user=self.admin)
+        self.assertEqual(sorted(entries.values_list('object_id', flat=True)), sorted(map(str, spam)))
+        self.assertEqual(set(entries.values_list('object_repr', flat=True)), {'spam 0', 'spam 1', 'spam 2'})
+        self.assertNotContains(self.client.get(reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': self.post.pk})), 'spam')
+
+    def test_bulk_post_delete_across_the_filtered_changelist(self):
+        url = reverse('admin:blog_post_changelist') + '?posted_on__lt=2020-01-02'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'action': 'delete_selected', 'index': 0, 'select_across': 1, 'post': 'yes',
+                                   '_selected_action': [self.post.pk]})
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(sorted(LogEntry.objects.values_list('object_repr', flat=True)), ['post 0', 'post 1'])
+        stats = SiteStatistics.load()
+        self.assertEqual((stats.num_posts, stats.num_comments), (2, 0))
+        self.assertEqual(stats.latest_post, Post.objects.order_by('-posted_on', '-id').first())
+        self.assertEqual(MonthlyPostCount.objects.get(blog=self.blog).count, 2)
+        self.assertEqual(Activity.objects.filter(kind=Activity.COMMENT).count(), 0)
+        self.assertNotContains(self.client.get(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk})), 'post 0')
+
+
+class SnapshotTests(BlogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = directory.name
+        self.user = User.objects.create_user('xena', password='pw')
+        self.blog = Blog.objects.create(name='xena blog', user=self.user)
+        make_posts(self.blog, 3)
+        Post.objects.update(last_modified=date(2020, 1, 1))
+        SiteStatistics.recompute()
+        self.post = Post.objects.order_by('id').first()
+        self.post_url = reverse('post-detail', kwargs={'blog_pk': self.blog.pk, 'post_pk': self.post.pk})
+
+    def snapshot(self, **options):
+        out = StringIO()
+        call_command('snapshot', output=self.output, stdout=out, **options)
+        return out.getvalue()
+
+    def page(self, url):
+        with open(os.path.join(self.output, url.strip('/'), 'index.html')) as f:
+            return f.read()
+
+    def test_pages_are_written_for_anonymous_visitors(self):
+        self.assertIn('Rendered 6 of 6 pages', self.snapshot())
+        self.assertIn('post 0', self.page(self.post_url))
+        self.assertIn('xena blog', self.page(reverse('blog-list')))
+        self.assertIn('post 2', self.page(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk})))
+        self.assertIn('Login', self.page(reverse('post-list')))
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'posts', 'index.html.gz')))
+
+    def test_later_runs_render_only_what_changed(self):
+        self.snapshot()
+        self.assertIn('Rendered 0 of 6 pages', self.snapshot())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(text='first!', post=self.post, user=self.user)
+        self.assertIn('Rendered 1 of 6 pages', self.snapshot())
+        self.assertIn('first!', self.page(self.post_url))
+
+        self.post.title = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save()
+        self.assertIn('Rendered 3 of 6 pages', self.snapshot())  # the post, its blog and the post list
+        self.assertIn('renamed', self.page(reverse('blog-detail', kwargs={'blog_pk': self.blog.pk})))
+        self.assertIn('Rendered 6 of 6 pages', self.snapshot(full=True))
+
+    def test_edits_on_the_day_of_the_snapshot_are_picked_up(self):
+        self.post.body = 'edited today'
+        self.post.save()
+        self.assertEqual(self.post.last_modified, date.today())
+        self.snapshot()
+        self.assertIn('Rendered 1 of 6 pages', self.snapshot())
+
+    def test_deleted_posts_are_removed(self):
+        self.snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertIn('removed 1', self.snapshot())
+        self.assertFalse(os.path.exists(os.path.join(self.output, self.post_url.strip('/'))))
+        self.assertNotIn('post 0', self.page(reverse('post-list')))
+
+    def test_parallel_rendering(self):
+        self.assertIn('Rendered 6 of 6 pages', self.snapshot(workers=2))
+        self.assertIn('post 0', self.page(self.post_url))
+
+
+class StaticFilesTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        with override_settings(STATIC_ROOT=self.root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            self.index = StaticFileIndex()
+        self.hashed = json.load(open(os.path.join(self.root, 'staticfiles.json')))['paths']['css/styles.css']
+
+    def get(self, path, **environ):
+        application = StaticFilesWSGI(lambda environ, start_response: [b'django'], self.index)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'], response['headers'] = status, dict(headers)
+
+        body = b''.join(application(dict({'REQUEST_METHOD': 'GET', 'PATH_INFO': path}, **environ), start_response))
+        return response.get('status'), response.get('headers'), body
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        self.assertRegex(self.hashed, r'^css/styles\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.root, self.hashed + '.gz')))
+
+    def test_hashed_files_are_served_compressed_and_immutable(self):
+        status, headers, body = self.get('/static/' + self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', headers['Cache-Control'])
+        self.assertEqual(int(headers['Content-Length']), len(body))
+
+        status, headers, body = self.get('/static/' + self.hashed)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertIn(b'.sidebar', body)
+
+        status, _, body = self.get('/static/' + self.hashed, HTTP_IF_NONE_MATCH=headers['ETag'])
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+
+    def test_unhashed_and_unknown_paths(self):
+        _, headers, _ = self.get('/static/css/styles.css')
+        self.assertNotIn('immutable', headers['Cache-Control'])
+        self.assertEqual(self.get('/static/css/missing.css')[2], b'django')
+        self.assertEqual(self.get('/posts/')[2], b'django')
+
+    def test_templates_fall_back_to_unhashed_urls_without_a_manifest(self):
+        self.assertContains(self.client.get(reverse('login')), '/static/css/styles.css')
+
+    def test_production_storage_requires_a_manifest_entry(self):
+        with tempfile.TemporaryDirectory() as root, self.assertRaises(ValueError):
+            CompressedManifestStaticFilesStorage(location=root).url('css/styles.css')
+
+    def test_served_files_are_closed(self):
+        application = StaticFilesWSGI(lambda environ, start_response: [b'django'], self.index)
+        response = application({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/' + self.hashed}, lambda *args: None)
+        self.assertIn(b'.sidebar', b''.join(response))
+        response.close()  # as the WSGI server does after sending the body
+        self.assertTrue(response.filelike.closed)
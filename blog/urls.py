@@ -1,15 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, feeds
 from django.views.decorators.http import require_POST
 
+# Under ASGI the busiest read views are served by their async versions, see blog/async_views.py
+if settings.ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
+
 #app_name = 'blog'
 
 # Index and List views of Blogs, Users, and Posts
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
+    path('', read_views.IndexView.as_view(), name='index'),
     path('blogs/', views.BlogListView.as_view(), name='blog-list'),
     path('users/', views.UserListView.as_view(), name='user-list'),
-    path('posts/', views.PostListView.as_view(), name='post-list'),
+    path('posts/', read_views.PostListView.as_view(), name='post-list'),
+    path('search/', views.SearchView.as_view(), name='search'),
 ]
 
 urlpatterns += [
@@ -19,8 +27,24 @@ urlpatterns += [
 # Detail views of Users, Blogs, and Posts
 urlpatterns += [
     path('user/<int:user_pk>', views.UserDetailView.as_view(), name='user-detail'),
-    path('blog/<int:blog_pk>', views.BlogDetailView.as_view(), name='blog-detail'),
-    path('blog/<int:blog_pk>/post/<int:post_pk>', views.PostDetailView.as_view(), name='post-detail'),
+    path('blog/<int:blog_pk>', read_views.BlogDetailView.as_view(), name='blog-detail'),
+    path('blog/<int:blog_pk>/post/<int:post_pk>', read_views.PostDetailView.as_view(), name='post-detail'),
+    path('blog/<int:blog_pk>/post/<int:post_pk>/comments', views.PostCommentsView.as_view(), name='post-comments'),
+]
+
+# Activity timelines, site wide, per user and per blog
+urlpatterns += [
+    path('activity/', views.ActivityView.as_view(), name='activity'),
+    path('user/<int:user_pk>/activity', views.ActivityView.as_view(), name='user-activity'),
+    path('blog/<int:blog_pk>/activity', views.ActivityView.as_view(), name='blog-activity'),
+]
+
+# Year and month archives, site wide and per blog
+urlpatterns += [
+    path('posts/<int:year>/', views.PostArchiveView.as_view(), name='post-archive-year'),
+    path('posts/<int:year>/<int:month>/', views.PostArchiveView.as_view(), name='post-archive-month'),
+    path('blog/<int:blog_pk>/<int:year>/', views.PostArchiveView.as_view(), name='blog-archive-year'),
+    path('blog/<int:blog_pk>/<int:year>/<int:month>/', views.PostArchiveView.as_view(), name='blog-archive-month'),
 ]
 
 # Create views for Post and Blog
@@ -28,4 +52,12 @@ urlpatterns += [
     path('blogs/create', views.BlogCreateView.as_view(), name='blog-create'),
     path('posts/create', views.PostCreateView.as_view(), name='post-create'),
     path('comments/create', require_POST(views.CommentCreateView.as_view()), name='comment-create')
+]
+
+# RSS and Atom feeds of the latest posts
+urlpatterns += [
+    path('feeds/posts/', feeds.latest_posts_rss, name='post-feed'),
+    path('feeds/posts/atom/', feeds.latest_posts_atom, name='post-feed-atom'),
+    path('blog/<int:blog_pk>/feed/', feeds.blog_posts_rss, name='blog-feed'),
+    path('blog/<int:blog_pk>/feed/atom/', feeds.blog_posts_atom, name='blog-feed-atom'),
 ]
\ No newline at end of file
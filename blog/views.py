@@ -1,43 +1,55 @@
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.views import generic
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.forms import ModelForm
-
-from blog.models import Blog, Post, Comment
+from django.core.paginator import InvalidPage
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+
+from blog.models import Activity, Blog, Post, Comment, MonthlyPostCount, SiteStatistics
+from blog.cache import cached_fragment, get_user_blog, version_key, versioned_condition
 from blog.forms import RegistrationForm, CommentForm
+from blog.ingest import BufferFull, comment_buffer
+from blog.pagination import KeysetPaginationMixin, ThreadPaginator
+from blog.routers import note_write
+from blog.search import search_posts
 from django.contrib.auth.models import User
 
 from datetime import date
 
 class IndexView(generic.TemplateView):
-    """Index view to display basic statistics of the website. Makes use of overriding the get_context_data method of superclass."""
+    """Index view to display basic statistics of the website. Makes use of overriding the get_context_data method of superclass.
+    The statistics are read from the denormalized SiteStatistics row rather than counted on every hit."""
     template_name = 'index.html'
     
     def get_context_data(self, **kwargs):
         """Override get_context_data() to be able to add additional items in the context dict to be available on the template"""
         context = super().get_context_data(**kwargs) # Need to call and set using parent method first
 
-        num_blogs = Blog.objects.all().count()
-        num_users = User.objects.all().count() - 1
-        num_posts = Post.objects.all().count()
-        try:
-            latest_post = Post.objects.latest('posted_on')
-        except Post.DoesNotExist:
-            latest_post = None
+        stats = self.get_statistics()
 
         context.update({
-            'num_blogs': num_blogs,
-            'num_users': num_users,
-            'num_posts': num_posts,
-            'latest_post': latest_post,
+            'num_blogs': stats.num_blogs,
+            'num_users': stats.num_users - 1,
+            'num_posts': stats.num_posts,
+            'num_comments': stats.num_comments,
+            'latest_post': stats.latest_post,
             'title': 'index',
         })
 
         return context
 
+    def get_statistics(self):
+        return SiteStatistics.load()
 
+
+@method_decorator(versioned_condition(lambda **kwargs: [version_key('blogs', 'all')]), name='dispatch')
 class BlogListView(generic.ListView):
     """List view for displaying all the blogs."""
     model = Blog
@@ -65,8 +77,8 @@ class UserListView(generic.ListView):
         })
         return context
 
-class UserDetailView(generic.DetailView):
-    """Detail view for an individual user."""
+class UserDetailView(KeysetPaginationMixin, generic.DetailView):
+    """Detail view for an individual user, lists the posts of their blog a page at a time."""
     model = User
     template_name = 'user_detail.html'
 
@@ -76,71 +88,301 @@ class UserDetailView(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        blog = get_user_blog(self.user.pk)
+        posts = Post.objects.filter(blog=blog['id']).only(*Post.LIST_FIELDS) if blog else Post.objects.none()
+        paginator, page = self.paginate_keyset(posts)
 
         context.update({
             'title': self.request.user.username,
-            'blog': Blog.objects.get(user=self.user)
+            'blog': blog,
+            'post_list': page.object_list,
+            'page_obj': page,
         })
         return context
 
 
-class PostListView(generic.ListView):
-    """List view of all posts across."""
+@method_decorator(versioned_condition(lambda **kwargs: [version_key('posts', 'all')]), name='dispatch')
+class PostListView(KeysetPaginationMixin, generic.ListView):
+    """List view of all posts across, newest first and paginated by (posted_on, id) cursor."""
     model = Post
     template_name = 'post_list.html'
 
+    def get_queryset(self):
+        return Post.objects.select_related('author').only(*Post.LIST_FIELDS, 'author__username')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        context.update({
+            'title': 'all posts',
+            'archive_sidebar': archive_sidebar(),
+        })
+        return context
+
+
+def archive_sidebar(blog_pk=None):
+    """Sidebar links to the months with posts, newest first, with their post counts. Site wide unless `blog_pk` is
+    given. Read from MonthlyPostCount and rendered once into a fragment cached until a post of the blog changes."""
+    version = version_key('blog', blog_pk) if blog_pk else version_key('posts', 'all')
+
+    def render():
+        counts = MonthlyPostCount.objects.filter(blog=blog_pk, count__gt=0).order_by('-month')
+        return render_to_string('archive_months.html', {'archive_months': counts.values('month', 'count'), 'blog_pk': blog_pk})
+
+    html, hit = cached_fragment('archive-sidebar', [version], render)
+    return mark_safe(html)
+
+
+def archive_version_keys(blog_pk=None, **kwargs):
+    return [version_key('blog', blog_pk) if blog_pk else version_key('posts', 'all')]
+
+
+@method_decorator(versioned_condition(archive_version_keys), name='dispatch')
+class PostArchiveView(KeysetPaginationMixin, generic.ListView):
+    """Posts of one year, or one month if the URL has a month, across the site or of one blog if it has a blog_pk.
+    Selects a posted_on range rather than extracting the year and month, so the (posted_on, id) and
+    (blog, posted_on, id) indexes make every page a range scan."""
+    model = Post
+    template_name = 'post_archive.html'
+
+    def get(self, request, *args, **kwargs):
+        year, month = kwargs['year'], kwargs.get('month')
+        try:
+            if month is None:
+                self.start, self.end = date(year, 1, 1), date(year + 1, 1, 1)
+            else:
+                self.start, self.end = date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+        except ValueError:
+            raise Http404('No such month.')
+        self.blog = None
+        if 'blog_pk' in kwargs:
+            self.blog = get_object_or_404(Blog.objects.only('id', 'name'), pk=kwargs['blog_pk'])
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        posts = Post.objects.filter(posted_on__gte=self.start, posted_on__lt=self.end)
+        if self.blog is not None:
+            posts = posts.filter(blog=self.blog.pk)
+        return posts.select_related('author').only(*Post.LIST_FIELDS, 'author__username')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        period = self.start.strftime('%B %Y' if 'month' in self.kwargs else '%Y')
+
+        context.update({
+            'title': '%s - %s' % (self.blog.name, period) if self.blog else 'posts from %s' % period,
+            'blog': self.blog,
+            'archive_sidebar': archive_sidebar(self.blog.pk if self.blog else None),
+        })
+        return context
+
+
+class ActivityView(KeysetPaginationMixin, generic.ListView):
+    """What's new: the activity timeline of the whole site, or of one user or blog (user_pk / blog_pk in the URL),
+    newest first. Each page is one range scan over an Activity index, however large the source tables grow."""
+    model = Activity
+    template_name = 'activity.html'
+    keyset_ordering = ('-created', '-id')
+
+    def get(self, request, *args, **kwargs):
+        self.owner = None
+        if 'user_pk' in kwargs:
+            self.owner = get_object_or_404(User.objects.only('username'), pk=kwargs['user_pk'])
+        elif 'blog_pk' in kwargs:
+            self.owner = get_object_or_404(Blog.objects.only('name'), pk=kwargs['blog_pk'])
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        activities = Activity.objects.select_related('user').only(
+            'kind', 'created', 'user__username', 'blog', 'post', 'summary')
+        if 'user_pk' in self.kwargs:
+            return activities.filter(user=self.kwargs['user_pk'])
+        if 'blog_pk' in self.kwargs:
+            return activities.filter(blog=self.kwargs['blog_pk'])
+        return activities
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.owner is None:
+            title = 'activity'
+        else:
+            title = '%s - activity' % (self.owner.username if 'user_pk' in self.kwargs else self.owner.name)
+
+        context.update({
+            'title': title,
+        })
+        return context
+
+
+class SearchView(generic.TemplateView):
+    """Full text search over post titles and bodies, best matches first with highlighted snippets."""
+    template_name = 'search.html'
+    paginate_by = 20
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        try:
+            page = search_posts(query, self.paginate_by, self.request.GET.get('after'))
+        except InvalidPage as e:
+            raise Http404(str(e))
 
         context.update({
-            'title': 'all posts'
+            'title': 'search',
+            'query': query,
+            'post_list': page.object_list,
+            'page_obj': page,
         })
         return context
 
 
-class PostDetailView(generic.DetailView):
+@method_decorator(versioned_condition(lambda post_pk, **kwargs: [version_key('post', post_pk)]), name='dispatch')
+class PostDetailView(KeysetPaginationMixin, generic.DetailView):
     """Detail view for an individual post, also displays comments on the post.
     Acts as a ListCreateView for comments by displaying the CommentForm below the comments.
     Initial values for the 'user' and 'post' field in the CommentForm are set in this view using the corresponding context data
-    When the form is submitted it will post to the CommentCreateView which only accepts POST requests """
+    When the form is submitted it will post to the CommentCreateView which only accepts POST requests
+    Comments are shown as threads, oldest first, a page of top-level comments with all of their replies at a time.
+    Further pages are fetched from PostCommentsView. ?reply=<comment id> points the form at that comment.
+    The post and its comments are rendered once into a fragment cached until the post's version is bumped."""
     model = Post
     template_name = 'post_detail.html'
+    fragment_template_name = 'post_detail_fragment.html'
+    paginate_by = 50
+
+    def get(self, request, *args, **kwargs):
+        fragment, hit = cached_fragment('post-detail', [version_key('post', kwargs['post_pk'])], self.render_fragment,
+                                        variant=request.GET.get(self.cursor_kwarg, ''))
+        return self.fragment_response(fragment, hit)
+
+    def fragment_response(self, fragment, hit):
+        initial = {
+            'post': self.kwargs['post_pk'],
+            'user': self.request.user,
+            'parent': self.request.GET.get('reply'),
+        }
+        response = self.render_to_response({
+            'view': self,
+            'fragment': mark_safe(fragment['html']),
+            'form': CommentForm(initial=initial),
+            'title': fragment['title'],
+        })
+        response['X-Fragment-Cache'] = 'hit' if hit else 'miss'
+        return response
+
+    def render_fragment(self):
+        self.object = self.get_object()
+        self.comment_page = self.get_comment_page()
+        return self.build_fragment()
+
+    def build_fragment(self):
+        """Render the parts of the page that are the same for every visitor. No request is passed so no per-user data leaks in."""
+        context = self.get_context_data(object=self.object)
+        return {'title': self.post.title, 'html': render_to_string(self.fragment_template_name, context)}
+
+    def get_comment_page(self):
+        paginator, page = self.paginate_keyset(Comment.objects.filter(post=self.kwargs['post_pk']).select_related('user'))
+        return page
+
+    def get_keyset_paginator(self, queryset, per_page):
+        return ThreadPaginator(queryset, per_page)
 
     def get_object(self, **kwargs):
         """Override get_object() method to return the correct post. Needed b/c of "view must be called with either an object pk or a slug in the urlconf" error."""
-        self.post = get_object_or_404(Post, pk=self.kwargs['post_pk']) # Set post as an instance variable because it is used in get_context_data to pass the post to the CommentForm
+        self.post = get_object_or_404(Post.objects.select_related('author').defer('body'), pk=self.kwargs['post_pk']) # Set post as an instance variable because it is used in get_context_data to pass the post to the CommentForm
         return self.post
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        initial = {
-            'post': self.post,
-            'user': self.request.user,
-        }
         context.update({
-            'form': CommentForm(initial=initial),
-            'title': self.post.title,
+            'comment_list': self.comment_page.object_list,
+            'page_obj': self.comment_page,
         })
         return context
 
+
+class PostCommentsView(KeysetPaginationMixin, generic.ListView):
+    """Renders one page of a post's comment threads as an HTML fragment, used by the "load more" link on PostDetailView."""
+    template_name = 'comment_list.html'
+    paginate_by = PostDetailView.paginate_by
+    get_keyset_paginator = PostDetailView.get_keyset_paginator
+
+    def get_queryset(self):
+        return Comment.objects.filter(post=self.kwargs['post_pk']).select_related('user')
+
 class CommentCreateView(generic.edit.FormView):
     """View used to create comments on Posts.
     Redirects to PostDetail view with list of comments"""
     form_class = CommentForm
 
     def form_valid(self, form):
+        # Buffered ingestion is WSGI only: under ASGI this sync view runs on the one thread Django shares between
+        # all sync code, which the wait for the batch would hold up
+        if getattr(settings, 'COMMENT_INGESTION', 'sync') == 'buffered' and not isinstance(self.request, ASGIRequest):
+            # Written in a batch with other requests' comments, see blog/ingest.py
+            self.comment = form.save(commit=False)
+            try:
+                committed = comment_buffer.submit(self.comment, timeout=getattr(settings, 'COMMENT_COMMIT_WAIT', 2.0))
+            except BufferFull:
+                response = HttpResponse('Too many comments are being posted right now, please try again.', status=503)
+                response['Retry-After'] = '1'
+                return response
+            note_write()  # the flusher thread writes it, keep this user's next reads on the primary
+            if not committed:
+                # Still queued and written later, saving it here as well would post it twice. The post page
+                # wouldn't show it yet, so say so instead of redirecting there.
+                response = HttpResponse('Your comment was received and will appear shortly.', status=202)
+            else:
+                response = super().form_valid(form)
+            response['X-Comment-Queue-Depth'] = str(comment_buffer.queue.qsize())
+            return response
         self.comment = form.save()
         return super().form_valid(form)
 
-    def get_success_url(self): 
-        return reverse('post-detail', kwargs={'blog_pk': self.comment.post.blog.id, 'post_pk': self.comment.post.id})
+    def get_success_url(self):
+        # The post was loaded when the form validated it, use it as is rather than querying the post and its blog again
+        post = self.comment.post
+        return reverse('post-detail', kwargs={'blog_pk': post.blog_id, 'post_pk': post.pk})
 
 
 
-class BlogDetailView(generic.DetailView):
-    """Detail view of a single blog, displays all posts ordered by their posted date."""
+@method_decorator(versioned_condition(lambda blog_pk, **kwargs: [version_key('blog', blog_pk)]), name='dispatch')
+class BlogDetailView(KeysetPaginationMixin, generic.DetailView):
+    """Detail view of a single blog, displays its posts ordered by their posted date a page at a time.
+    The post listing is a cached fragment keyed on the blog's version, which every new or edited post bumps."""
     model = Blog
     template_name = 'blog_detail.html'
+    fragment_template_name = 'blog_detail_fragment.html'
+
+    def get(self, request, *args, **kwargs):
+        fragment, hit = cached_fragment('blog-detail', [version_key('blog', kwargs['blog_pk'])], self.render_fragment,
+                                        variant=request.GET.get(self.cursor_kwarg, ''))
+        self.archive_sidebar = archive_sidebar(kwargs['blog_pk'])
+        return self.fragment_response(fragment, hit)
+
+    def fragment_response(self, fragment, hit):
+        response = self.render_to_response({
+            'view': self,
+            'fragment': mark_safe(fragment['html']),
+            'owner_id': fragment['owner_id'],
+            'title': fragment['title'],
+            'archive_sidebar': self.archive_sidebar,
+        })
+        response['X-Fragment-Cache'] = 'hit' if hit else 'miss'
+        return response
+
+    def render_fragment(self):
+        self.object = self.get_object()
+        self.post_page = self.get_post_page()
+        return self.build_fragment()
+
+    def build_fragment(self):
+        context = self.get_context_data(object=self.object)
+        return {'title': self.blog.name, 'owner_id': self.blog.user_id, 'html': render_to_string(self.fragment_template_name, context)}
+
+    def get_post_page(self):
+        paginator, page = self.paginate_keyset(Post.objects.filter(blog=self.kwargs['blog_pk']).only(*Post.LIST_FIELDS))
+        return page
 
     def get_object(self, **kwargs):
         self.blog = get_object_or_404(Blog, pk=self.kwargs['blog_pk'])
@@ -150,7 +392,8 @@ class BlogDetailView(generic.DetailView):
         context = super().get_context_data(**kwargs)
 
         context.update({
-            'title': self.blog.name
+            'post_list': self.post_page.object_list,
+            'page_obj': self.post_page,
         })
         return context
 
@@ -161,11 +404,9 @@ class RegisterView(generic.edit.FormView):
     #success_url = 'blog:index'
 
     def form_valid(self, form):
-        form.save()
-        username = form.cleaned_data.get('username')
-        raw_password = form.cleaned_data.get('password1')
-        user = authenticate(username=username, password=raw_password)
-        login(self.request, user), 
+        # The password was just hashed by save(), log the new user in without hashing it again through authenticate()
+        user = form.save()
+        login(self.request, user)
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -195,14 +436,17 @@ class PostCreateView(generic.edit.CreateView):
 
     def form_valid(self, form):
         self.post = form.save(commit=False)
-        self.post.author = User.objects.get(id=self.request.user.id)
-        self.post.blog = Blog.objects.get(user=self.request.user.id)
+        self.post.author = self.request.user  # already loaded by AuthenticationMiddleware
+        blog = get_user_blog(self.request.user.pk)
+        if blog is None:
+            return redirect('blog-create')
+        self.post.blog_id = blog['id']
         self.post.posted_on = date.today()
         self.post.save()
         return super().form_valid(form)
 
     def get_success_url(self):
-        return reverse('post-detail', kwargs={'blog_pk': self.post.blog.id, 'post_pk': self.post.id})
+        return reverse('post-detail', kwargs={'blog_pk': self.post.blog_id, 'post_pk': self.post.id})
 
 
 class BlogCreateView(generic.edit.CreateView):
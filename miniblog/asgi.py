@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'miniblog.settings')
+os.environ.setdefault('MINIBLOG_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+from miniblog.static import StaticFilesASGI  # noqa: E402, needs the settings module
+
+# Collected static files are served ahead of Django, precompressed and with far-future caching
+application = StaticFilesASGI(get_asgi_application())
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,10 +38,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'blog',
+    'blog.apps.BlogConfig',
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.ProfilingMiddleware',
+    'blog.middleware.QueryCountMiddleware',
+    'blog.middleware.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'blog.middleware.HashingBusyMiddleware',
 ]
 
 ROOT_URLCONF = 'miniblog.urls'
@@ -64,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'blog.context_processors.navigation',
             ],
         },
     },
@@ -75,14 +81,93 @@ WSGI_APPLICATION = 'miniblog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# miniblog.sqlite3 is the stock backend plus per-connection pragmas and IMMEDIATE transactions, see its docstring.
+# WAL lets readers carry on while a comment is being written, and writers queue on busy_timeout instead of failing.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'miniblog.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('MINIBLOG_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 5,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'wal',
+                'synchronous': 'normal',  # durable across application crashes, a power loss may drop the last commits
+                'busy_timeout': 5000,
+                'cache_size': -64000,  # KiB
+                'mmap_size': 256 * 1024 * 1024,
+                'temp_store': 'memory',
+            },
+        },
     }
 }
 
 
+# Read replicas, see blog/routers.py. MINIBLOG_REPLICA_DB names an SQLite file that stands in for a replica locally,
+# `manage.py replicate` keeps it in sync with the primary. A real replica is added to DATABASES and
+# DATABASE_REPLICAS the same way, with `manage.py replicate --heartbeat-only` running against the primary.
+
+DATABASE_ROUTERS = ['blog.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+if os.environ.get('MINIBLOG_REPLICA_DB'):
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=os.environ['MINIBLOG_REPLICA_DB'], TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica')
+
+REPLICA_MAX_LAG = 5  # seconds
+REPLICA_CHECK_INTERVAL = 1  # seconds between heartbeat checks of each replica
+READ_YOUR_WRITES_SECONDS = 5
+
+
+# Caching
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# MINIBLOG_CACHE picks the backend for page fragments and version counters (blog/cache.py): locmem, file or redis.
+# Version bumps have to reach every worker process, so the default is the file cache, which the processes of one
+# host share. locmem is private to each process: with it CACHE_SHARED is off and pages are neither served from
+# fragments nor revalidated with 304s. The test runner is a single process, where locmem is shared.
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'miniblog',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('MINIBLOG_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+TESTING = sys.argv[1:2] == ['test']
+
+CACHE_BACKEND = os.environ.get('MINIBLOG_CACHE', 'locmem' if TESTING else 'file')
+CACHE_SHARED = CACHE_BACKEND != 'locmem' or TESTING
+
+CACHES = {
+    'default': CACHE_BACKENDS[CACHE_BACKEND],
+}
+
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+USER_BLOG_CACHE_TIMEOUT = 60 * 5
+
+# With a cache shared by every worker process, sessions are read from the cache and written through to the database,
+# and session users are resolved through an in-process LRU validated against version counters in the cache
+# (blog/auth.py), so logged-in requests don't query for either. locmem and file caches are private to a process or a
+# host: a logout or password change in one process would leave the session or user cached in the others, so with
+# those sessions and users are read from the database.
+if CACHE_BACKEND == 'redis':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    AUTHENTICATION_BACKENDS = ['blog.auth.CachedModelBackend']
+
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -102,6 +187,19 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashes are computed on a bounded pool of threads (blog/hashing.py) so login and sign-up storms can't
+# starve page rendering. More than PASSWORD_HASHING_QUEUE running or waiting hashes are refused with a 503.
+PASSWORD_HASHERS = [
+    'blog.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_HASHING_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PASSWORD_HASHING_QUEUE = 32
+PASSWORD_HASHING_TIMEOUT = 10.0  # seconds a request waits for its hash
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -121,10 +219,46 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Project wide assets, app assets live in each app's static/ directory. collectstatic fails on a missing directory.
 STATICFILES_DIRS = [
-    os.path.join(BASE_DIR, "static"),
-    #'/var/www/static/',
+    directory for directory in [
+        os.path.join(BASE_DIR, "static"),
+        #'/var/www/static/',
+    ] if os.path.isdir(directory)
 ]
 
+# collectstatic writes content hashed, precompressed copies here, served by the layer in miniblog/static.py
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# The test suite doesn't run collectstatic, so its storage links unhashed names for files missing from the manifest
+STATICFILES_STORAGE = 'miniblog.static.%s' % (
+    'TestStaticFilesStorage' if TESTING else 'CompressedManifestStaticFilesStorage')
+
+# Serve the read-heavy views with their async implementations (blog/async_views.py). Set by miniblog/asgi.py.
+ASYNC_VIEWS = os.environ.get('MINIBLOG_ASYNC_VIEWS', '0') == '1'
+
+# Per-request query instrumentation, see blog/middleware.py. Cheap enough to leave on in production.
+QUERY_INSTRUMENTATION = os.environ.get('MINIBLOG_QUERY_INSTRUMENTATION', '0') == '1'
+QUERY_REPEAT_THRESHOLD = 5
+
+# Sampling profiler, see ProfilingMiddleware in blog/middleware.py and the profile_report command. Profiles one
+# request in PROFILE_SAMPLE_RATE (0 for none) plus requests with a signed X-Profile header.
+PROFILING = os.environ.get('MINIBLOG_PROFILING', '0') == '1'
+PROFILE_SAMPLE_RATE = int(os.environ.get('MINIBLOG_PROFILE_SAMPLE_RATE', 100))
+PROFILE_DIR = os.environ.get('MINIBLOG_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+# Static HTML copies of the blog and post pages for the front proxy to serve to anonymous visitors, written by the
+# snapshot command.
+SNAPSHOT_DIR = os.environ.get('MINIBLOG_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshot'))
+
+# Comment ingestion: 'sync' saves each comment in its own request, 'buffered' group commits comments from concurrent
+# requests in batches through a bounded buffer (blog/ingest.py). WSGI only, comments are saved one by one under ASGI.
+COMMENT_INGESTION = os.environ.get('MINIBLOG_COMMENT_INGESTION', 'sync')
+COMMENT_BUFFER_SIZE = 1000
+COMMENT_BATCH_SIZE = 200
+COMMENT_BATCH_LINGER = 0.005  # seconds the flusher waits for more comments to join a batch
+COMMENT_COMMIT_WAIT = 2.0  # seconds a request waits for its batch before redirecting anyway
+
 LOGIN_REDIRECT_URL = 'index'
-LOGOUT_REDIRECT_URL = 'index'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'index'
@@ -0,0 +1,49 @@
+"""SQLite database backend tuned for serving a website: ENGINE = 'miniblog.sqlite3'.
+
+Two extra OPTIONS are understood on top of the stock backend's:
+
+pragmas           PRAGMA name -> value, applied to every new connection (WAL journaling, busy timeout, caches...).
+transaction_mode  'DEFERRED', 'IMMEDIATE' or 'EXCLUSIVE'. With IMMEDIATE an atomic block takes the write lock when it
+                  starts and waits up to busy_timeout for it, rather than failing with "database is locked" when
+                  a read inside the block has to be upgraded to a write while another connection is writing.
+
+CONN_HEALTH_CHECKS in the database settings makes a persistent connection run a trivial query before it is reused
+for a new request, and reconnect if that fails.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute('BEGIN %s' % self.transaction_mode)
+        else:
+            super()._start_transaction_under_autocommit()
+
+    def is_usable(self):
+        try:
+            self.connection.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and end of every request, so a connection that broke while idle is replaced up front
+        if (self.connection is not None and self.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not self.in_atomic_block and not self.is_usable()):
+            self.close()
+            return
+        super().close_if_unusable_or_obsolete()
@@ -0,0 +1,189 @@
+"""Production static files: content hashed names, precompressed variants and a serving layer in front of Django.
+
+`collectstatic` with CompressedManifestStaticFilesStorage copies every asset to STATIC_ROOT under a name containing
+a hash of its content (css/styles.3f2a9c1b.css) and writes .gz and, when the optional brotli package is installed, .br
+siblings of every compressible file. Templates link the hashed names through {% static %}, so a changed file gets
+a new URL and the old one can be cached forever.
+
+StaticFilesWSGI / StaticFilesASGI wrap the Django application (see miniblog/wsgi.py and miniblog/asgi.py) and answer
+requests under STATIC_URL themselves from an index of STATIC_ROOT built once at startup. They pick the smallest
+variant the client accepts and mark hashed files `immutable` for a year, so browsers and proxies never revalidate
+them. Everything else is passed through to Django.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+from wsgiref.util import FileWrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.map', '.ico', '.ttf', '.otf'}
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SHORT = 'public, max-age=60'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]  # in order of preference
+CHUNK_SIZE = 64 * 1024
+
+
+def compress(path):
+    """Write .gz and .br variants of the file at `path`, skipping any that wouldn't be noticeably smaller."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        if kwargs.get('dry_run'):
+            return
+        for name in set(self.hashed_files.values()):
+            path = self.path(name)
+            if os.path.splitext(name)[1] in COMPRESSIBLE and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                compress(path)
+
+
+class TestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """The storage under the test runner, which renders templates without running collectstatic first: files missing
+    from the manifest link their unhashed name. The production storage raises instead, so a deploy that skipped
+    collectstatic fails loudly (with DEBUG on, Django links unhashed names itself)."""
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            return StaticFilesStorage.url(self, name)
+
+
+class StaticFile:
+
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type and (content_type.startswith('text/') or content_type in ('application/javascript', 'application/json')):
+            content_type += '; charset=utf-8'
+        self.headers = [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Cache-Control', IMMUTABLE if immutable else SHORT),
+            ('Last-Modified', http_date(stat.st_mtime)),
+            # Weak, since the compressed variants share it
+            ('ETag', 'W/"%x-%x"' % (int(stat.st_mtime), stat.st_size)),
+        ]
+        self.variants = {None: (path, stat.st_size)}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self.variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+        if len(self.variants) > 1:
+            self.headers.append(('Vary', 'Accept-Encoding'))
+
+    def select(self, accept_encoding):
+        """(path, extra headers) of the best variant for an Accept-Encoding header value."""
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+        for encoding, _ in ENCODINGS:
+            if encoding in self.variants and encoding in accepted:
+                path, size = self.variants[encoding]
+                return path, self.headers + [('Content-Encoding', encoding), ('Content-Length', str(size))]
+        path, size = self.variants[None]
+        return path, self.headers + [('Content-Length', str(size))]
+
+    def not_modified(self, if_none_match):
+        return if_none_match and dict(self.headers)['ETag'] in if_none_match
+
+
+class StaticFileIndex:
+    """Every file under STATIC_ROOT by URL path, scanned once so serving a request never touches the filesystem
+    until the file is opened."""
+
+    def __init__(self, root=None, url=None):
+        self.root = root or settings.STATIC_ROOT
+        self.prefix = url or settings.STATIC_URL
+        self.files = {}
+        if not self.root or not os.path.isdir(self.root):
+            return
+        storage = CompressedManifestStaticFilesStorage(location=self.root)
+        hashed = set(storage.load_manifest().values())
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                self.files[posixpath.join(self.prefix, relative)] = StaticFile(path, relative in hashed)
+
+    def find(self, path):
+        return self.files.get(path) if path.startswith(self.prefix) else None
+
+
+class StaticFilesWSGI:
+
+    def __init__(self, application, index=None):
+        self.application = application
+        self.index = index or StaticFileIndex()
+
+    def __call__(self, environ, start_response):
+        static = self.index.find(environ.get('PATH_INFO', ''))
+        if static is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        if static.not_modified(environ.get('HTTP_IF_NONE_MATCH')):
+            start_response('304 Not Modified', [h for h in static.headers if h[0] in ('Cache-Control', 'ETag', 'Vary')])
+            return []
+        path, headers = static.select(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        # The server calls close() on either wrapper once the response is sent, which closes the file
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(path, 'rb'), CHUNK_SIZE)
+
+
+class StaticFilesASGI:
+
+    def __init__(self, application, index=None):
+        self.application = application
+        self.index = index or StaticFileIndex()
+
+    async def __call__(self, scope, receive, send):
+        static = self.index.find(scope['path']) if scope['type'] == 'http' else None
+        if static is None or scope['method'] not in ('GET', 'HEAD'):
+            return await self.application(scope, receive, send)
+        request_headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        if static.not_modified(request_headers.get('if-none-match')):
+            headers = [h for h in static.headers if h[0] in ('Cache-Control', 'ETag', 'Vary')]
+            await send({'type': 'http.response.start', 'status': 304, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        path, headers = static.select(request_headers.get('accept-encoding', ''))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        f = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+        try:
+            read = sync_to_async(f.read, thread_sensitive=False)
+            more = True
+            while more:
+                chunk = await read(CHUNK_SIZE)
+                more = len(chunk) == CHUNK_SIZE
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+        finally:
+            f.close()
+
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
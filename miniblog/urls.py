@@ -28,8 +28,4 @@ urlpatterns += [
     #path('', RedirectView.as_view(url='blog/')),
 ]
 
-# Use static() to add url mapping to serve static files during development (only)
-from django.conf import settings
-from django.conf.urls.static import static
-
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+# Static files are served by the staticfiles app under runserver and by miniblog/static.py in production
@@ -13,4 +13,7 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'miniblog.settings')
 
-application = get_wsgi_application()
+from miniblog.static import StaticFilesWSGI  # noqa: E402, needs the settings module
+
+# Collected static files are served ahead of Django, precompressed and with far-future caching
+application = StaticFilesWSGI(get_wsgi_application())